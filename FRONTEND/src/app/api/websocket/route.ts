@@ -16,6 +16,17 @@ interface MlPredictionResponse {
     erosion_rate_prediction?: number;
 }
 
+// Multi-hazard gateway (backend/gateway_app.py) serving every model from one origin
+const ML_GATEWAY_URL = process.env.ML_GATEWAY_URL ?? 'https://scx7v12m-8000.inc1.devtunnels.ms';
+
+// Gateway route for each threat type
+const ML_HAZARD_ROUTES: Record<string, string> = {
+    cyclone: 'cyclone',
+    stormSurge: 'storm',
+    pollution: 'pollution',
+    coastalErosion: 'coastal_erosion'
+};
+
 // In-memory store for active threat data
 const activeThreatData = new Map<string, ThreatData>();
 
@@ -40,7 +51,9 @@ async function getMlPrediction(threatType: string, data: any): Promise<MlPredict
     try {
         const mlPayload = prepareMlPayload(threatType, data);
 
-        const response = await fetch('https://scx7v12m-8000.inc1.devtunnels.ms/predict', {
+        const hazard = ML_HAZARD_ROUTES[threatType] ?? threatType;
+
+        const response = await fetch(`${ML_GATEWAY_URL}/predict/${hazard}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
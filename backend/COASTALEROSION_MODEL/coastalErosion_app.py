@@ -1,23 +1,30 @@
 # FASTAPI Coastal Erosion Prediction API
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List
 import numpy as np
-import pandas as pd
-import joblib
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import registry
+from micro_batching import MicroBatcher, batching_stats
+from prediction_cache import PredictionCache, cache_stats
+from csv_scoring import score_csv_upload, csv_matrix
+from serving_metrics import TimedRoute, metrics_for, metrics_response, clock
+from request_profiling import run_in_threadpool
+from wire_formats import batch_openapi, decode_columns, encode_predictions
 
-# Load the pre-trained model
-model_data = joblib.load("coastal_erosion_model.pkl")
-model = model_data["model"]
-scaler = model_data["scaler"]
-label_encoder = model_data["label_encoder"]
-feature_columns = model_data["feature_columns"]
-final_features = model_data.get("final_features", feature_columns)
+# Load the pre-trained model: a compiled forest with the scaler folded into its
+# thresholds, so inputs are passed in raw units. Predictions fetch the model from the
+# registry on every call, so newly activated versions are picked up live.
+registry.get("coastal_erosion")
 
 # Initialize FastAPI
 app = FastAPI(title="Coastal Erosion Prediction API")
+app.router.route_class = TimedRoute
+metrics = metrics_for("coastal_erosion")
 
 # Enable CORS
 app.add_middleware(
@@ -48,44 +55,120 @@ class CoastalErosionInput(BaseModel):
 # For batch predictions
 class CoastalErosionBatchInput(BaseModel):
     records: List[CoastalErosionInput]
+predict_batch_openapi = batch_openapi(CoastalErosionBatchInput)
+
+# Raw input order used to build feature matrices
+input_columns = list(CoastalErosionInput.__fields__)
 
 @app.get("/")
 def read_root():
     return {"message": "Coastal Erosion Prediction API is running. Use POST /predict or /predict_batch."}
 
+# Optional coalescing of concurrent /predict calls into one model call (MICRO_BATCHING=1)
+batcher = MicroBatcher.from_env(lambda rows: _versioned_results(np.vstack(rows)))
+
+# Optional cache of /predict results for repeated readings (PREDICTION_CACHE=1)
+cache = PredictionCache.from_env(input_columns, lambda: registry.get("coastal_erosion")["version"])
+
 @app.post("/predict")
-def predict(data: CoastalErosionInput):
-    return _predict_single(data)
-
-@app.post("/predict_batch")
-def predict_batch(data: CoastalErosionBatchInput):
-    results = []
-    for record in data.records:
-        result = _predict_single(record)
-        results.append(result)
-    return {"predictions": results}
-
-# Internal function to handle single prediction
-def _predict_single(data: CoastalErosionInput):
+async def predict(data: CoastalErosionInput):
+    started = clock()
     input_dict = data.dict()
-    df_input = pd.DataFrame([input_dict])
+    X = np.array([[input_dict[f] for f in input_columns]], dtype=float)
+    metrics.observe("features", started)
+    if cache is not None:
+        cached = cache.get(X[0])
+        if cached is not None:
+            return cached
+    if batcher is not None:
+        version, result = await batcher.submit(X)
+    else:
+        version, result = (await run_in_threadpool(_versioned_results, X))[0]
+    if cache is not None:
+        cache.put(X[0], result, version)
+    return result
+
+# Batch prediction endpoint: {"records": [...]} or one array per field, as JSON, MessagePack
+# or a float64 matrix; the response format follows Accept (see wire_formats.py)
+@app.post("/predict_batch", openapi_extra=predict_batch_openapi)
+async def predict_batch(request: Request):
+    body = await request.body()
+    return await run_in_threadpool(_predict_batch, request, body)
+
+def _predict_batch(request, body):
+    columns = decode_columns(request, body, input_columns, metrics=metrics)
+    started = clock()
+    rows = np.column_stack([columns[f] for f in input_columns])
+    metrics.observe("features", started)
+    model_data = registry.get("coastal_erosion")
+    label_classes = model_data["label_classes"]
+    predictions = _predict_rows(model_data, rows)
+    classes = {"risk_assessment_prediction": label_classes} if label_classes is not None else None
+    return encode_predictions(request, {"risk_assessment_prediction": predictions},
+                              lambda: _prediction_results(predictions), classes=classes, metrics=metrics)
+
+# Streamed CSV scoring: predictions come back chunk by chunk while the upload is still arriving
+@app.post("/predict_csv")
+async def predict_csv(request: Request):
+    return await score_csv_upload(request, input_columns, lambda columns: _predict_results(registry.get("coastal_erosion"), csv_matrix(columns, input_columns)))
+
+# Micro-batching queue depth and batch-size distribution
+@app.get("/batching/stats")
+def read_batching_stats():
+    return batching_stats(batcher)
+
+# Prediction cache size and hit rate
+@app.get("/cache/stats")
+def read_cache_stats():
+    return cache_stats(cache)
+
+# Active model version and its registry metadata
+@app.get("/model/version")
+def read_model_version():
+    return registry.describe("coastal_erosion")
+
+# Per-stage latency histograms (Prometheus text format)
+@app.get("/metrics")
+def read_metrics():
+    return metrics_response()
+
+# Results of one model fetch, each paired with the version that scored it (for the cache)
+def _versioned_results(X):
+    model_data = registry.get("coastal_erosion")
+    return [(model_data["version"], result) for result in _predict_results(model_data, X)]
+
+def _predict_results(model_data, rows):
+    return _prediction_results(_predict_rows(model_data, rows))
+
+def _prediction_results(predictions):
+    return [{"risk_assessment_prediction": p} for p in predictions.tolist()]
 
-    # Feature engineering
-    if 'wave_height' in df_input.columns and 'wave_period' in df_input.columns:
-        df_input['wave_steepness'] = df_input['wave_height'] / (df_input['wave_period'] + 1e-6)
-    if 'beach_width' in df_input.columns and 'beach_volume' in df_input.columns:
-        df_input['beach_stability_ratio'] = df_input['beach_volume'] / (df_input['beach_width'] + 1e-6)
+# Build the model's feature matrix from raw input rows (ordered as input_columns)
+def _feature_matrix(rows, final_features):
+    columns = {name: rows[:, i] for i, name in enumerate(input_columns)}
 
-    # Ensure all final features exist in input
-    missing_features = [f for f in final_features if f not in df_input.columns]
-    for f in missing_features:
-        df_input[f] = 0.0  # Fill missing engineered features with 0
+    # Feature engineering, same as CoastalErosionPredictor.feature_engineering
+    columns['wave_steepness'] = columns['wave_height'] / (columns['wave_period'] + 1e-6)
+    columns['beach_stability_ratio'] = columns['beach_volume'] / (columns['beach_width'] + 1e-6)
 
-    X = df_input[final_features].values
-    X_scaled = scaler.transform(X)
+    # Features missing from the input are filled with 0
+    zeros = np.zeros(len(rows))
+    return np.column_stack([columns.get(f, zeros) for f in final_features])
 
-    prediction = model.predict(X_scaled)
-    if hasattr(label_encoder, 'classes_'):
-        prediction = label_encoder.inverse_transform(prediction)
+# Score a whole matrix of readings in one model/decoder pass (scaling is folded into the model)
+def _predict_rows(model_data, rows):
+    label_classes = model_data["label_classes"]
+    started = clock()
+    X = _feature_matrix(rows, model_data["final_features"])
+    started = metrics.observe("engineer", started)
+    prediction = model_data["model"].predict(X)
+    started = metrics.observe_model(started, len(X), model_data["version"])
+    if label_classes is not None:
+        prediction = label_classes.take(prediction)
+    metrics.observe("labels", started)
+    return prediction
 
-    return {"risk_assessment_prediction": prediction[0]}
+# Column-oriented scoring for offline use: input column -> array in, output column -> array out
+def predict_columns(columns):
+    rows = np.column_stack([np.asarray(columns[c], dtype=float) for c in input_columns])
+    return {"risk_assessment_prediction": _predict_rows(registry.get("coastal_erosion"), rows)}
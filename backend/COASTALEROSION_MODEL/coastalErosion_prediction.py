@@ -1,18 +1,31 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV
+from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.metrics import classification_report, accuracy_score, precision_recall_fscore_support
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
 import joblib
 import warnings
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_artifact import training_fill_values, compile_verified, save_trained_model, publish_trained_model
+from training_data import read_training_table
+from training_run import TrainingRun, require_run
+from forest_tuning import successive_halving_search, print_search_report
+from incremental_update import update_scaled_classifier
 warnings.filterwarnings('ignore')
 
 
+def _plotting():
+    # matplotlib and seaborn are only imported for the plots, so update/publish jobs skip them
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
+
 class CoastalErosionPredictor:
     def __init__(self, random_state=42):
         self.random_state = random_state
@@ -27,7 +40,13 @@ class CoastalErosionPredictor:
             "wind_direction","sea_level_rise","relative_sea_level_change"
         ]
         self.final_features = None
+        self.fill_values = None
+        # Memoized predictions, CV scores and importances of the latest train_model call
+        self.run = None
         self.X_train = self.X_test = self.y_train = self.y_test = None
+        # Raw engineered features and prequential metrics of the latest update_model call
+        self.X_recent = None
+        self.update_metrics = None
 
     # -------------------- Load Data --------------------
     def load_data(self, file_path=None, data=None):
@@ -35,7 +54,8 @@ class CoastalErosionPredictor:
             self.data = data
             print("Data loaded from provided dataset")
         elif file_path:
-            self.data = pd.read_csv(file_path)
+            self.data = read_training_table(file_path, columns=self.feature_columns + ['risk_assessment'],
+                                            categorical=['risk_assessment'])
             print(f"Data loaded from {file_path}")
         else:
             raise ValueError("Either file_path or data must be provided")
@@ -50,6 +70,7 @@ class CoastalErosionPredictor:
         if 'risk_assessment' in self.data.columns:
             print("\nTarget distribution:")
             print(self.data['risk_assessment'].value_counts().sort_index())
+            plt, sns = _plotting()
             plt.figure(figsize=(12,5))
             plt.subplot(1,2,1)
             self.data['risk_assessment'].value_counts().sort_index().plot(kind='bar')
@@ -81,10 +102,11 @@ class CoastalErosionPredictor:
             data = self.data
         available_features = [col for col in self.feature_columns if col in data.columns]
         self.feature_columns = available_features
-        X = data[available_features].copy().fillna(data[available_features].median())
+        self.fill_values = data[available_features].median().to_dict()
+        X = data[available_features].copy().fillna(self.fill_values)
         if 'risk_assessment' in data.columns:
             y = data['risk_assessment'].copy()
-            if y.dtype == 'object':
+            if not pd.api.types.is_numeric_dtype(y):
                 y = self.label_encoder.fit_transform(y)
         else:
             raise ValueError("Target column 'risk_assessment' not found")
@@ -92,20 +114,32 @@ class CoastalErosionPredictor:
         return self.feature_engineering(X), y
 
     # -------------------- Train Model --------------------
-    def train_model(self, X, y, tune_hyperparameters=False):
+    def train_model(self, X, y, tune_hyperparameters=False, tuning_budget=None, budget_clock='wall'):
+        # tune_hyperparameters: False, True (exhaustive grid search) or 'halving' (successive halving
+        # with warm-started forests, stopped after tuning_budget seconds of budget_clock time)
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=0.2, random_state=self.random_state, stratify=y
         )
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
 
-        if tune_hyperparameters:
-            param_grid = {
-                'n_estimators': [100, 200],
-                'max_depth': [10, 15, 20, None],
-                'min_samples_split': [2, 5, 10],
-                'min_samples_leaf': [1, 2, 4]
-            }
+        param_grid = {
+            'n_estimators': [100, 200],
+            'max_depth': [10, 15, 20, None],
+            'min_samples_split': [2, 5, 10],
+            'min_samples_leaf': [1, 2, 4]
+        }
+        if tune_hyperparameters == 'halving':
+            rf = RandomForestClassifier(random_state=self.random_state, n_jobs=-1)
+            self.tuning_result = successive_halving_search(
+                rf, param_grid, X_train_scaled, y_train, scoring='accuracy',
+                time_budget=tuning_budget, budget_clock=budget_clock, random_state=self.random_state
+            )
+            print_search_report(self.tuning_result)
+            self.model = RandomForestClassifier(random_state=self.random_state, n_jobs=-1,
+                                                **self.tuning_result['best_params'])
+            self.model.fit(X_train_scaled, y_train)
+        elif tune_hyperparameters:
             rf = RandomForestClassifier(random_state=self.random_state, n_jobs=-1)
             grid_search = GridSearchCV(rf, param_grid, cv=5, scoring='accuracy', n_jobs=-1, verbose=1)
             grid_search.fit(X_train_scaled, y_train)
@@ -125,16 +159,22 @@ class CoastalErosionPredictor:
 
         self.X_train, self.X_test = X_train_scaled, X_test_scaled
         self.y_train, self.y_test = y_train, y_test
+        self.run = TrainingRun(self.model, X_train_scaled, y_train, X_test_scaled, y_test,
+                               self.final_features if self.final_features is not None else self.feature_columns,
+                               scoring='accuracy')
+        self.X_recent = None
         print("Model training completed!")
         return self.model
 
     # -------------------- Evaluate Model --------------------
     def evaluate_model(self):
-        y_train_pred = self.model.predict(self.X_train)
-        y_test_pred = self.model.predict(self.X_test)
+        # Predictions and CV scores come from the memoized training run
+        run = require_run(self.run, self.update_metrics is not None)
+        y_train_pred = run.y_train_pred
+        y_test_pred = run.y_test_pred
         train_acc = accuracy_score(self.y_train, y_train_pred)
         test_acc = accuracy_score(self.y_test, y_test_pred)
-        cv_scores = cross_val_score(self.model, self.X_train, self.y_train, cv=5, scoring='accuracy')
+        cv_scores = run.cv_scores
         precision, recall, f1, _ = precision_recall_fscore_support(self.y_test, y_test_pred, average='weighted')
         metrics = {
             'train_accuracy': train_acc,
@@ -151,6 +191,8 @@ class CoastalErosionPredictor:
     def get_feature_importance(self):
         if self.model is None:
             raise ValueError("Model must be trained first")
+        if self.run is not None:
+            return self.run.feature_importance
         features = self.final_features if self.final_features is not None else self.feature_columns
         importances = self.model.feature_importances_
         min_length = min(len(features), len(importances))
@@ -164,23 +206,66 @@ class CoastalErosionPredictor:
     def predict_risk(self, new_data):
         if isinstance(new_data, dict):
             new_data = pd.DataFrame([new_data])
-        X_new = self.feature_engineering(new_data[self.feature_columns])
+        X_new = self.feature_engineering(new_data[self.feature_columns].fillna(self.training_fill_values()))
         X_scaled = self.scaler.transform(X_new)
         preds = self.model.predict(X_scaled)
         if hasattr(self.label_encoder, 'classes_'):
             preds = self.label_encoder.inverse_transform(preds)
         return preds
 
+    # -------------------- Incremental Update --------------------
+    def update_model(self, new_data, n_new_trees=50, max_trees=None):
+        # The forest is updated on the engineered features; the save/load format is unchanged
+        if self.model is None:
+            raise ValueError("Model must be trained first")
+        if 'risk_assessment' not in new_data.columns:
+            raise ValueError("Target column 'risk_assessment' not found")
+        X_new = self.feature_engineering(new_data[self.feature_columns].fillna(self.training_fill_values()))
+        self.update_metrics = update_scaled_classifier(self.model, self.scaler, self.label_encoder, X_new,
+                                                       new_data['risk_assessment'], n_new_trees, max_trees)
+        self.run = None
+        self.X_recent = X_new.to_numpy()
+        return self.update_metrics
+
+    def training_fill_values(self):
+        return training_fill_values(self.fill_values, self.scaler, self.feature_columns, self.final_features)
+
+    # -------------------- Export Raw-Units Model --------------------
+    def export_raw_model(self, X_check=None):
+        """Compile the forest with the scaler folded into its split thresholds.
+
+        The returned model scores raw engineered features (final_features order) and is
+        verified to make identical predictions to scaler + model on X_check (default: the
+        readings of the latest update, else the test split, else samples around the
+        training means).
+        """
+        if self.model is None:
+            raise ValueError("Model must be trained first")
+        if X_check is None and self.X_recent is not None:
+            X_check = self.X_recent
+        elif X_check is None and self.X_test is not None:
+            X_check = self.scaler.inverse_transform(self.X_test)
+        raw_model = compile_verified(self.model, self.scaler, X_check, name="raw-units coastal_erosion model")
+        print("Raw-units model verified against scaler + model")
+        return raw_model
+
     # -------------------- Save/Load Model --------------------
     def save_model(self, filename='coastal_erosion_model.pkl'):
-        joblib.dump({
+        save_trained_model(filename, {
             'model': self.model,
             'scaler': self.scaler,
             'label_encoder': self.label_encoder,
             'feature_columns': self.feature_columns,
-            'final_features': self.final_features
-        }, filename)
-        print(f"Model saved to {filename}")
+            'final_features': self.final_features,
+            'fill_values': self.fill_values
+        }, self.export_raw_model(), run=self.run, metrics=self.current_metrics())
+
+    def current_metrics(self):
+        return self.evaluate_model()[0] if self.run is not None else self.update_metrics
+
+    def publish_model(self, filename='coastal_erosion_model.pkl', activate=True):
+        self.save_model(filename)
+        return publish_trained_model('coastal_erosion', filename, self.current_metrics(), activate=activate)
 
     def load_model(self, filename='coastal_erosion_model.pkl'):
         data = joblib.load(filename)
@@ -189,6 +274,9 @@ class CoastalErosionPredictor:
         self.label_encoder = data['label_encoder']
         self.feature_columns = data['feature_columns']
         self.final_features = data.get('final_features', self.feature_columns)
+        self.fill_values = data.get('fill_values')
+        self.X_recent = None
+        self.run = self.update_metrics = None
         print(f"Model loaded from {filename}")
 
     # -------------------- Print Summary --------------------
@@ -1,17 +1,29 @@
 # FASTAPI Cyclone Prediction API
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import numpy as np
-import joblib
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import registry
+from columnar import columnar_model
+from micro_batching import MicroBatcher, batching_stats
+from prediction_cache import PredictionCache, cache_stats
+from csv_scoring import score_csv_upload, csv_matrix
+from serving_metrics import TimedRoute, metrics_for, metrics_response, clock
+from request_profiling import run_in_threadpool
+from wire_formats import batch_openapi, decode_columns, encode_predictions
 
-# Load the pre-trained model
-model_data = joblib.load("cyclone_formation_model.pkl")
-model = model_data["model"]
+# Load the pre-trained model (a compiled forest, served from its memory-mapped artifact).
+# Predictions fetch it from the registry on every call, so newly activated versions are picked up live.
+registry.get("cyclone")
 
 # Initialize FastAPI
 app = FastAPI(title="Cyclone Prediction API")
+app.router.route_class = TimedRoute
+metrics = metrics_for("cyclone")
 
 # Enable CORS (optional, for frontend access)
 app.add_middleware(
@@ -36,13 +48,98 @@ class CycloneInput(BaseModel):
 # Test endpoint
 @app.get("/")
 def read_root():
-    return {"message": "Cyclone Prediction API is running. Use POST /predict with input JSON."}
+    return {"message": "Cyclone Prediction API is running. Use POST /predict with input JSON or POST /predict_batch with one array per feature."}
+
+# Columnar batch schema: one array per CycloneInput field
+CycloneBatchInput = columnar_model(CycloneInput, "CycloneBatchInput")
+predict_batch_openapi = batch_openapi(CycloneBatchInput)
+input_columns = list(CycloneInput.__fields__)
+
+# Optional coalescing of concurrent /predict calls into one model call (MICRO_BATCHING=1)
+batcher = MicroBatcher.from_env(lambda rows: _versioned_results(np.vstack(rows)))
+
+# Optional cache of /predict results for repeated readings (PREDICTION_CACHE=1)
+cache = PredictionCache.from_env(input_columns, lambda: registry.get("cyclone")["version"])
 
 # Prediction endpoint
 @app.post("/predict")
-def predict(data: CycloneInput):
+async def predict(data: CycloneInput):
     # Convert input to numpy array
+    started = clock()
     X = np.array([[value for value in data.dict().values()]])
+    metrics.observe("features", started)
     # Make prediction
-    prediction = model.predict(X)[0]
-    return {"cyclone_formation_probability": round(float(prediction), 4)}
+    if cache is not None:
+        cached = cache.get(X[0])
+        if cached is not None:
+            return cached
+    if batcher is not None:
+        version, result = await batcher.submit(X)
+    else:
+        version, result = (await run_in_threadpool(_versioned_results, X))[0]
+    if cache is not None:
+        cache.put(X[0], result, version)
+    return result
+
+# Batch prediction endpoint (columnar payload, scored in one model call). The body is
+# JSON, MessagePack or a float64 matrix, and so is the response (see wire_formats.py)
+@app.post("/predict_batch", openapi_extra=predict_batch_openapi)
+async def predict_batch(request: Request):
+    body = await request.body()
+    return await run_in_threadpool(_predict_batch, request, body)
+
+def _predict_batch(request, body):
+    columns = decode_columns(request, body, input_columns, metrics=metrics)
+    started = clock()
+    X = np.column_stack([columns[c] for c in input_columns])
+    metrics.observe("features", started)
+    predictions = _predict_rows(registry.get("cyclone"), X)
+    return encode_predictions(request, {"cyclone_formation_probability": predictions},
+                              lambda: _prediction_results(predictions), metrics=metrics)
+
+# Streamed CSV scoring: predictions come back chunk by chunk while the upload is still arriving
+@app.post("/predict_csv")
+async def predict_csv(request: Request):
+    return await score_csv_upload(request, input_columns, lambda columns: _predict_results(registry.get("cyclone"), csv_matrix(columns, input_columns)))
+
+# Micro-batching queue depth and batch-size distribution
+@app.get("/batching/stats")
+def read_batching_stats():
+    return batching_stats(batcher)
+
+# Prediction cache size and hit rate
+@app.get("/cache/stats")
+def read_cache_stats():
+    return cache_stats(cache)
+
+# Active model version and its registry metadata
+@app.get("/model/version")
+def read_model_version():
+    return registry.describe("cyclone")
+
+# Per-stage latency histograms (Prometheus text format)
+@app.get("/metrics")
+def read_metrics():
+    return metrics_response()
+
+# Results of one model fetch, each paired with the version that scored it (for the cache)
+def _versioned_results(X):
+    model_data = registry.get("cyclone")
+    return [(model_data["version"], result) for result in _predict_results(model_data, X)]
+
+def _predict_results(model_data, X):
+    return _prediction_results(_predict_rows(model_data, X))
+
+def _prediction_results(predictions):
+    return [{"cyclone_formation_probability": p} for p in predictions.tolist()]
+
+def _predict_rows(model_data, X):
+    started = clock()
+    predictions = np.round(model_data["model"].predict(X), 4)
+    metrics.observe_model(started, len(X), model_data["version"])
+    return predictions
+
+# Column-oriented scoring for offline use: input column -> array in, output column -> array out
+def predict_columns(columns):
+    X = np.column_stack([np.asarray(columns[c], dtype=float) for c in input_columns])
+    return {"cyclone_formation_probability": _predict_rows(registry.get("cyclone"), X)}
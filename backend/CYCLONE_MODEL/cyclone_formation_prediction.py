@@ -1,13 +1,18 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
-import matplotlib.pyplot as plt
-import seaborn as sns
 import joblib
 import warnings
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_artifact import compile_verified, save_trained_model, publish_trained_model
+from training_data import read_training_table
+from training_run import TrainingRun, require_run
+from incremental_update import grow_forest
 warnings.filterwarnings('ignore')
 
 class CycloneFormationPredictor:
@@ -19,10 +24,17 @@ class CycloneFormationPredictor:
             'central_pressure', 'wind_speed', 'wind_shear', 'sea_surface_temp',
             'cloud_top_temp', 'vorticity', 'convective_activity', 'humidity', 'precipitation'
         ]
+        self.fill_values = None
+        # Memoized predictions, CV scores and importances of the latest train_model call
+        self.run = None
+        self.X_test = None
+        # Readings and prequential metrics of the latest update_model call
+        self.X_recent = None
+        self.update_metrics = None
 
     def load_data(self, file_path):
         try:
-            data = pd.read_csv(file_path)
+            data = read_training_table(file_path, columns=self.feature_columns + ['cyclone_formation_probability'])
             print(f"Data loaded from {file_path}")
             return data
         except Exception as e:
@@ -31,7 +43,8 @@ class CycloneFormationPredictor:
     def preprocess_data(self, data):
         X = data[self.feature_columns].copy()
         y = data['cyclone_formation_probability'].copy()
-        X = X.fillna(X.mean())
+        self.fill_values = X.mean().to_dict()
+        X = X.fillna(self.fill_values)
         return X, y
 
     def train_model(self, X, y):
@@ -49,11 +62,37 @@ class CycloneFormationPredictor:
         self.model.fit(X_train, y_train)
         self.X_train, self.X_test = X_train, X_test
         self.y_train, self.y_test = y_train, y_test
+        self.run = TrainingRun(self.model, X_train, y_train, X_test, y_test, self.feature_columns, scoring='r2')
+        self.X_recent = None
         print("Model training completed!")
 
+    def update_model(self, new_data, n_new_trees=25, max_trees=None):
+        # Incremental update from newly labeled readings: score them with the current forest
+        # first (prequential error), then add n_new_trees trees fitted on them and retire the
+        # oldest trees beyond max_trees. The forest works on raw features, so there are no
+        # scaler statistics to update.
+        if self.model is None:
+            raise ValueError("Model must be trained first")
+        X_new = new_data[self.feature_columns].copy().fillna(self.fill_values or {})
+        y_new = new_data['cyclone_formation_probability']
+        y_pred = self.model.predict(X_new)
+        self.update_metrics = {
+            'update_samples': len(y_new),
+            'prequential_mae': mean_absolute_error(y_new, y_pred),
+            'prequential_r2': r2_score(y_new, y_pred),
+        }
+        grow_forest(self.model, X_new, y_new, n_new_trees, max_trees)
+        self.update_metrics['n_trees'] = len(self.model.estimators_)
+        self.run = None
+        self.X_recent = X_new
+        print(f"Model updated with {len(y_new)} readings: MAE on them before the update "
+              f"{self.update_metrics['prequential_mae']:.4f}, {self.update_metrics['n_trees']} trees")
+        return self.update_metrics
+
     def evaluate_model(self):
-        y_train_pred = self.model.predict(self.X_train)
-        y_test_pred = self.model.predict(self.X_test)
+        run = require_run(self.run, self.update_metrics is not None)
+        y_train_pred = run.y_train_pred
+        y_test_pred = run.y_test_pred
         metrics = {
             'train_mse': mean_squared_error(self.y_train, y_train_pred),
             'test_mse': mean_squared_error(self.y_test, y_test_pred),
@@ -61,11 +100,13 @@ class CycloneFormationPredictor:
             'test_mae': mean_absolute_error(self.y_test, y_test_pred),
             'train_r2': r2_score(self.y_train, y_train_pred),
             'test_r2': r2_score(self.y_test, y_test_pred),
-            'cv_r2_mean': cross_val_score(self.model, self.X_train, self.y_train, cv=5, scoring='r2').mean()
+            'cv_r2_mean': run.cv_scores.mean()
         }
         return metrics
 
     def get_feature_importance(self):
+        if self.run is not None:
+            return self.run.feature_importance
         importance_df = pd.DataFrame({
             'feature': self.feature_columns,
             'importance': self.model.feature_importances_
@@ -73,12 +114,33 @@ class CycloneFormationPredictor:
         return importance_df
 
     def save_model(self, filename='cyclone_formation_model.pkl'):
-        joblib.dump({
+        # The forest works on raw features, so it is compiled without the (unfitted) scaler
+        X_check = self.X_recent if self.X_recent is not None else self.X_test
+        compiled = compile_verified(self.model, X_check=X_check.values if X_check is not None else None,
+                                    name="cyclone model")
+        save_trained_model(filename, {
             'model': self.model,
             'scaler': self.scaler,
-            'feature_columns': self.feature_columns
-        }, filename)
-        print(f"Model saved to {filename}")
+            'feature_columns': self.feature_columns,
+            'fill_values': self.fill_values
+        }, compiled, run=self.run, metrics=self.current_metrics())
+
+    def current_metrics(self):
+        return self.evaluate_model() if self.run is not None else self.update_metrics
+
+    def publish_model(self, filename='cyclone_formation_model.pkl', activate=True):
+        self.save_model(filename)
+        return publish_trained_model('cyclone', filename, self.current_metrics(), activate=activate)
+
+    def load_model(self, filename='cyclone_formation_model.pkl'):
+        data = joblib.load(filename)
+        self.model = data['model']
+        self.scaler = data['scaler']
+        self.feature_columns = data['feature_columns']
+        self.fill_values = data.get('fill_values')
+        self.run = self.update_metrics = None
+        self.X_test = self.X_recent = None
+        print(f"Model loaded from {filename}")
 
     def print_model_summary(self):
         metrics = self.evaluate_model()
@@ -4,7 +4,15 @@ import pandas as pd
 import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler, LabelEncoder
+import pickle
 import warnings
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_artifact import artifact_path, save_centroid_artifact
+from model_registry import ModelStore
+from incremental_update import update_centres
+from centroid_engine import CompiledRiskPredictor
 warnings.filterwarnings('ignore')
 
 class EnvironmentalRiskPredictor:
@@ -73,15 +81,79 @@ class EnvironmentalRiskPredictor:
         if not self.is_trained:
             raise ValueError("Model must be trained before prediction")
 
+        X_scaled = self.scaler.transform(self._processed_features(X))
+        cluster_predictions = self.kmeans.predict(X_scaled)
+        return [self.cluster_risk_mapping[cluster] for cluster in cluster_predictions]
+
+    def update_model(self, X):
+        """Move the cluster centres towards new readings instead of refitting.
+
+        Scaler statistics are updated with partial_fit, the centres are carried over to
+        the new scaled space, and each centre moves to the running mean of the points
+        assigned to it so far. Risk levels are then re-derived from the moved centres.
+        Returns the mean squared distance of the new readings to their nearest centre
+        before the update.
+        """
+        if not self.is_trained:
+            raise ValueError("Model must be trained first")
+        X_processed = self._processed_features(X)
+
+        # Models pickled before incremental updates only know their training assignments
+        counts = getattr(self, 'cluster_counts_', None)
+        if counts is None:
+            counts = np.bincount(self.kmeans.labels_, minlength=self.n_clusters).astype(np.float64)
+        distances = self.kmeans.transform(self.scaler.transform(X_processed)).min(axis=1)
+        update_inertia = float((distances ** 2).mean())
+
+        centres = self.scaler.inverse_transform(self.kmeans.cluster_centers_)
+        self.scaler.partial_fit(X_processed)
+        centres = self.scaler.transform(pd.DataFrame(centres, columns=self.feature_names))
+        centres, self.cluster_counts_ = update_centres(centres, counts, self.scaler.transform(X_processed))
+        self.kmeans.cluster_centers_ = centres
+        self._calculate_risk_mapping(X_processed, None)
+        print(f"Model updated with {len(X_processed)} readings "
+              f"(mean squared distance to nearest centre before the update: {update_inertia:.4f})")
+        return update_inertia
+
+    def _processed_features(self, X):
         X_processed = pd.DataFrame(0, index=range(len(X)), columns=self.feature_names)
         for col in X.columns:
             if col in X_processed.columns:
-                X_processed[col] = X[col]
+                X_processed[col] = X[col].to_numpy()
 
-        if 'toxicity_level' in X_processed.columns:
-            X_processed['toxicity_level_encoded'] = self.label_encoder.transform(X_processed['toxicity_level'])
-            X_processed = X_processed.drop('toxicity_level', axis=1)
+        # feature_names only holds the encoded column, so encode straight from the input
+        if 'toxicity_level' in X.columns and 'toxicity_level_encoded' in X_processed.columns:
+            X_processed['toxicity_level_encoded'] = self.label_encoder.transform(X['toxicity_level'])
+        return X_processed
 
-        X_scaled = self.scaler.transform(X_processed)
-        cluster_predictions = self.kmeans.predict(X_scaled)
-        return [self.cluster_risk_mapping[cluster] for cluster in cluster_predictions]
+    def centroids(self):
+        """Fitted state as plain arrays: what CompiledRiskPredictor and model artifacts need."""
+        if not self.is_trained:
+            raise ValueError("Model must be trained first")
+        n_features = len(self.feature_names)
+        return {
+            'feature_names': list(self.feature_names),
+            'mean': self.scaler.mean_ if self.scaler.with_mean else np.zeros(n_features),
+            'scale': self.scaler.scale_ if self.scaler.with_std else np.ones(n_features),
+            'centers': self.kmeans.cluster_centers_,
+            'toxicity_classes': [str(label) for label in getattr(self.label_encoder, 'classes_', [])],
+            'risk_levels': [self.cluster_risk_mapping[cluster] for cluster in range(self.n_clusters)],
+        }
+
+    def compile(self, input_columns):
+        """Build a CompiledRiskPredictor for inputs with the given columns (others are zero-filled)."""
+        return CompiledRiskPredictor.from_centroids(input_columns=input_columns, **self.centroids())
+
+    def save_model(self, filename='environmental_risk_model.pkl'):
+        with open(filename, 'wb') as f:
+            pickle.dump(self, f)
+        save_centroid_artifact(artifact_path(filename), self.centroids())
+        print(f"Model saved to {filename}")
+
+    def publish_model(self, filename='environmental_risk_model.pkl', activate=True):
+        # Publish the centroid artifact as a new model store version (inertia is the only metric)
+        self.save_model(filename)
+        version = ModelStore().publish('pollution', artifact_path(filename),
+                                       metrics={'inertia': self.kmeans.inertia_}, activate=activate)
+        print(f"Published pollution model version {version}")
+        return version
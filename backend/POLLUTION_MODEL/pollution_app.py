@@ -1,18 +1,29 @@
 # pollution_app.py
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import pandas as pd
-import pickle
-from environmental_model import EnvironmentalRiskPredictor
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import registry
+from columnar import columnar_model
+from micro_batching import MicroBatcher, batching_stats
+from prediction_cache import cache_stats
+from csv_scoring import score_csv_upload
+from serving_metrics import TimedRoute, metrics_for, metrics_response, clock
+from request_profiling import run_in_threadpool
+from wire_formats import batch_openapi, decode_columns, encode_predictions
+from centroid_engine import CompiledRiskPredictor
 
-# Load trained model
-with open("environmental_risk_model.pkl", "rb") as f:
-    model = pickle.load(f)
+# Load trained model (fetched from the registry on every call, so newly activated versions are picked up live)
+registry.get("pollution")
 
 # FastAPI setup
 app = FastAPI(title="Environmental Risk Prediction API")
+app.router.route_class = TimedRoute
+metrics = metrics_for("pollution")
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,14 +52,111 @@ class EnvironmentalInput(BaseModel):
     agricultural_runoff_index: float
     domestic_sewage_index: float
 
+# Columnar batch schema: one array per EnvironmentalInput field
+EnvironmentalBatchInput = columnar_model(EnvironmentalInput, "EnvironmentalBatchInput")
+predict_batch_openapi = batch_openapi(EnvironmentalBatchInput)
+input_columns = list(EnvironmentalInput.__fields__)
+
+# Nearest-centroid scorer compiled from the served model: one matrix product per batch.
+# It is built once per model version and kept alongside it in the registry entry.
+def _fast_model(model_data=None):
+    model_data = model_data or registry.get("pollution")
+    fast_model = model_data.get("fast_model")
+    if fast_model is None:
+        fast_model = model_data["fast_model"] = CompiledRiskPredictor.from_centroids(input_columns=input_columns, **model_data["centroids"])
+    return fast_model
+
 # Test endpoint
 @app.get("/")
 def read_root():
-    return {"message": "Environmental Risk Prediction API is running. Use POST /predict with input JSON."}
+    return {"message": "Environmental Risk Prediction API is running. Use POST /predict with input JSON or POST /predict_batch with one array per feature."}
+
+# Optional coalescing of concurrent /predict calls into one model call (MICRO_BATCHING=1)
+batcher = MicroBatcher.from_env(lambda rows: _predict_results(registry.get("pollution"), {c: [row[c] for row in rows] for c in input_columns}))
 
 # Prediction endpoint
 @app.post("/predict")
-def predict(data: EnvironmentalInput):
-    input_df = pd.DataFrame([data.dict()])
-    prediction = model.predict(input_df)[0]
-    return {"predicted_risk_level": prediction}
+async def predict(data: EnvironmentalInput):
+    input_dict = data.dict()
+    model_data = registry.get("pollution")
+    # Reject unknown labels up front so one bad reading cannot fail a shared micro-batch
+    if input_dict['toxicity_level'] not in _fast_model(model_data).toxicity_codes:
+        raise HTTPException(status_code=422, detail=f"Unknown toxicity_level '{input_dict['toxicity_level']}'")
+    if batcher is not None:
+        return await batcher.submit(input_dict)
+    columns = {c: [value] for c, value in input_dict.items()}
+    return (await run_in_threadpool(_predict_results, model_data, columns))[0]
+
+# Batch prediction endpoint (columnar payload, scored in one model call). The body is
+# JSON, MessagePack or a float64 matrix (toxicity_level as the index of its label among
+# the model's sorted toxicity labels), and so is the response (see wire_formats.py)
+@app.post("/predict_batch", openapi_extra=predict_batch_openapi)
+async def predict_batch(request: Request):
+    body = await request.body()
+    return await run_in_threadpool(_predict_batch, request, body)
+
+def _predict_batch(request, body):
+    model_data = registry.get("pollution")
+    fast_model = _fast_model(model_data)
+    columns = decode_columns(request, body, input_columns, categories={"toxicity_level": list(fast_model.toxicity_codes)},
+                             metrics=metrics)
+    try:
+        labels = _predict_labels(model_data, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return encode_predictions(request, {"predicted_risk_level": labels}, lambda: _prediction_results(labels),
+                              classes={"predicted_risk_level": model_data["label_classes"]},
+                              metrics=metrics)
+
+# Streamed CSV scoring: predictions come back chunk by chunk while the upload is still arriving
+@app.post("/predict_csv")
+async def predict_csv(request: Request):
+    return await score_csv_upload(request, input_columns, _predict_csv_chunk)
+
+# Micro-batching queue depth and batch-size distribution
+@app.get("/batching/stats")
+def read_batching_stats():
+    return batching_stats(batcher)
+
+# The centroid scorer is cheaper than a cache lookup, so pollution has no prediction cache
+@app.get("/cache/stats")
+def read_cache_stats():
+    return cache_stats(None)
+
+# Active model version and its registry metadata
+@app.get("/model/version")
+def read_model_version():
+    return registry.describe("pollution")
+
+# Per-stage latency histograms (Prometheus text format)
+@app.get("/metrics")
+def read_metrics():
+    return metrics_response()
+
+def _predict_results(model_data, columns):
+    return _prediction_results(_predict_labels(model_data, columns))
+
+def _prediction_results(labels):
+    return [{"predicted_risk_level": p} for p in labels.tolist()]
+
+def _predict_labels(model_data, columns):
+    fast_model = _fast_model(model_data)
+    started = clock()
+    X = fast_model.feature_matrix(columns)
+    started = metrics.observe("features", started)
+    nearest = fast_model.nearest(X)
+    started = metrics.observe_model(started, len(X), model_data["version"])
+    labels = fast_model.risk_levels[nearest]
+    metrics.observe("labels", started)
+    return labels
+
+def _predict_csv_chunk(columns):
+    try:
+        numeric = {c: np.array(values, dtype=np.float64) for c, values in columns.items() if c != 'toxicity_level'}
+    except ValueError as e:
+        raise ValueError(f"Non-numeric value in CSV: {e}")
+    return _predict_results(registry.get("pollution"), {**numeric, 'toxicity_level': columns['toxicity_level']})
+
+# Column-oriented scoring for offline use: input column -> array in, output column -> array out
+def predict_columns(columns):
+    return {"predicted_risk_level": _predict_labels(registry.get("pollution"), columns)}
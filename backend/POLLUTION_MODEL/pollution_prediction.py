@@ -104,20 +104,21 @@
  
  # pollution_prediction.py
 
-import pandas as pd
-import pickle
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from environmental_model import EnvironmentalRiskPredictor
+from training_data import read_training_table
 
 if __name__ == "__main__":
-    # Load training data
-    training_data = pd.read_csv("pollution_data.csv")
+    # Load training data (CSV, Parquet/Arrow file or partitioned dataset). Every numeric
+    # column is a clustering feature, so nothing is projected away; labels load as categoricals
+    training_data = read_training_table(sys.argv[1] if len(sys.argv) > 1 else "pollution_data.csv",
+                                        categorical=['toxicity_level'])
 
     # Train model
     model = EnvironmentalRiskPredictor()
     model.fit(training_data)
 
-    # Save model
-    with open("environmental_risk_model.pkl", "wb") as f:
-        pickle.dump(model, f)
-
-    print("Model trained and saved as environmental_risk_model.pkl")
+    # Save model (pickle plus memory-mappable serving artifact)
+    model.save_model("environmental_risk_model.pkl")
@@ -1,20 +1,30 @@
 # FASTAPI Storm Alert Prediction API
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import numpy as np
-import joblib
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import registry
+from columnar import columnar_model
+from micro_batching import MicroBatcher, batching_stats
+from prediction_cache import PredictionCache, cache_stats
+from csv_scoring import score_csv_upload, csv_matrix
+from serving_metrics import TimedRoute, metrics_for, metrics_response, clock
+from request_profiling import run_in_threadpool
+from wire_formats import batch_openapi, decode_columns, encode_predictions
 
-# Load the pre-trained storm alert model
-model_data = joblib.load("storm_alert_model.pkl")
-model = model_data["model"]
-scaler = model_data["scaler"]
-label_encoder = model_data["label_encoder"]
-feature_columns = model_data["feature_columns"]
+# Load the pre-trained storm alert model: a compiled forest with the scaler folded
+# into its thresholds, so inputs are passed in raw units. Predictions fetch the model
+# from the registry on every call, so newly activated versions are picked up live.
+feature_columns = registry.get("storm")["feature_columns"]
 
 # Initialize FastAPI
 app = FastAPI(title="Storm Alert Prediction API")
+app.router.route_class = TimedRoute
+metrics = metrics_for("storm")
 
 # Enable CORS (optional, for frontend access)
 app.add_middleware(
@@ -49,30 +59,127 @@ class StormInput(BaseModel):
 # Test endpoint
 @app.get("/")
 def read_root():
-    return {"message": "Storm Alert Prediction API is running. Use POST /predict with input JSON."}
+    return {"message": "Storm Alert Prediction API is running. Use POST /predict with input JSON or POST /predict_batch with one array per feature."}
+
+# Columnar batch schema: one array per StormInput field
+StormBatchInput = columnar_model(StormInput, "StormBatchInput")
+predict_batch_openapi = batch_openapi(StormBatchInput)
+input_columns = list(StormInput.__fields__)
+
+# Optional coalescing of concurrent /predict calls into one model call (MICRO_BATCHING=1)
+batcher = MicroBatcher.from_env(lambda rows: _versioned_results(np.vstack(rows)))
+
+# Optional cache of /predict results for repeated readings (PREDICTION_CACHE=1)
+cache = PredictionCache.from_env(feature_columns, lambda: registry.get("storm")["version"])
 
 # Prediction endpoint
 @app.post("/predict")
-def predict(data: StormInput):
+async def predict(data: StormInput):
     # Convert input to numpy array in the same order as feature_columns
+    started = clock()
     input_dict = data.dict()
     X = np.array([[input_dict[feat] for feat in feature_columns]])
-    
-    # Scale input
-    X_scaled = scaler.transform(X)
-    
-    # Make prediction
-    pred_class = model.predict(X_scaled)[0]
-    pred_proba = model.predict_proba(X_scaled)[0]
-    
-    # Convert class back to original label
-    if hasattr(label_encoder, 'classes_'):
-        pred_class_label = label_encoder.inverse_transform([pred_class])[0]
-    else:
-        pred_class_label = pred_class
-    
+    metrics.observe("features", started)
+
     # Return prediction and class probabilities
-    return {
-        "predicted_risk_level": str(pred_class_label),
-        "class_probabilities": {label_encoder.classes_[i]: float(prob) for i, prob in enumerate(pred_proba)}
-    }
+    if cache is not None:
+        cached = cache.get(X[0])
+        if cached is not None:
+            return cached
+    if batcher is not None:
+        version, result = await batcher.submit(X)
+    else:
+        version, result = (await run_in_threadpool(_versioned_results, X))[0]
+    if cache is not None:
+        cache.put(X[0], result, version)
+    return result
+
+# Batch prediction endpoint (columnar payload, scored in one model call). The body is
+# JSON, MessagePack or a float64 matrix, and so is the response (see wire_formats.py)
+@app.post("/predict_batch", openapi_extra=predict_batch_openapi)
+async def predict_batch(request: Request):
+    body = await request.body()
+    return await run_in_threadpool(_predict_batch, request, body)
+
+def _predict_batch(request, body):
+    columns = decode_columns(request, body, input_columns, metrics=metrics)
+    started = clock()
+    X = np.column_stack([columns[c] for c in feature_columns])
+    metrics.observe("features", started)
+    model_data = registry.get("storm")
+    label_classes = model_data["label_classes"]
+    pred_labels, pred_proba = _predict_rows(model_data, X)
+    return encode_predictions(request, _prediction_outputs(label_classes, pred_labels, pred_proba),
+                              lambda: _prediction_results(label_classes, pred_labels, pred_proba),
+                              classes={"predicted_risk_level": label_classes}, metrics=metrics)
+
+# Streamed CSV scoring: predictions come back chunk by chunk while the upload is still arriving
+@app.post("/predict_csv")
+async def predict_csv(request: Request):
+    return await score_csv_upload(request, feature_columns, lambda columns: _predict_results(registry.get("storm"), csv_matrix(columns, feature_columns)))
+
+# Micro-batching queue depth and batch-size distribution
+@app.get("/batching/stats")
+def read_batching_stats():
+    return batching_stats(batcher)
+
+# Prediction cache size and hit rate
+@app.get("/cache/stats")
+def read_cache_stats():
+    return cache_stats(cache)
+
+# Active model version and its registry metadata
+@app.get("/model/version")
+def read_model_version():
+    return registry.describe("storm")
+
+# Per-stage latency histograms (Prometheus text format)
+@app.get("/metrics")
+def read_metrics():
+    return metrics_response()
+
+# Results of one model fetch, each paired with the version that scored it (for the cache)
+def _versioned_results(X):
+    model_data = registry.get("storm")
+    return [(model_data["version"], result) for result in _predict_results(model_data, X)]
+
+def _predict_results(model_data, X):
+    label_classes = model_data["label_classes"]
+    pred_labels, pred_proba = _predict_rows(model_data, X)
+    return _prediction_results(label_classes, pred_labels, pred_proba)
+
+# Score a matrix of raw readings; classes come from the same predict_proba pass
+def _predict_rows(model_data, X):
+    model = model_data["model"]
+    label_classes = model_data["label_classes"]
+    started = clock()
+    pred_proba = model.predict_proba(X)
+    pred_class = model.classes_.take(np.argmax(pred_proba, axis=1))
+    started = metrics.observe_model(started, len(X), model_data["version"])
+
+    # Convert class back to original label
+    if label_classes is not None:
+        pred_class = label_classes.take(pred_class)
+    metrics.observe("labels", started)
+    return pred_class, pred_proba
+
+def _prediction_results(label_classes, pred_labels, pred_proba):
+    # One result dict per row; tolist() converts each array in a single pass
+    labels = [str(label) for label in label_classes]
+    return [
+        {"predicted_risk_level": str(pred_class_label), "class_probabilities": dict(zip(labels, proba))}
+        for pred_class_label, proba in zip(pred_labels.tolist(), pred_proba.tolist())
+    ]
+
+def _prediction_outputs(label_classes, pred_labels, pred_proba):
+    outputs = {"predicted_risk_level": pred_labels.astype(str)}
+    for i, label in enumerate(label_classes):
+        outputs[f"probability_{label}"] = pred_proba[:, i]
+    return outputs
+
+# Column-oriented scoring for offline use: input column -> array in, output column -> array out
+def predict_columns(columns):
+    model_data = registry.get("storm")
+    X = np.column_stack([np.asarray(columns[c], dtype=float) for c in feature_columns])
+    pred_labels, pred_proba = _predict_rows(model_data, X)
+    return _prediction_outputs(model_data["label_classes"], pred_labels, pred_proba)
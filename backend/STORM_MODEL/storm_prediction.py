@@ -1,18 +1,31 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV
+from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, precision_recall_fscore_support
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend to avoid Tkinter errors
-import matplotlib.pyplot as plt
-import seaborn as sns
 import joblib
 import warnings
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_artifact import training_fill_values, compile_verified, save_trained_model, publish_trained_model
+from training_data import read_training_table
+from training_run import TrainingRun, require_run
+from forest_tuning import successive_halving_search, print_search_report
+from incremental_update import update_scaled_classifier
 
 warnings.filterwarnings('ignore')
 
+
+def _plotting():
+    # matplotlib and seaborn are only imported for the plots, so update/publish jobs skip them
+    import matplotlib
+    matplotlib.use('Agg')  # Use non-GUI backend to avoid Tkinter errors
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    return plt, sns
+
 class StormAlertPredictor:
     def __init__(self, random_state=42):
         self.random_state = random_state
@@ -26,6 +39,12 @@ class StormAlertPredictor:
             'atmospheric_pressure', 'pressure_trend', 'air_temperature', 
             'sea_surface_temp', 'flood_depth', 'inundation_area', 'drainage_rate'
         ]
+        self.fill_values = None
+        # Memoized predictions, CV scores and importances of the latest train_model call
+        self.run = None
+        # Raw readings and prequential metrics of the latest update_model call
+        self.X_recent = None
+        self.update_metrics = None
     
     def load_data(self, file_path=None, data=None):
         try:
@@ -33,7 +52,8 @@ class StormAlertPredictor:
                 self.data = data
                 print("Data loaded from provided dataset")
             elif file_path:
-                self.data = pd.read_csv(file_path)
+                self.data = read_training_table(file_path, columns=self.feature_columns + ['risk_level'],
+                                                categorical=['risk_level'])
                 print(f"Data loaded from {file_path}")
             else:
                 raise ValueError("Either file_path or data must be provided")
@@ -53,6 +73,7 @@ class StormAlertPredictor:
             print(f"\nTarget variable distribution:")
             print(self.data['risk_level'].value_counts().sort_index())
             
+            plt, sns = _plotting()
             plt.figure(figsize=(12, 5))
             
             plt.subplot(1, 2, 1)
@@ -81,11 +102,12 @@ class StormAlertPredictor:
         self.feature_columns = available_features
         
         X = data[self.feature_columns].copy()
-        X = X.fillna(X.median())
+        self.fill_values = X.median().to_dict()
+        X = X.fillna(self.fill_values)
         
         if 'risk_level' in data.columns:
             y = data['risk_level'].copy()
-            if y.dtype == 'object':
+            if not pd.api.types.is_numeric_dtype(y):
                 y = self.label_encoder.fit_transform(y)
         else:
             raise ValueError("Target column 'risk_level' not found in data")
@@ -94,7 +116,9 @@ class StormAlertPredictor:
         print(f"Target classes: {np.unique(y)}")
         return X, y
     
-    def train_model(self, X, y, tune_hyperparameters=False):
+    def train_model(self, X, y, tune_hyperparameters=False, tuning_budget=None, budget_clock='wall'):
+        # tune_hyperparameters: False, True (exhaustive grid search) or 'halving' (successive halving
+        # with warm-started forests, stopped after tuning_budget seconds of budget_clock time)
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=0.2, random_state=self.random_state, stratify=y
         )
@@ -102,13 +126,23 @@ class StormAlertPredictor:
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
         
-        if tune_hyperparameters:
-            param_grid = {
-                'n_estimators': [100, 200, 300],
-                'max_depth': [10, 15, 20, None],
-                'min_samples_split': [2, 5, 10],
-                'min_samples_leaf': [1, 2, 4]
-            }
+        param_grid = {
+            'n_estimators': [100, 200, 300],
+            'max_depth': [10, 15, 20, None],
+            'min_samples_split': [2, 5, 10],
+            'min_samples_leaf': [1, 2, 4]
+        }
+        if tune_hyperparameters == 'halving':
+            rf = RandomForestClassifier(random_state=self.random_state, n_jobs=-1)
+            self.tuning_result = successive_halving_search(
+                rf, param_grid, X_train_scaled, y_train, scoring='accuracy',
+                time_budget=tuning_budget, budget_clock=budget_clock, random_state=self.random_state
+            )
+            print_search_report(self.tuning_result)
+            self.model = RandomForestClassifier(random_state=self.random_state, n_jobs=-1,
+                                                **self.tuning_result['best_params'])
+            self.model.fit(X_train_scaled, y_train)
+        elif tune_hyperparameters:
             rf = RandomForestClassifier(random_state=self.random_state, n_jobs=-1)
             grid_search = GridSearchCV(rf, param_grid, cv=5, scoring='accuracy', n_jobs=-1, verbose=1)
             grid_search.fit(X_train_scaled, y_train)
@@ -128,17 +162,22 @@ class StormAlertPredictor:
         
         self.X_train, self.X_test = X_train_scaled, X_test_scaled
         self.y_train, self.y_test = y_train, y_test
+        self.run = TrainingRun(self.model, X_train_scaled, y_train, X_test_scaled, y_test,
+                               self.feature_columns, scoring='accuracy')
+        self.X_recent = None
         
         print("Model training completed!")
         return self.model
     
     def evaluate_model(self):
-        y_train_pred = self.model.predict(self.X_train)
-        y_test_pred = self.model.predict(self.X_test)
+        # Predictions and CV scores are computed once per training run and reused
+        run = require_run(self.run, self.update_metrics is not None)
+        y_train_pred = run.y_train_pred
+        y_test_pred = run.y_test_pred
         
         train_accuracy = accuracy_score(self.y_train, y_train_pred)
         test_accuracy = accuracy_score(self.y_test, y_test_pred)
-        cv_scores = cross_val_score(self.model, self.X_train, self.y_train, cv=5, scoring='accuracy')
+        cv_scores = run.cv_scores
         precision, recall, f1, _ = precision_recall_fscore_support(self.y_test, y_test_pred, average='weighted')
         
         metrics = {
@@ -155,6 +194,8 @@ class StormAlertPredictor:
     def get_feature_importance(self):
         if self.model is None:
             raise ValueError("Model must be trained first")
+        if self.run is not None:
+            return self.run.feature_importance
         importance_df = pd.DataFrame({
             'feature': self.feature_columns,
             'importance': self.model.feature_importances_
@@ -162,6 +203,7 @@ class StormAlertPredictor:
         return importance_df
     
     def plot_results(self, y_test_pred):
+        plt, sns = _plotting()
         fig, axes = plt.subplots(2, 2, figsize=(15, 12))
         
         importance_df = self.get_feature_importance()
@@ -183,8 +225,8 @@ class StormAlertPredictor:
         axes[1, 0].set_ylabel('Count')
         axes[1, 0].legend()
         
-        cv_scores = cross_val_score(self.model, self.X_train, self.y_train, cv=5, scoring='accuracy')
-        axes[1, 1].bar(range(1, 6), cv_scores)
+        cv_scores = require_run(self.run, self.update_metrics is not None).cv_scores
+        axes[1, 1].bar(range(1, len(cv_scores) + 1), cv_scores)
         axes[1, 1].axhline(y=cv_scores.mean(), color='red', linestyle='--', label=f'Mean: {cv_scores.mean():.3f}')
         axes[1, 1].set_title('Cross-Validation Scores')
         axes[1, 1].set_xlabel('Fold')
@@ -203,7 +245,7 @@ class StormAlertPredictor:
         if not available_features:
             raise ValueError("No matching features found in new data")
         
-        X_new = new_data[available_features].copy().fillna(new_data[available_features].median())
+        X_new = new_data[available_features].copy().fillna(self.training_fill_values())
         X_new_scaled = self.scaler.transform(X_new)
         predictions = self.model.predict(X_new_scaled)
         probabilities = self.model.predict_proba(X_new_scaled)
@@ -212,16 +254,61 @@ class StormAlertPredictor:
             predictions = self.label_encoder.inverse_transform(predictions)
         return predictions, probabilities
     
+    def update_model(self, new_data, n_new_trees=50, max_trees=None):
+        # Incremental update from newly labeled readings (see update_scaled_classifier).
+        # Saves and loads exactly like a fully trained model.
+        if self.model is None:
+            raise ValueError("Model must be trained first")
+        if 'risk_level' not in new_data.columns:
+            raise ValueError("Target column 'risk_level' not found in data")
+        
+        X_new = new_data[self.feature_columns].copy().fillna(self.training_fill_values())
+        self.update_metrics = update_scaled_classifier(self.model, self.scaler, self.label_encoder, X_new,
+                                                       new_data['risk_level'], n_new_trees, max_trees)
+        # Metrics of the original training run no longer describe this forest (see require_run)
+        self.run = None
+        self.X_recent = X_new.to_numpy()
+        return self.update_metrics
+    
+    def training_fill_values(self):
+        return training_fill_values(self.fill_values, self.scaler, self.feature_columns)
+    
+    def export_raw_model(self, X_check=None):
+        """Compile the forest with the scaler folded into its split thresholds.
+
+        The returned model scores raw (unscaled) readings and is verified to make
+        identical predictions to scaler + model on X_check (default: the readings of
+        the latest update, else the test split, else samples around the training means).
+        """
+        if self.model is None:
+            raise ValueError("Model must be trained first")
+        if X_check is None and self.X_recent is not None:
+            X_check = self.X_recent
+        elif X_check is None and getattr(self, 'X_test', None) is not None:
+            X_check = self.scaler.inverse_transform(self.X_test)
+        raw_model = compile_verified(self.model, self.scaler, X_check, name="raw-units storm model")
+        print("Raw-units model verified against scaler + model")
+        return raw_model
+    
     def save_model(self, filename='storm_alert_model.pkl'):
         if self.model is None:
             raise ValueError("Model must be trained first")
-        joblib.dump({
+        # The pickle plus the raw-units artifact the serving apps load
+        save_trained_model(filename, {
             'model': self.model,
             'scaler': self.scaler,
             'label_encoder': self.label_encoder,
-            'feature_columns': self.feature_columns
-        }, filename)
-        print(f"Model saved to {filename}")
+            'feature_columns': self.feature_columns,
+            'fill_values': self.fill_values
+        }, self.export_raw_model(), run=self.run, metrics=self.current_metrics())
+    
+    def current_metrics(self):
+        # Evaluation of the training run, or the prequential scores of the latest update
+        return self.evaluate_model()[0] if self.run is not None else self.update_metrics
+    
+    def publish_model(self, filename='storm_alert_model.pkl', activate=True):
+        self.save_model(filename)
+        return publish_trained_model('storm', filename, self.current_metrics(), activate=activate)
     
     def load_model(self, filename='storm_alert_model.pkl'):
         try:
@@ -230,6 +317,9 @@ class StormAlertPredictor:
             self.scaler = model_data['scaler']
             self.label_encoder = model_data['label_encoder']
             self.feature_columns = model_data['feature_columns']
+            self.fill_values = model_data.get('fill_values')
+            self.X_recent = None
+            self.run = self.update_metrics = None
             print(f"Model loaded from {filename}")
         except Exception as e:
             raise RuntimeError(f"Error loading model: {e}")
@@ -0,0 +1,227 @@
+# Vectorized alert evaluation over model outputs for every hazard
+#
+# Each hazard's rule turns a model output column into a numeric score: the
+# formation probability for cyclones, or an ordinal risk level for the labelled
+# models. Thresholds on the score give a severity (the AlertSeverity enum of the
+# Prisma schema, with 0 = no alert). Alert state is kept per key (a region or
+# station id) in flat arrays, and one evaluate() call processes a whole tick of
+# predictions with array operations. Readings in the tick that share a key are
+# reduced to the worst one first.
+#   - Hysteresis: a severity rises as soon as the score crosses its threshold (after
+#     confirm_ticks consecutive ticks), but only falls once the score has been below
+#     threshold - clear_margin for clear_ticks consecutive ticks.
+#   - Deduplication: an open alert is not raised again at the same or a lower
+#     severity. Rising above the highest severity it was raised at is an "escalate".
+#     Falling below min_severity resolves it.
+#   - Cooldown: for cooldown_seconds after an alert resolves, the key does not reopen
+#     unless it reaches a higher severity than the alert that just closed.
+# Only the emitted alerts become Python dicts shaped like the Prisma Alert model.
+#
+#   engine = AlertEngine()
+#   for alert in engine.evaluate("storm", regions, storm_app.predict_columns(columns)):
+#       ...
+
+import time
+import numpy as np
+
+SEVERITIES = ["NONE", "LOW", "MODERATE", "HIGH", "EXTREME"]
+ACTIONS = ["none", "open", "escalate", "resolve"]
+OPEN, ESCALATE, RESOLVE = 1, 2, 3
+
+
+class AlertRule:
+    def __init__(self, alert_type, output, thresholds, labels=None, clear_margin=0.0, confirm_ticks=1,
+                 clear_ticks=3, cooldown_seconds=1800.0, min_severity=2, confidence_prefix=None, title=None):
+        # thresholds[k] is the lowest score at severity k + 1 (LOW, MODERATE, HIGH, EXTREME)
+        self.alert_type = alert_type
+        self.output = output
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.labels = labels
+        self.clear_margin = clear_margin
+        self.confirm_ticks = confirm_ticks
+        self.clear_ticks = clear_ticks
+        self.cooldown_seconds = cooldown_seconds
+        self.min_severity = min_severity
+        self.confidence_prefix = confidence_prefix
+        self.title = title or alert_type.replace("_", " ").title()
+
+    def scores(self, outputs):
+        values = outputs[self.output]
+        if self.labels is None:
+            return np.asarray(values, dtype=np.float64)
+        # Map each distinct label once; labels without a rule score 0
+        uniques, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+        return np.array([self.labels.get(label, 0.0) for label in uniques], dtype=np.float64)[inverse]
+
+    def confidences(self, outputs, scores, severities):
+        # 0-1 confidence for the Alert's mlPrediction: the probability of the predicted
+        # class when the model reports one, else the score itself for probability outputs
+        if self.confidence_prefix is not None:
+            columns = [np.asarray(v, dtype=np.float64) for k, v in outputs.items() if k.startswith(self.confidence_prefix)]
+            if columns:
+                return np.max(np.column_stack(columns), axis=1)
+        if self.labels is None:
+            return np.clip(scores, 0.0, 1.0)
+        return severities / (len(SEVERITIES) - 1)
+
+
+RISK_LEVELS = {"Low": 1, "Moderate": 2, "Medium": 2, "High": 3, "Very High": 4, "Critical": 4}
+
+DEFAULT_RULES = {
+    "storm": AlertRule("STORM_SURGE", "predicted_risk_level", [1, 2, 3, 4], labels=RISK_LEVELS,
+                       confidence_prefix="probability_", title="Storm Surge"),
+    # Same cut-offs as the dashboard: alert from 70%, HIGH from 75%, EXTREME from 85%
+    "cyclone": AlertRule("CYCLONE", "cyclone_formation_probability", [0.5, 0.7, 0.75, 0.85],
+                         clear_margin=0.05, title="Cyclone Formation"),
+    "coastal_erosion": AlertRule("COASTAL_EROSION", "risk_assessment_prediction", [1, 2, 3, 4],
+                                 labels=RISK_LEVELS, clear_ticks=5, cooldown_seconds=6 * 3600.0,
+                                 title="Coastal Erosion"),
+    "pollution": AlertRule("WATER_POLLUTION", "predicted_risk_level", [1, 2, 3, 4], labels=RISK_LEVELS,
+                           title="Water Quality Degradation"),
+}
+
+
+class _AlertState:
+    # Per-key alert state of one hazard, one array entry per key
+    FIELDS = {
+        "level": (np.int8, 0),            # severity after hysteresis
+        "open_severity": (np.int8, 0),    # highest severity raised for the open alert, 0 = none
+        "closed_severity": (np.int8, 0),  # severity of the last resolved alert
+        "up_ticks": (np.int16, 0),
+        "down_ticks": (np.int16, 0),
+        "resolved_at": (np.float64, -np.inf),
+        "last_score": (np.float64, np.nan),
+    }
+
+    def __init__(self, capacity=1024):
+        self.keys = {}
+        self.key_list = []
+        self.capacity = 0
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        for name, (dtype, fill) in self.FIELDS.items():
+            array = np.full(capacity, fill, dtype=dtype)
+            if self.capacity:
+                array[:self.capacity] = getattr(self, name)
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def rows(self, keys):
+        # Look up each distinct key once, then scatter back to every reading
+        uniques, inverse = np.unique(np.asarray(keys), return_inverse=True)
+        unique_rows = np.empty(len(uniques), dtype=np.int64)
+        for i, key in enumerate(uniques.tolist()):
+            row = self.keys.get(key)
+            if row is None:
+                row = self.keys[key] = len(self.key_list)
+                self.key_list.append(key)
+            unique_rows[i] = row
+        if len(self.key_list) > self.capacity:
+            self._grow(max(len(self.key_list), 2 * self.capacity))
+        return unique_rows[inverse.reshape(-1)]
+
+
+class AlertEngine:
+    def __init__(self, rules=None):
+        self.rules = dict(DEFAULT_RULES if rules is None else rules)
+        self.states = {hazard: _AlertState() for hazard in self.rules}
+
+    def evaluate_arrays(self, hazard, keys, outputs, now=None):
+        """One tick for one hazard, as arrays: (index, action, severity, confidence).
+
+        index points into keys/outputs at the worst reading of each key that emitted
+        an alert; action is OPEN, ESCALATE or RESOLVE.
+        """
+        rule, state = self.rules[hazard], self.states[hazard]
+        now = time.time() if now is None else now
+        scores = rule.scores(outputs)
+        rows = state.rows(keys)
+
+        # Worst reading per key: sort by (row, score) and keep the last of each row
+        order = np.lexsort((scores, rows))
+        last = np.flatnonzero(np.r_[rows[order][1:] != rows[order][:-1], True])
+        index = order[last]
+        r, score = rows[index], scores[index]
+
+        level = state.level[r].astype(np.int64)
+        up_level = (score[:, None] >= rule.thresholds[None, :]).sum(axis=1)
+        down_level = (score[:, None] >= rule.thresholds[None, :] - rule.clear_margin).sum(axis=1)
+
+        rising = up_level > level
+        falling = ~rising & (down_level < level)
+        up_ticks = np.where(rising, state.up_ticks[r] + 1, 0)
+        down_ticks = np.where(falling, state.down_ticks[r] + 1, 0)
+        raise_level = rising & (up_ticks >= rule.confirm_ticks)
+        lower_level = falling & (down_ticks >= rule.clear_ticks)
+        level = np.where(raise_level, up_level, np.where(lower_level, down_level, level))
+        changed = raise_level | lower_level
+        state.up_ticks[r] = np.where(changed, 0, up_ticks)
+        state.down_ticks[r] = np.where(changed, 0, down_ticks)
+        state.level[r] = level
+        state.last_score[r] = score
+
+        open_severity = state.open_severity[r].astype(np.int64)
+        alerting = level >= rule.min_severity
+        cooled = (now - state.resolved_at[r] >= rule.cooldown_seconds) | (level > state.closed_severity[r])
+        opening = alerting & (open_severity == 0) & cooled
+        escalating = alerting & (open_severity > 0) & (level > open_severity)
+        resolving = ~alerting & (open_severity > 0)
+
+        state.open_severity[r] = np.where(opening | escalating, level, np.where(resolving, 0, open_severity))
+        state.closed_severity[r] = np.where(resolving, open_severity, state.closed_severity[r])
+        state.resolved_at[r] = np.where(resolving, now, state.resolved_at[r])
+
+        action = np.where(opening, OPEN, np.where(escalating, ESCALATE, np.where(resolving, RESOLVE, 0)))
+        severity = np.where(resolving, open_severity, level)
+        emitted = action > 0
+        confidence = rule.confidences({k: np.asarray(v)[index[emitted]] for k, v in outputs.items()},
+                                      score[emitted], severity[emitted])
+        return index[emitted], action[emitted], severity[emitted], confidence
+
+    def evaluate(self, hazard, keys, outputs, now=None, state=None):
+        """One tick for one hazard; returns the emitted alerts as Alert-shaped dicts.
+
+        keys holds the region (or station) of each prediction, outputs the model's
+        output columns (e.g. an app's predict_columns result). state fills the
+        Alert's state field.
+        """
+        keys = list(keys)
+        index, action, severity, confidence = self.evaluate_arrays(hazard, keys, outputs, now)
+        rule = self.rules[hazard]
+        alerts = []
+        for i, a, s, c in zip(index.tolist(), action.tolist(), severity.tolist(), confidence.tolist()):
+            severity_name = SEVERITIES[s]
+            prediction = {name: _json_value(values[i]) for name, values in outputs.items()}
+            if a == RESOLVE:
+                title = f"{rule.title} Risk Resolved"
+                description = f"{rule.title} risk for {keys[i]} dropped below {SEVERITIES[rule.min_severity]}."
+            else:
+                verb = "Escalated to" if a == ESCALATE else "Detected:"
+                title = f"{severity_name} {rule.title} Risk {'Escalated' if a == ESCALATE else 'Detected'}"
+                description = (f"{verb} {severity_name} {rule.title.lower()} risk for {keys[i]} "
+                               f"({rule.output} = {prediction[rule.output]}, confidence {c:.0%}).")
+            alerts.append({
+                "action": ACTIONS[a],
+                "type": rule.alert_type,
+                "severity": severity_name,
+                "title": title,
+                "description": description,
+                "region": str(keys[i]),
+                "state": state or "Unknown",
+                "predictionData": prediction,
+                "mlPrediction": float(c),
+                "thresholdMet": a != RESOLVE,
+            })
+        return alerts
+
+    def open_alerts(self, hazard):
+        # Keys with an open alert and the severity it was raised at
+        state = self.states[hazard]
+        n = len(state.key_list)
+        rows = np.flatnonzero(state.open_severity[:n] > 0)
+        return {state.key_list[row]: SEVERITIES[state.open_severity[row]] for row in rows.tolist()}
+
+
+def _json_value(value):
+    return value.item() if hasattr(value, "item") else value
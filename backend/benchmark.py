@@ -0,0 +1,374 @@
+# Reproducible inference benchmarks for the four hazard APIs
+#
+#   python benchmark.py                              all hazards, compared with benchmark_baselines.json
+#   python benchmark.py storm pollution --save-baseline
+#   python benchmark.py --threshold 0.3 --output results.json
+#
+# Each hazard is benchmarked in a fresh interpreter, so import time, cold start and
+# peak RSS start from a clean process. Inputs are the model directory's
+# sample_data.json plus readings generated from it with a fixed seed (numeric fields
+# scaled by a random factor around 1, string fields drawn from the labels the model
+# knows), so every run scores the same data. Measured per hazard:
+#   - import_ms: importing the app module, model load included
+#   - cold_start_ms: interpreter start to first prediction, timed from outside (median of --cold-runs)
+#   - in_process: p50/p99 single-reading latency and batch throughput (rows/s) of predict_columns
+#   - asgi: the same through the full FastAPI stack (POST /predict and /predict_batch
+#     through FastAPI's TestClient, no network), JSON encoding and validation included
+#   - import_rss_mb / peak_rss_mb: max resident set size after import and at the end
+#   - training_imports: which of pandas, sklearn, scipy, joblib, matplotlib and seaborn
+#     the app pulled in; any of them fails the run, as does an import_ms over
+#     --import-budget-ms (BENCH_IMPORT_BUDGET_MS, off by default). --imports-only
+#     measures just the import, cold start and RSS, for a quick check
+# MICRO_BATCHING and PREDICTION_CACHE are switched off so every call reaches the model.
+#
+# Results are written as JSON (--output). When a baseline file exists, each metric is
+# compared with it and the run exits 1 if any is worse by more than --threshold
+# (a fraction; BENCH_REGRESSION_THRESHOLD, default 0.2). Throughputs regress when they
+# fall, every other metric when it rises. --save-baseline writes the results as the
+# new baseline instead. Baselines are only meaningful on the machine that wrote them;
+# the environment is recorded alongside and a mismatch is reported.
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tempfile
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES_PATH = os.getenv("BENCH_BASELINES", os.path.join(BACKEND_DIR, "benchmark_baselines.json"))
+REGRESSION_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.2"))
+IMPORT_BUDGET_MS = float(os.getenv("BENCH_IMPORT_BUDGET_MS", "0")) or None
+
+# Training and plotting libraries the serving apps must not import
+TRAINING_MODULES = ["pandas", "sklearn", "scipy", "joblib", "matplotlib", "seaborn"]
+
+BATCH_SIZES = [1, 10, 100, 1000, 10_000, 100_000]
+ASGI_MAX_BATCH = 10_000
+SEED = 20240601
+
+# Serving switches that would let calls skip the model
+BENCH_ENV = {"MICRO_BATCHING": "0", "PREDICTION_CACHE": "0"}
+
+
+def _peak_rss_mb():
+    # VmHWM belongs to this process image; ru_maxrss on Linux carries over the parent's
+    # peak through fork + exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _import_app(hazard):
+    sys.path.insert(0, BACKEND_DIR)
+    from model_registry import load_app
+    return load_app(hazard)
+
+
+def sample_reading(hazard):
+    from model_registry import HAZARDS
+    with open(os.path.join(BACKEND_DIR, HAZARDS[hazard][0], "sample_data.json")) as f:
+        return json.load(f)
+
+
+def _categories(module, field, sample_value):
+    # Labels a string input can take, when the app exposes them (pollution's toxicity_level)
+    fast_model = getattr(module, "_fast_model", None)
+    if field == "toxicity_level" and fast_model is not None:
+        return sorted(fast_model().toxicity_codes)
+    return [sample_value]
+
+
+def generate_columns(module, sample, n_rows, seed=SEED):
+    # n_rows readings as input columns; row 0 is the sample itself
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for field in module.input_columns:
+        value = sample[field]
+        if isinstance(value, str):
+            choices = np.array(_categories(module, field, value), dtype=object)
+            column = choices[rng.integers(len(choices), size=n_rows)]
+        else:
+            column = float(value) * rng.uniform(0.5, 1.5, n_rows) + rng.normal(0.0, 0.1, n_rows)
+        column[0] = value
+        columns[field] = column
+    return columns
+
+
+def _rows(columns, start, stop):
+    return [{field: _json_value(values[i]) for field, values in columns.items()} for i in range(start, stop)]
+
+
+def _json_value(value):
+    return value.item() if hasattr(value, "item") else value
+
+
+def _latency(call, n_calls, warmup=20):
+    for i in range(min(warmup, n_calls)):
+        call(i)
+    gc.collect()
+    timings = np.empty(n_calls)
+    for i in range(n_calls):
+        started = time.perf_counter()
+        call(i)
+        timings[i] = time.perf_counter() - started
+    return {"latency_p50_ms": float(np.percentile(timings, 50) * 1e3),
+            "latency_p99_ms": float(np.percentile(timings, 99) * 1e3)}
+
+
+def _throughput(call, size, min_seconds):
+    # Median time per call over as many calls as fit in min_seconds (at least one, after a warm-up)
+    call()
+    gc.collect()
+    timings = []
+    while not timings or (sum(timings) < min_seconds and len(timings) < 1000):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return size / float(np.median(timings))
+
+
+def bench_in_process(module, columns, sizes, n_calls, min_seconds):
+    single = {field: values[:n_calls] for field, values in columns.items()}
+    result = _latency(lambda i: module.predict_columns({f: v[i:i + 1] for f, v in single.items()}), n_calls)
+    result["throughput"] = {str(size): _throughput(
+        lambda batch={f: v[:size] for f, v in columns.items()}: module.predict_columns(batch), size, min_seconds)
+        for size in sizes}
+    return result
+
+
+def _batch_payload(module, columns, size):
+    # Coastal erosion takes a list of records, the other apps one array per field
+    if hasattr(module, "CoastalErosionBatchInput"):
+        return {"records": _rows(columns, 0, size)}
+    return {field: [_json_value(v) for v in values[:size]] for field, values in columns.items()}
+
+
+def bench_asgi(module, columns, sizes, n_calls, min_seconds):
+    from fastapi.testclient import TestClient
+
+    headers = {"content-type": "application/json"}
+    singles = [json.dumps(row).encode() for row in _rows(columns, 0, n_calls)]
+    batches = {size: json.dumps(_batch_payload(module, columns, size)).encode() for size in sizes}
+
+    with TestClient(module.app) as client:
+        def post(path, body):
+            response = client.post(path, content=body, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+            return response.content
+
+        result = _latency(lambda i: post("/predict", singles[i]), n_calls)
+        result["throughput"] = {str(size): _throughput(lambda body=body: post("/predict_batch", body), size, min_seconds)
+                                for size, body in batches.items()}
+    return result
+
+
+def run_child(hazard, sizes, asgi_max_batch, n_calls, min_seconds, imports_only, output):
+    # Runs in the fresh interpreter: everything but cold start
+    started = time.perf_counter()
+    module = _import_app(hazard)
+    import_ms = (time.perf_counter() - started) * 1e3
+    result = {
+        "import_ms": import_ms,
+        "import_rss_mb": _peak_rss_mb(),
+        "training_imports": [name for name in TRAINING_MODULES if name in sys.modules],
+    }
+    if not imports_only:
+        columns = generate_columns(module, sample_reading(hazard), max(max(sizes), n_calls + 20))
+        result["in_process"] = bench_in_process(module, columns, sizes, n_calls, min_seconds)
+        result["asgi"] = bench_asgi(module, columns, [s for s in sizes if s <= asgi_max_batch], n_calls, min_seconds)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    with open(output, "w") as f:
+        json.dump(result, f)
+
+
+def run_cold_start(hazard):
+    # Import and score the sample once; the parent times the whole process
+    module = _import_app(hazard)
+    sample = sample_reading(hazard)
+    module.predict_columns({field: np.array([sample[field]]) for field in module.input_columns})
+
+
+def _child_env():
+    return {**os.environ, **BENCH_ENV, "PYTHONHASHSEED": "0"}
+
+
+def bench_hazard(hazard, args):
+    cold_starts = []
+    for _ in range(args.cold_runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, __file__, "--cold-start", hazard], check=True, env=_child_env(),
+                       cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cold_starts.append((time.perf_counter() - started) * 1e3)
+
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    try:
+        subprocess.run([sys.executable, __file__, "--child", hazard, "--child-output", output,
+                        "--sizes", ",".join(map(str, args.sizes)), "--asgi-max-batch", str(args.asgi_max_batch),
+                        "--calls", str(args.calls), "--min-seconds", str(args.min_seconds)]
+                       + (["--imports-only"] if args.imports_only else []),
+                       check=True, env=_child_env(), cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            result = json.load(f)
+    finally:
+        os.unlink(output)
+    return {"cold_start_ms": float(np.median(cold_starts)), **result}
+
+
+def environment():
+    from importlib.metadata import version
+    return {"python": platform.python_version(), "numpy": np.__version__, "sklearn": version("scikit-learn"),
+            "machine": platform.machine(), "system": platform.system(), "cpu_count": os.cpu_count()}
+
+
+def flatten(results):
+    # hazard.section.metric -> value, the unit of comparison
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}.{key}" if prefix else key, item)
+        else:
+            flat[prefix] = value
+
+    walk("", results["hazards"])
+    return flat
+
+
+def compare(results, baseline, threshold):
+    # Metrics worse than the baseline by more than threshold: (metric, baseline, current, change)
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for metric, value in current.items():
+        base = previous.get(metric)
+        if not base or not isinstance(value, (int, float)):
+            continue
+        higher_is_better = ".throughput." in metric
+        change = (base - value) / base if higher_is_better else (value - base) / base
+        if change > threshold:
+            regressions.append((metric, base, value, change))
+    return regressions
+
+
+def import_failures(results, budget_ms):
+    failures = []
+    for hazard, result in results["hazards"].items():
+        if result["training_imports"]:
+            failures.append(f"{hazard}: serving imports {', '.join(result['training_imports'])}")
+        if budget_ms and result["import_ms"] > budget_ms:
+            failures.append(f"{hazard}: import took {result['import_ms']:.0f} ms, budget {budget_ms:.0f} ms")
+    return failures
+
+
+def print_summary(results):
+    for hazard, result in results["hazards"].items():
+        print(f"{hazard}: import {result['import_ms']:.0f} ms, cold start {result['cold_start_ms']:.0f} ms, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        if result["training_imports"]:
+            print(f"  imports training libraries: {', '.join(result['training_imports'])}")
+        for section in ("in_process", "asgi"):
+            stats = result.get(section)
+            if stats is None:
+                continue
+            throughput = "  ".join(f"{size}:{rate:,.0f}" for size, rate in stats["throughput"].items())
+            print(f"  {section:<10} p50 {stats['latency_p50_ms']:.3f} ms  p99 {stats['latency_p99_ms']:.3f} ms  "
+                  f"rows/s {throughput}")
+
+
+def main():
+    from model_registry import HAZARDS
+
+    parser = argparse.ArgumentParser(description="Benchmark the hazard prediction apps")
+    parser.add_argument("hazards", nargs="*", metavar="hazard",
+                        help=f"Hazards to benchmark (default: all of {', '.join(HAZARDS)})")
+    parser.add_argument("--sizes", type=lambda s: [int(v) for v in s.split(",")], default=BATCH_SIZES,
+                        help="Comma-separated batch sizes")
+    parser.add_argument("--asgi-max-batch", type=int, default=ASGI_MAX_BATCH,
+                        help="Largest batch sent through the ASGI stack")
+    parser.add_argument("--calls", type=int, default=500, help="Single-reading calls per latency measurement")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="Minimum timed seconds per batch size")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Fresh processes timed for cold start")
+    parser.add_argument("--baseline", default=BASELINES_PATH, help="Baseline JSON to compare with or save to")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Allowed fractional regression before failing")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="Fail when an app takes longer than this to import")
+    parser.add_argument("--imports-only", action="store_true",
+                        help="Only measure import time, cold start and RSS")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    parser.add_argument("--cold-start", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_start:
+        return run_cold_start(args.cold_start)
+    if args.child:
+        return run_child(args.child, args.sizes, args.asgi_max_batch, args.calls, args.min_seconds,
+                         args.imports_only, args.child_output)
+
+    unknown = [hazard for hazard in args.hazards if hazard not in HAZARDS]
+    if unknown:
+        parser.error(f"unknown hazards {unknown}, expected some of {list(HAZARDS)}")
+
+    results = {"environment": environment(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+               "settings": {"sizes": args.sizes, "asgi_max_batch": args.asgi_max_batch, "calls": args.calls,
+                            "min_seconds": args.min_seconds, "cold_runs": args.cold_runs, "seed": SEED,
+                            "imports_only": args.imports_only},
+               "hazards": {}}
+    for hazard in args.hazards or list(HAZARDS):
+        print(f"Benchmarking {hazard}...", file=sys.stderr)
+        results["hazards"][hazard] = bench_hazard(hazard, args)
+    print_summary(results)
+    failures = import_failures(results, args.import_budget_ms)
+    for failure in failures:
+        print(f"FAILED {failure}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baseline = {"hazards": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # Hazards not benchmarked this run keep their previous baseline
+        results = {**results, "hazards": {**baseline.get("hazards", {}), **results["hazards"]}}
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 1 if failures else 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 1 if failures else 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != results["environment"]:
+        print(f"Warning: baseline was recorded on {baseline.get('environment')}, "
+              f"this run is {results['environment']}")
+    regressions = compare(results, baseline, args.threshold)
+    for metric, base, value, change in regressions:
+        print(f"REGRESSION {metric}: {base:,.3f} -> {value:,.3f} ({change:+.0%} worse)")
+    print(f"{len(regressions)} regressions past {args.threshold:.0%}")
+    return 1 if regressions or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# Offline bulk scoring for archived readings
+#
+#   python bulk_score.py storm readings.csv predictions.csv
+#   python bulk_score.py pollution samples.csv.gz scored.ndjson --workers 8 --id-column timestamp
+#
+# The input is read --chunk-rows rows at a time (only the model's input columns, plus
+# --id-column if given). Chunks are scored on a process pool, and results are
+# appended to the output in input order as they complete, so memory stays bounded
+# by the number of chunks in flight. Workers load the memory-mapped model once each,
+# pinned to the version that was active when the run started. Missing values are
+# filled with the model's training-time fill values, so a row's prediction does
+# not depend on which chunk it lands in. A row that still cannot be scored (a value
+# missing with no fill value, such as pollution's toxicity_level, or an unknown label)
+# is written as an error line in its place and counted in the summary.
+# Output is NDJSON for .ndjson/.jsonl paths, CSV otherwise.
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from model_registry import HAZARDS, registry, load_app
+
+_hazard = None
+_module = None
+
+
+def _init_worker(hazard, version):
+    global _hazard, _module
+    _hazard = hazard
+    registry.pin(hazard, version)
+    _module = load_app(hazard)
+
+
+def _score_chunk(chunk, id_column, output_format):
+    # Runs in a worker: fill, score and encode one chunk. Rows that cannot be scored
+    # (a value still missing after filling, an unknown label) are reported in-band at
+    # their position, as /predict_csv does, and the rest of the chunk is scored.
+    import pandas as pd
+
+    fill_values = registry.get(_hazard).get("fill_values")
+    if fill_values:
+        chunk = chunk.fillna({c: v for c, v in fill_values.items() if c in chunk.columns})
+    inputs = chunk[list(_module.input_columns)]
+    errors = {row: f"missing {', '.join(inputs.columns[inputs.loc[row].isna()])}"
+              for row in inputs.index[inputs.isna().any(axis=1)]}
+    scored = chunk.drop(index=list(errors))
+    outputs = {}
+    if len(scored):
+        columns = {c: scored[c].to_numpy() for c in _module.input_columns}
+        try:
+            outputs = _module.predict_columns(columns)
+        except ValueError:
+            # One bad value (e.g. an unknown label) fails the whole call, so score rows one at a time
+            outputs, scored = _score_rows(scored, columns, errors)
+    outputs = pd.DataFrame(outputs, index=scored.index)
+    if id_column is not None:
+        outputs.insert(0, id_column, scored[id_column].to_numpy())
+    if not len(outputs):
+        text = ""
+    elif output_format == "ndjson":
+        text = outputs.to_json(orient="records", lines=True)
+    else:
+        text = outputs.to_csv(index=False, header=False)
+    if not errors:
+        return text, list(outputs.columns), 0
+    lines = dict(zip(outputs.index, text.splitlines(keepends=True)))
+    for row, message in errors.items():
+        lines[row] = _error_line(row, message, output_format)
+    text = "".join(line if line.endswith("\n") else line + "\n" for _, line in sorted(lines.items()))
+    return text, list(outputs.columns) if len(outputs) else None, len(errors)
+
+
+def _score_rows(scored, columns, errors):
+    kept, results = [], []
+    for j, row in enumerate(scored.index):
+        try:
+            results.append(_module.predict_columns({c: values[j:j + 1] for c, values in columns.items()}))
+            kept.append(row)
+        except ValueError as e:
+            errors[row] = str(e)
+    outputs = {name: np.concatenate([np.asarray(r[name]) for r in results]) for name in results[0]} if results else {}
+    return outputs, scored.loc[kept]
+
+
+def _error_line(row, message, output_format):
+    # row counts data rows from 0, as in the input file
+    if output_format == "ndjson":
+        return json.dumps({"error": message, "row": int(row)}) + "\n"
+    return f"# error in row {row}: {message}\n"
+
+
+def _read_chunks(path, input_columns, id_column, chunk_rows):
+    import pandas as pd
+
+    wanted = set(input_columns) | ({id_column} if id_column else set())
+    dtypes = {c: "float64" for c in input_columns if c != "toxicity_level"}
+    reader = pd.read_csv(path, usecols=lambda c: c in wanted, dtype=dtypes, chunksize=chunk_rows)
+    for chunk in reader:
+        missing = wanted - set(chunk.columns)
+        if missing:
+            raise SystemExit(f"{path} is missing columns: {sorted(missing)}")
+        yield chunk
+
+
+def bulk_score(hazard, input_path, output_path, chunk_rows=100_000, workers=None, id_column=None):
+    workers = workers if workers is not None else os.cpu_count()
+    version = registry.store.active_version(hazard)
+    registry.pin(hazard, version)
+    input_columns = load_app(hazard).input_columns
+    output_format = "ndjson" if output_path.endswith((".ndjson", ".jsonl")) else "csv"
+
+    started = time.perf_counter()
+    rows = rejected = 0
+    wrote_header = False
+
+    def write(result, n_rows):
+        nonlocal rows, rejected, wrote_header
+        text, header, n_rejected = result
+        if output_format == "csv" and not wrote_header and header is not None:
+            out.write(",".join(header) + "\n")
+            wrote_header = True
+        out.write(text)
+        rows += n_rows
+        rejected += n_rejected
+        elapsed = time.perf_counter() - started
+        print(f"\r{rows:,} rows  {elapsed:.1f}s  {rows / elapsed:,.0f} rows/s", end="", file=sys.stderr)
+
+    chunks = _read_chunks(input_path, input_columns, id_column, chunk_rows)
+    with open(output_path, "w", newline="") as out:
+        if workers <= 1:
+            _init_worker(hazard, version)
+            for chunk in chunks:
+                write(_score_chunk(chunk, id_column, output_format), len(chunk))
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(hazard, version)) as pool:
+                # Two chunks per worker in flight keeps every core busy without reading ahead unboundedly
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append((pool.submit(_score_chunk, chunk, id_column, output_format), len(chunk)))
+                    if len(in_flight) >= 2 * workers:
+                        future, n_rows = in_flight.popleft()
+                        write(future.result(), n_rows)
+                while in_flight:
+                    future, n_rows = in_flight.popleft()
+                    write(future.result(), n_rows)
+
+    elapsed = time.perf_counter() - started
+    print(f"\nScored {rows:,} {hazard} rows with model {version or 'bundled'} in {elapsed:.1f}s "
+          f"({rows / max(elapsed, 1e-9):,.0f} rows/s, {max(workers, 1)} worker(s))", file=sys.stderr)
+    if rejected:
+        print(f"{rejected:,} rows could not be scored; see the error lines in {output_path}", file=sys.stderr)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score archived readings with a hazard model")
+    parser.add_argument("hazard", choices=list(HAZARDS))
+    parser.add_argument("input", help="CSV file (optionally compressed) with the model's input columns")
+    parser.add_argument("output", help="Output path; .ndjson/.jsonl writes NDJSON, anything else CSV")
+    parser.add_argument("--chunk-rows", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores, 1 = in-process)")
+    parser.add_argument("--id-column", default=None, help="Input column copied to the output to identify each row")
+    args = parser.parse_args()
+    bulk_score(args.hazard, args.input, args.output, args.chunk_rows, args.workers, args.id_column)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Nearest-centroid inference for the pollution model
+#
+# CompiledRiskPredictor scores readings against the centroids of a fitted
+# EnvironmentalRiskPredictor (environmental_model.py). The scaler is folded into one
+# weight matrix, so any number of rows is scored with a single matrix product and
+# argmin. Only numpy is needed, so pollution_app can serve without importing pandas
+# or sklearn.
+
+import numpy as np
+
+
+class CompiledRiskPredictor:
+    def __init__(self, columns, weights, bias, toxicity_codes, risk_levels):
+        self.columns = columns
+        self.weights = weights
+        self.bias = bias
+        self.toxicity_codes = toxicity_codes
+        self.risk_levels = risk_levels
+
+    @classmethod
+    def from_centroids(cls, input_columns, feature_names, mean, scale, centers, toxicity_classes, risk_levels):
+        # ||(x - mean) / scale - c||^2 without the per-row ||x'||^2 term is
+        # x . (-2 c / scale) + (||c||^2 + 2 (mean / scale) . c); zero-filled features only add to the bias
+        weights = np.zeros((len(input_columns), len(centers)))
+        for i, column in enumerate(input_columns):
+            feature = 'toxicity_level_encoded' if column == 'toxicity_level' else column
+            if feature in feature_names:
+                j = feature_names.index(feature)
+                weights[i] = -2.0 * centers[:, j] / scale[j]
+        bias = (centers ** 2).sum(axis=1) + 2.0 * centers @ (mean / scale)
+
+        toxicity_codes = {label: float(code) for code, label in enumerate(toxicity_classes)}
+        return cls(list(input_columns), weights, bias, toxicity_codes, np.array(risk_levels, dtype=object))
+
+    def encode_toxicity(self, values):
+        try:
+            return np.array([self.toxicity_codes[value] for value in values])
+        except KeyError as e:
+            raise ValueError(f"Unknown toxicity_level {e.args[0]!r}. Expected one of {list(self.toxicity_codes)}")
+
+    def nearest(self, X):
+        # Index of the nearest centroid; X holds self.columns in order, with toxicity_level already encoded
+        scores = np.asarray(X, dtype=np.float64) @ self.weights
+        scores += self.bias
+        return np.argmin(scores, axis=1)
+
+    def predict_matrix(self, X):
+        return self.risk_levels[self.nearest(X)]
+
+    def feature_matrix(self, columns):
+        # columns maps each input column to a sequence of values (toxicity_level as labels)
+        n_rows = len(columns[self.columns[0]])
+        X = np.empty((n_rows, len(self.columns)))
+        for i, column in enumerate(self.columns):
+            values = columns[column]
+            X[:, i] = self.encode_toxicity(values) if column == 'toxicity_level' else values
+        return X
+
+    def predict_columns(self, columns):
+        return self.predict_matrix(self.feature_matrix(columns))
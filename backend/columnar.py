@@ -0,0 +1,11 @@
+# Columnar (one array per feature) batch payloads for the hazard APIs
+
+from typing import List
+from pydantic import create_model
+
+
+# Build a batch schema with one list per field of a single-reading schema
+def columnar_model(input_model, name=None):
+    fields = {field: (List[field_type], ...) for field, field_type in input_model.__annotations__.items()}
+    return create_model(name or f"{input_model.__name__}Columns", **fields)
+
@@ -0,0 +1,171 @@
+# Streamed CSV upload scoring shared by the hazard APIs
+#
+# POST a CSV body (header row first) to /predict_csv. It is parsed and scored
+# CSV_CHUNK_ROWS rows at a time while the upload is still arriving, and predictions
+# stream back as NDJSON (default) or CSV (?format=csv or Accept: text/csv).
+# Only one chunk is held in memory at a time, whatever the size of the file.
+# Columns other than the model inputs are ignored; records must not contain
+# embedded newlines. Rows with a NaN or infinite input ("nan", "inf", "1e999") are
+# reported as errors and not scored, as the JSON and matrix bodies reject them.
+
+import os
+import io
+import csv
+import json
+import codecs
+import numpy as np
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "1024"))
+
+
+class UploadStreamingResponse(StreamingResponse):
+    # The body generator reads the upload itself, so skip Starlette's disconnect
+    # listener: it would consume the request body messages the generator needs
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+async def _lines(request):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for data in request.stream():
+        pending += decoder.decode(data)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def csv_matrix(columns, names):
+    # columns maps each CSV column to a list of strings
+    try:
+        return np.column_stack([np.array(columns[name], dtype=np.float64) for name in names])
+    except ValueError as e:
+        raise ValueError(f"Non-numeric value in CSV: {e}")
+
+
+def response_format(request):
+    requested = request.query_params.get("format")
+    if requested is None:
+        requested = "csv" if "text/csv" in request.headers.get("accept", "") else "ndjson"
+    if requested not in ("ndjson", "csv"):
+        raise HTTPException(status_code=422, detail=f"Unknown format '{requested}'. Expected ndjson or csv")
+    return requested
+
+
+def _flatten(result):
+    # {"class_probabilities": {"High": 0.2}} -> {"class_probabilities_High": 0.2}
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                flat[f"{key}_{sub_key}"] = sub_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def _non_finite_rows(columns):
+    # Row position -> first numeric column whose value is NaN or infinite. Columns that
+    # do not parse as numbers are left to score_chunk, which reports them.
+    rejected = {}
+    for name, values in columns.items():
+        try:
+            array = np.array(values, dtype=np.float64)
+        except ValueError:
+            continue
+        for i in np.flatnonzero(~np.isfinite(array)).tolist():
+            rejected.setdefault(i, name)
+    return rejected
+
+
+class _ChunkScorer:
+    def __init__(self, column_index, score_chunk, fmt):
+        self.column_index = column_index
+        self.score_chunk = score_chunk
+        self.fmt = fmt
+        self.rows_scored = 0
+        self.csv_header = None
+
+    def __call__(self, lines):
+        # Runs on the threadpool: parse, score and encode one chunk
+        first_row = self.rows_scored
+        self.rows_scored += len(lines)
+        try:
+            records = list(csv.reader(lines))
+            columns = {name: [record[i] for record in records] for name, i in self.column_index.items()}
+            rejected = _non_finite_rows(columns)
+            if rejected:
+                kept = [i for i in range(len(records)) if i not in rejected]
+                columns = {name: [values[i] for i in kept] for name, values in columns.items()}
+            results = iter(self.score_chunk(columns) if len(rejected) < len(records) else [])
+        except (ValueError, IndexError) as e:
+            # The status line is already sent, so a bad chunk is reported in-band and skipped
+            message = str(e) if isinstance(e, ValueError) else "Row has fewer fields than the header"
+            return self._error(first_row, self.rows_scored - 1, message)
+
+        rows = []
+        for i in range(len(records)):
+            if i in rejected:
+                rows.append(self._error(first_row + i, first_row + i,
+                                        f"Field '{rejected[i]}' must be a finite number (no NaN/inf)"))
+            else:
+                rows.append({"row": first_row + i, **next(results)})
+        if self.fmt == "ndjson":
+            return "".join(row if isinstance(row, str) else json.dumps(row) + "\n" for row in rows)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for row in rows:
+            if isinstance(row, str):
+                out.write(row)
+                continue
+            row = _flatten(row)
+            if self.csv_header is None:
+                self.csv_header = list(row)
+                writer.writerow(self.csv_header)
+            writer.writerow([row.get(name) for name in self.csv_header])
+        return out.getvalue()
+
+    def _error(self, first_row, last_row, message):
+        # One in-band error line (NDJSON object or CSV comment) covering first_row..last_row
+        if self.fmt == "ndjson":
+            return json.dumps({"error": message, "first_row": first_row, "last_row": last_row}) + "\n"
+        return f"# error in rows {first_row}-{last_row}: {message}\n"
+
+
+async def score_csv_upload(request, input_columns, score_chunk):
+    # score_chunk(columns) -> one result dict per row, where columns maps each of
+    # input_columns to a list of raw CSV strings
+    fmt = response_format(request)
+    lines = _lines(request)
+    header = None
+    async for line in lines:
+        if line.strip():
+            header = next(csv.reader([line]))
+            break
+    if header is None:
+        raise HTTPException(status_code=422, detail="CSV upload is empty")
+    header = [name.strip() for name in header]
+    missing = [name for name in input_columns if name not in header]
+    if missing:
+        raise HTTPException(status_code=422, detail=f"CSV is missing columns: {missing}")
+    scorer = _ChunkScorer({name: header.index(name) for name in input_columns}, score_chunk, fmt)
+
+    async def body():
+        chunk = []
+        async for line in lines:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) >= CHUNK_ROWS:
+                yield await run_in_threadpool(scorer, chunk)
+                chunk = []
+        if chunk:
+            yield await run_in_threadpool(scorer, chunk)
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    return UploadStreamingResponse(body(), media_type=media_type)
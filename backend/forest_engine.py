@@ -0,0 +1,433 @@
+# Array-backed random forest inference
+#
+# Flattens a fitted sklearn RandomForestClassifier / RandomForestRegressor into
+# contiguous node arrays. Small batches walk every tree for a block of rows at once.
+# From COMPILED_TREE_ROWS rows on, the node arrays are handed to sklearn's Cython tree
+# traversal. A forest with a folded scaler compares float64 readings, so there each
+# split threshold becomes its rank among the feature's thresholds and each input its
+# rank among them too, and sklearn's float32 comparisons give exactly the float64
+# answers. Those trees are built once, on a background thread, so neither startup nor
+# the first large batch waits for the sklearn import. Until they are ready (or without
+# sklearn), batches from TREE_MAJOR_ROWS rows on walk one tree at a time through an
+# implicit binary heap (children of slot i at 2i+1, 2i+2).
+# Inputs are cast to float32 and leaf values are summed in tree order, exactly as
+# sklearn does, so predictions and probabilities are identical to the original.
+# fold_scaler() pushes a fitted StandardScaler into the split thresholds so the
+# forest can be evaluated on raw (unscaled) readings.
+
+import os
+import threading
+import numpy as np
+
+# Rows evaluated per block; bounds the (rows x trees x outputs) leaf-value buffer
+BLOCK_ROWS = 1024
+# Batches from this size on go through sklearn's compiled tree traversal once it is built
+COMPILED_TREE_ROWS = 128
+# Otherwise, batches from this size on are scored tree by tree. Both large-batch paths
+# take TREE_BLOCK_ROWS rows at a time, so a block's buffers stay in cache
+TREE_MAJOR_ROWS = 2048
+TREE_BLOCK_ROWS = 8192
+# Deeper trees are walked through their child arrays instead of a heap of 2^(depth+1) slots
+HEAP_MAX_DEPTH = 14
+
+
+class CompiledForest:
+    # children[2 * node + go_left] -> next node, so each level needs a single gather
+    def __init__(self, feature, threshold, children, values, roots,
+                 max_depth, n_features, classes_=None, missing_go_to_left=None, input_dtype=np.float32):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.values = values
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features)
+        self.classes_ = classes_
+        self.missing_go_to_left = missing_go_to_left
+        self.n_estimators = len(roots)
+        self.input_dtype = np.dtype(input_dtype)
+        self._tree_layouts = None
+        self._compiled_trees = None
+        self._compiled_trees_claimed = threading.Lock()
+
+    @property
+    def children_left(self):
+        return self.children[1::2]
+
+    @property
+    def children_right(self):
+        return self.children[0::2]
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        from sklearn import __version__ as sklearn_version
+        # sklearn < 1.4 stores class counts in tree_.value and normalises them in predict_proba
+        normalize_counts = tuple(int(part) for part in sklearn_version.split(".")[:2]) < (1, 4)
+
+        classes = getattr(forest, "classes_", None)
+        if classes is not None and np.ndim(forest.n_classes_) != 0:
+            raise ValueError("Multi-output forests are not supported")
+
+        features, thresholds, lefts, rights, values, missing, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Multi-output forests are not supported")
+            node_ids = np.arange(tree.node_count) + offset
+
+            # Leaves point at themselves so every row can take max_depth steps
+            is_leaf = tree.children_left == -1
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+
+            value = tree.value[:, 0, :]
+            if classes is not None:
+                value = value[:, :len(classes)].copy()
+                if normalize_counts:
+                    # Same per-tree normalisation as DecisionTreeClassifier.predict_proba
+                    normalizer = value.sum(axis=1)[:, np.newaxis]
+                    normalizer[normalizer == 0.0] = 1.0
+                    value /= normalizer
+            values.append(value)
+
+            if hasattr(tree, "missing_go_to_left"):
+                missing.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+            roots.append(offset)
+            offset += tree.node_count
+
+        children = np.stack([np.concatenate(rights), np.concatenate(lefts)], axis=1).ravel()
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            children=np.ascontiguousarray(children, dtype=np.intp),
+            values=np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max(estimator.tree_.max_depth for estimator in forest.estimators_),
+            n_features=forest.n_features_in_,
+            classes_=classes,
+            missing_go_to_left=np.concatenate(missing) if len(missing) == len(roots) else None,
+        )
+
+    # Node arrays plus scalar settings, as stored in a model artifact
+    def to_arrays(self):
+        arrays = {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "children": self.children,
+            "values": self.values,
+            "roots": self.roots,
+        }
+        if self.classes_ is not None:
+            arrays["classes"] = np.asarray(self.classes_)
+        if self.missing_go_to_left is not None:
+            arrays["missing_go_to_left"] = self.missing_go_to_left
+        settings = {
+            "max_depth": self.max_depth,
+            "n_features": self.n_features_in_,
+            "input_dtype": self.input_dtype.str,
+        }
+        return arrays, settings
+
+    # Wraps the given arrays without copying, so memory-mapped buffers stay shared
+    @classmethod
+    def from_arrays(cls, arrays, settings):
+        return cls(
+            feature=arrays["feature"],
+            threshold=arrays["threshold"],
+            children=arrays["children"],
+            values=arrays["values"],
+            roots=arrays["roots"],
+            max_depth=settings["max_depth"],
+            n_features=settings["n_features"],
+            classes_=arrays.get("classes"),
+            missing_go_to_left=arrays.get("missing_go_to_left"),
+            input_dtype=settings["input_dtype"],
+        )
+
+    def _check_input(self, X):
+        # sklearn evaluates trees on float32 inputs; raw-units forests compare float64 readings
+        X = np.asarray(X, dtype=self.input_dtype)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected input of shape (n_rows, {self.n_features_in_}), got {X.shape}")
+        return X
+
+    def apply(self, X):
+        X = np.ascontiguousarray(self._check_input(X))
+        flat_X = X.ravel()
+        row_offsets = (np.arange(len(X)) * X.shape[1])[:, np.newaxis]
+        node = np.repeat(self.roots[np.newaxis, :], len(X), axis=0)
+        check_missing = self.missing_go_to_left is not None and np.isnan(X).any()
+        for _ in range(self.max_depth):
+            x = flat_X.take(row_offsets + self.feature.take(node))
+            go_left = x <= self.threshold.take(node)
+            if check_missing:
+                go_left |= np.isnan(x) & self.missing_go_to_left.take(node)
+            node = self.children.take(2 * node + go_left)
+        return node
+
+    def _heap_layouts(self):
+        # Per tree: (depth, heap slot -> node or None, node features, thresholds, missing flags).
+        # Leaves point at themselves, so slots below a leaf repeat it and any branch keeps it.
+        if self._tree_layouts is None:
+            children_left, children_right = self.children_left, self.children_right
+            layouts = []
+            for root in self.roots:
+                level, levels = np.array([root]), []
+                while (children_left[level] != level).any():
+                    levels.append(level)
+                    level = np.stack([children_left[level], children_right[level]], axis=1).ravel()
+                depth = len(levels)
+                if depth > HEAP_MAX_DEPTH:
+                    layouts.append((depth, None, None, None, None))
+                    continue
+                heap = np.concatenate(levels + [level])
+                missing = None if self.missing_go_to_left is None else self.missing_go_to_left[heap]
+                layouts.append((depth, heap, self.feature[heap], self.threshold[heap], missing))
+            self._tree_layouts = layouts
+        return self._tree_layouts
+
+    def _tree_major_sum(self, X, out):
+        # Add every tree's leaf values for the rows of X into out, tree by tree in order
+        n_rows = len(X)
+        flat_X = np.ascontiguousarray(X.T).ravel()
+        rows = np.arange(n_rows)
+        check_missing = self.missing_go_to_left is not None and np.isnan(flat_X).any()
+        slot = np.empty(n_rows, dtype=np.intp)
+        index = np.empty(n_rows, dtype=np.intp)
+        x = np.empty(n_rows, dtype=flat_X.dtype)
+        threshold = np.empty(n_rows)
+        go_right = np.empty(n_rows, dtype=bool)
+        for root, (depth, heap, feature, node_threshold, missing) in zip(self.roots, self._heap_layouts()):
+            if heap is None:
+                leaf = self._walk_tree(root, depth, flat_X, n_rows)
+            else:
+                # feature * n_rows + row indexes the transposed X
+                feature = feature * n_rows
+                slot.fill(0)
+                for _ in range(depth):
+                    np.take(feature, slot, out=index, mode="clip")
+                    index += rows
+                    np.take(flat_X, index, out=x, mode="clip")
+                    np.take(node_threshold, slot, out=threshold, mode="clip")
+                    np.greater(x, threshold, out=go_right)
+                    if check_missing:
+                        go_right |= np.isnan(x) & ~missing.take(slot)
+                    slot *= 2
+                    slot += 1
+                    slot += go_right
+                leaf = heap.take(slot)
+            out += self.values.take(leaf, axis=0)
+
+    def _walk_tree(self, root, depth, flat_X, n_rows):
+        # Leaf of one tree for every row of a transposed, flattened X, through the child arrays
+        rows = np.arange(n_rows)
+        check_missing = self.missing_go_to_left is not None and np.isnan(flat_X).any()
+        node = np.full(n_rows, root, dtype=np.intp)
+        for _ in range(depth):
+            x = flat_X.take(self.feature.take(node) * n_rows + rows)
+            go_left = x <= self.threshold.take(node)
+            if check_missing:
+                go_left |= np.isnan(x) & self.missing_go_to_left.take(node)
+            node = self.children.take(2 * node + go_left)
+        return node
+
+    def _start_compiled_trees(self):
+        # Build the sklearn trees once, off the request path; the lock is never released
+        if self._compiled_trees_claimed.acquire(blocking=False):
+            threading.Thread(target=self._build_compiled_trees, name="forest-engine-trees", daemon=True).start()
+
+    def _build_compiled_trees(self):
+        # One sklearn Tree per estimator over threshold ranks, plus each feature's sorted
+        # thresholds to rank the inputs against. Leaves the fallback paths on without sklearn.
+        try:
+            from sklearn.tree._tree import Tree, NODE_DTYPE
+        except ImportError:
+            return
+        node_ids = np.arange(len(self.feature))
+        internal = self.children_left != node_ids
+        if self.input_dtype == np.float32:
+            # The thresholds are sklearn's own and the inputs already float32
+            levels, ranks = None, np.where(internal, self.threshold, -2.0)
+        else:
+            levels, ranks = [], np.full(len(node_ids), -2.0)
+            for f in range(self.n_features_in_):
+                split = internal & (self.feature == f)
+                levels.append(np.unique(self.threshold[split]))
+                ranks[split] = np.searchsorted(levels[-1], self.threshold[split])
+
+        trees = []
+        bounds = np.append(self.roots, len(node_ids))
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            leaf = ~internal[start:stop]
+            nodes = np.zeros(stop - start, dtype=NODE_DTYPE)
+            nodes["left_child"] = np.where(leaf, -1, self.children_left[start:stop] - start)
+            nodes["right_child"] = np.where(leaf, -1, self.children_right[start:stop] - start)
+            nodes["feature"] = np.where(leaf, -2, self.feature[start:stop])
+            nodes["threshold"] = ranks[start:stop]
+            if self.missing_go_to_left is not None:
+                nodes["missing_go_to_left"] = self.missing_go_to_left[start:stop]
+            tree = Tree(self.n_features_in_, np.array([1], dtype=np.intp), 1)
+            tree.__setstate__({"max_depth": self.max_depth, "node_count": len(nodes), "nodes": nodes,
+                               "values": np.zeros((len(nodes), 1, 1))})
+            trees.append((start, tree))
+        self._compiled_trees = (levels, trees)
+
+    def _compiled_tree_sum(self, X, out):
+        # x <= threshold exactly when x's rank among the feature's thresholds is <= the threshold's
+        levels, trees = self._compiled_trees
+        if levels is None:
+            ranks = np.ascontiguousarray(X)
+        else:
+            ranks = np.empty(X.shape, dtype=np.float32)
+            for f, thresholds in enumerate(levels):
+                ranks[:, f] = np.searchsorted(thresholds, X[:, f])
+            missing = np.isnan(X)
+            if missing.any():
+                ranks[missing] = np.nan
+        for start, tree in trees:
+            leaf = tree.apply(ranks)
+            leaf += start
+            out += self.values.take(leaf, axis=0)
+
+    def _mean_leaf_value(self, X):
+        X = self._check_input(X)
+        out = np.zeros((len(X), self.values.shape[1]))
+        if len(X) >= COMPILED_TREE_ROWS:
+            self._start_compiled_trees()
+        if len(X) >= COMPILED_TREE_ROWS and self._compiled_trees is not None:
+            # Trees are added one after another, matching sklearn's accumulation order
+            for start in range(0, len(X), TREE_BLOCK_ROWS):
+                self._compiled_tree_sum(X[start:start + TREE_BLOCK_ROWS], out[start:start + TREE_BLOCK_ROWS])
+        elif len(X) >= TREE_MAJOR_ROWS:
+            # Trees are added one after another, matching sklearn's accumulation order
+            for start in range(0, len(X), TREE_BLOCK_ROWS):
+                self._tree_major_sum(X[start:start + TREE_BLOCK_ROWS], out[start:start + TREE_BLOCK_ROWS])
+        else:
+            for start in range(0, len(X), BLOCK_ROWS):
+                leaf_values = self.values[self.apply(X[start:start + BLOCK_ROWS])]
+                # cumsum adds strictly tree by tree, matching sklearn's accumulation order
+                out[start:start + BLOCK_ROWS] = np.cumsum(leaf_values, axis=1)[:, -1]
+        out /= self.n_estimators
+        return out
+
+    def predict_proba(self, X):
+        if self.classes_ is None:
+            raise AttributeError("predict_proba is only available for classifiers")
+        return self._mean_leaf_value(X)
+
+    def predict(self, X):
+        mean = self._mean_leaf_value(X)
+        if self.classes_ is None:
+            return mean[:, 0]
+        return self.classes_.take(np.argmax(mean, axis=1), axis=0)
+
+
+# Map float64 values to int64 keys with the same ordering, and back
+def _flip_negative(bits):
+    return bits ^ ((bits >> 63) & np.int64(0x7FFFFFFFFFFFFFFF))
+
+
+def _float_keys(x):
+    return _flip_negative(np.asarray(x, dtype=np.float64).view(np.int64))
+
+
+def _keys_to_float(keys):
+    return _flip_negative(keys).view(np.float64)
+
+
+def fold_scaler(compiled, scaler):
+    # sklearn sends a raw reading x left when float32((x - mean) / scale) <= threshold.
+    # That test is monotone in x, so it equals x <= T for the largest float64 T that
+    # still goes left. T is found exactly by bisecting over the ordered float64 values.
+    node_ids = np.arange(len(compiled.feature))
+    internal = compiled.children_left != node_ids
+    feature = compiled.feature[internal]
+    threshold = compiled.threshold[internal]
+    mean = scaler.mean_[feature] if scaler.with_mean else np.zeros(len(feature))
+    scale = scaler.scale_[feature] if scaler.with_std else np.ones(len(feature))
+
+    def goes_left(x, idx):
+        scaled = x
+        if scaler.with_mean:
+            scaled = scaled - mean[idx]
+        if scaler.with_std:
+            scaled = scaled / scale[idx]
+        return scaled.astype(np.float32) <= threshold[idx]
+
+    # Bracket the boundary around the algebraic answer, widening until it holds
+    everything = np.arange(len(feature))
+    guess = threshold * scale + mean
+    width = 1e-6 * (np.abs(guess) + np.abs(mean) + scale * (np.abs(threshold) + 1.0))
+    for _ in range(64):
+        lo, hi = guess - width, guess + width
+        bad = ~(goes_left(lo, everything) & ~goes_left(hi, everything))
+        if not bad.any():
+            break
+        width[bad] *= 16
+    else:
+        raise ValueError("Could not bracket folded thresholds")
+
+    lo_keys, hi_keys = _float_keys(lo), _float_keys(hi)
+    while True:
+        active = np.flatnonzero(hi_keys - lo_keys > 1)
+        if len(active) == 0:
+            break
+        mid_keys = lo_keys[active] + (hi_keys[active] - lo_keys[active]) // 2
+        left = goes_left(_keys_to_float(mid_keys), active)
+        lo_keys[active[left]] = mid_keys[left]
+        hi_keys[active[~left]] = mid_keys[~left]
+
+    raw_threshold = compiled.threshold.copy()
+    raw_threshold[internal] = _keys_to_float(lo_keys)
+    return CompiledForest(
+        feature=compiled.feature,
+        threshold=raw_threshold,
+        children=compiled.children,
+        values=compiled.values,
+        roots=compiled.roots,
+        max_depth=compiled.max_depth,
+        n_features=compiled.n_features_in_,
+        classes_=compiled.classes_,
+        missing_go_to_left=compiled.missing_go_to_left,
+        input_dtype=np.float64,
+    )
+
+
+# Compile a fitted forest for serving (FOREST_ENGINE=sklearn keeps the sklearn estimator).
+# With a scaler the returned model takes raw readings: it is folded into the thresholds,
+# or chained in front of the sklearn estimator.
+def compile_forest(forest, scaler=None):
+    if os.getenv("FOREST_ENGINE", "compiled") == "sklearn":
+        if scaler is None:
+            return forest
+        from sklearn.pipeline import make_pipeline
+        return make_pipeline(scaler, forest)
+    compiled = CompiledForest.from_sklearn(forest)
+    return compiled if scaler is None else fold_scaler(compiled, scaler)
+
+
+# True when the compiled forest reproduces the sklearn forest exactly on X
+def matches_sklearn(forest, compiled, X):
+    if not np.array_equal(forest.predict(X), compiled.predict(X)):
+        return False
+    if hasattr(forest, "predict_proba"):
+        return np.array_equal(forest.predict_proba(X), compiled.predict_proba(X))
+    return True
+
+
+# True when a folded forest matches scaler + forest on X and on both sides of every split
+def matches_scaled_sklearn(forest, scaler, raw_model, X):
+    from sklearn.pipeline import make_pipeline
+    X = np.asarray(X, dtype=np.float64)
+    internal = np.flatnonzero(raw_model.children_left != np.arange(len(raw_model.feature)))
+    feature = raw_model.feature[internal]
+    threshold = raw_model.threshold[internal]
+
+    # One row exactly on each folded threshold and one a single float64 step above it
+    boundary = np.repeat(X[:1], 2 * len(internal), axis=0)
+    boundary[0::2][np.arange(len(internal)), feature] = threshold
+    boundary[1::2][np.arange(len(internal)), feature] = np.nextafter(threshold, np.inf)
+    return matches_sklearn(make_pipeline(scaler, forest), raw_model, np.vstack([X, boundary]))
@@ -0,0 +1,119 @@
+# Budgeted successive-halving search for the random forest hyperparameters
+#
+# Every configuration in the grid (minus n_estimators) starts with a few trees,
+# each fitted on a small bootstrap sample, and is scored on fixed CV folds. Each
+# round keeps the best 1/factor of the configurations and grows their forests
+# (warm_start, so trees already fitted are kept) with more trees and larger
+# samples, until one configuration is left at the full forest size. The search
+# stops early when the wall-clock or CPU budget runs out, and the best
+# configuration from the furthest round wins. The winner is refitted on all
+# training data by the caller.
+
+import math
+import time
+import itertools
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import KFold, StratifiedKFold
+
+MIN_TREES = 10
+MIN_SAMPLE_FRACTION = 0.1
+
+
+def _configurations(param_grid):
+    names = sorted(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[n] for n in names))]
+
+
+def successive_halving_search(estimator, param_grid, X, y, scoring, cv=3, factor=3,
+                              time_budget=None, budget_clock="wall", random_state=None):
+    # param_grid may list n_estimators; its largest value is the final forest size
+    param_grid = dict(param_grid)
+    max_trees = max(param_grid.pop("n_estimators", [estimator.get_params()["n_estimators"]]))
+    configs = _configurations(param_grid)
+    n_rounds = math.ceil(math.log(len(configs), factor)) + 1 if len(configs) > 1 else 1
+
+    splitter = StratifiedKFold if is_classifier(estimator) else KFold
+    folds = list(splitter(n_splits=cv, shuffle=True, random_state=random_state).split(X, y))
+    scorer = get_scorer(scoring)
+    clock = time.process_time if budget_clock == "cpu" else time.perf_counter
+    started = clock()
+
+    def take(data, index):
+        return data.iloc[index] if hasattr(data, "iloc") else data[index]
+
+    # One warm-started forest per configuration and fold
+    candidates = [{
+        "params": params,
+        "forests": [clone(estimator).set_params(warm_start=True, **params) for _ in folds],
+        "scores": [],
+        "seconds": 0.0,
+    } for params in configs]
+    survivors = candidates
+    out_of_budget = False
+
+    # Trees and sample share per round, growing by factor up to the full forest on all samples;
+    # every round adds trees, since warm_start only fits the new ones
+    schedule = []
+    for round_index in range(n_rounds):
+        share = factor ** (round_index - n_rounds + 1)
+        n_trees = max(MIN_TREES, round(max_trees * share))
+        if schedule:
+            n_trees = max(n_trees, schedule[-1][0] + MIN_TREES)
+        schedule.append((n_trees, max(MIN_SAMPLE_FRACTION, share) if share < 1 else None))
+    schedule[-1] = (max(max_trees, schedule[-1][0]), None)
+
+    for round_index, (n_trees, sample_fraction) in enumerate(schedule):
+        for candidate in survivors:
+            if time_budget is not None and clock() - started > time_budget:
+                out_of_budget = True
+                break
+            candidate_started = time.perf_counter()
+            fold_scores = []
+            for forest, (train_index, test_index) in zip(candidate["forests"], folds):
+                forest.set_params(n_estimators=n_trees, max_samples=sample_fraction)
+                forest.fit(take(X, train_index), take(y, train_index))
+                fold_scores.append(scorer(forest, take(X, test_index), take(y, test_index)))
+            candidate["seconds"] += time.perf_counter() - candidate_started
+            candidate["scores"].append({"trees": n_trees, "sample_fraction": sample_fraction or 1.0,
+                                        "score": sum(fold_scores) / len(fold_scores)})
+        if out_of_budget:
+            break
+        if round_index < n_rounds - 1:
+            keep = max(1, math.ceil(len(survivors) / factor))
+            survivors = sorted(survivors, key=lambda c: c["scores"][-1]["score"], reverse=True)[:keep]
+            # Forests of eliminated configurations are no longer needed
+            survivor_ids = {id(c) for c in survivors}
+            for candidate in candidates:
+                if id(candidate) not in survivor_ids:
+                    candidate["forests"] = []
+
+    # Best of the configurations that got furthest, by their latest score
+    scored = [c for c in candidates if c["scores"]]
+    if not scored:
+        raise RuntimeError(f"Tuning budget of {time_budget}s ran out before any configuration was scored")
+    best = max(scored, key=lambda c: (len(c["scores"]), c["scores"][-1]["score"]))
+    return {
+        "best_params": {**best["params"], "n_estimators": schedule[-1][0]},
+        "best_score": best["scores"][-1]["score"],
+        "best_round": len(best["scores"]),
+        "rounds": n_rounds,
+        "elapsed_seconds": clock() - started,
+        "budget_clock": budget_clock,
+        "out_of_budget": out_of_budget,
+        "configurations": [
+            {"params": c["params"], "seconds": c["seconds"], "scores": c["scores"]}
+            for c in sorted(scored, key=lambda c: (len(c["scores"]), c["scores"][-1]["score"]), reverse=True)
+        ],
+    }
+
+
+def print_search_report(result, top=10):
+    print(f"Best parameters: {result['best_params']} "
+          f"(CV score {result['best_score']:.4f}, round {result['best_round']}/{result['rounds']})")
+    budget_note = ", stopped by budget" if result["out_of_budget"] else ""
+    print(f"Search took {result['elapsed_seconds']:.1f}s {result['budget_clock']} time{budget_note}")
+    for config in result["configurations"][:top]:
+        last = config["scores"][-1]
+        print(f"  {config['params']}: {last['score']:.4f} at {last['trees']} trees / "
+              f"{last['sample_fraction']:.0%} samples, {config['seconds']:.2f}s")
@@ -0,0 +1,68 @@
+# FASTAPI Multi-Hazard Prediction Gateway
+# Serves storm, cyclone, coastal erosion and pollution models from one process:
+#   uvicorn gateway_app:app --port 8000
+
+import os
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from anyio import to_thread
+from model_registry import HAZARDS, registry, load_app
+from serving_metrics import TimedRoute, metrics_response
+
+# Size of the thread pool shared by every hazard's (sync) prediction endpoints
+WORKER_THREADS = int(os.getenv("GATEWAY_WORKER_THREADS", "40"))
+
+# Import each hazard app once; they all load their models through the shared registry
+hazard_apps = {hazard: load_app(hazard) for hazard in HAZARDS}
+
+app = FastAPI(title="Coastal Threat Prediction Gateway")
+app.router.route_class = TimedRoute
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+@app.on_event("startup")
+def configure_worker_pool():
+    to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
+
+
+for hazard, module in hazard_apps.items():
+    app.add_api_route(f"/predict/{hazard}", module.predict, methods=["POST"], tags=[hazard])
+    app.add_api_route(f"/predict_batch/{hazard}", module.predict_batch, methods=["POST"], tags=[hazard],
+                      openapi_extra=module.predict_batch_openapi)
+    app.add_api_route(f"/predict_csv/{hazard}", module.predict_csv, methods=["POST"], tags=[hazard])
+
+
+@app.get("/batching/stats")
+def read_batching_stats():
+    return {hazard: module.read_batching_stats() for hazard, module in hazard_apps.items()}
+
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return {hazard: module.read_cache_stats() for hazard, module in hazard_apps.items()}
+
+
+# Per-stage latency histograms of every hazard (Prometheus text format)
+@app.get("/metrics")
+def read_metrics():
+    return metrics_response()
+
+
+@app.get("/models")
+def read_model_versions():
+    return {hazard: module.read_model_version() for hazard, module in hazard_apps.items()}
+
+
+@app.get("/")
+def read_root():
+    return {
+        "message": "Coastal Threat Prediction Gateway is running. Use POST /predict/{hazard} or /predict_batch/{hazard}.",
+        "hazards": list(hazard_apps),
+        "loaded_models": registry.loaded(),
+    }
@@ -0,0 +1,264 @@
+# Gridded hazard scoring into memory-mapped output arrays
+#
+#   python grid_score.py storm coast_grid/ storm_heatmap/
+#   python grid_score.py cyclone fields.npz cyclone_heatmap/ --tile 512 --workers 8
+#
+# The input is a directory with one <feature>.npy per model input field, or an .npz
+# holding the same arrays (unpacked once into the output directory so they can be
+# memory-mapped). Every field is a 2-D (lat, lon) grid of the same shape. NaN cells
+# are filled with the model's training-time fill values; cells where every input is
+# missing (land, no data) are left empty in the outputs.
+#
+# The grid is scored tile by tile on a process pool. Each worker memory-maps the
+# inputs and outputs and writes its tile in place, so RAM stays at a few tiles
+# whatever the grid size. The output directory holds one .npy per model output:
+# int16 class codes for label outputs (-1 = empty) and float32 for the rest
+# (NaN = empty). manifest.json lists the classes, the model version and a hash of
+# each tile's inputs. A rerun scores only the tiles whose hash changed; a new model
+# version, a retrained bundled model (new artifact or pickle files) or new fill
+# values change every hash.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from numpy.lib.format import open_memmap
+from model_registry import HAZARDS, registry, load_app
+
+MANIFEST = "manifest.json"
+INPUT_CACHE = "inputs"
+
+_hazard = None
+_module = None
+
+
+def _init_worker(hazard, version):
+    global _hazard, _module
+    _hazard = hazard
+    registry.pin(hazard, version)
+    _module = load_app(hazard)
+
+
+def prepare_inputs(input_path, feature_names, output_dir):
+    # Directory of <feature>.npy files to memory-map; .npz archives are unpacked one field at a time
+    if not input_path.endswith(".npz"):
+        return input_path
+    input_dir = os.path.join(output_dir, INPUT_CACHE)
+    os.makedirs(input_dir, exist_ok=True)
+    with np.load(input_path) as archive:
+        for name in feature_names:
+            if name not in archive.files:
+                raise SystemExit(f"{input_path} has no '{name}' grid")
+            target = os.path.join(input_dir, f"{name}.npy")
+            if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(input_path):
+                np.save(target, archive[name])
+    return input_dir
+
+
+def open_inputs(input_dir, feature_names):
+    grids = {}
+    for name in feature_names:
+        path = os.path.join(input_dir, f"{name}.npy")
+        if not os.path.exists(path):
+            raise SystemExit(f"Missing input grid {path}")
+        grids[name] = np.load(path, mmap_mode="r")
+    shapes = {grid.shape for grid in grids.values()}
+    if len(shapes) != 1 or len(next(iter(shapes))) != 2:
+        raise SystemExit(f"Input grids must share one 2-D shape, got { {n: g.shape for n, g in grids.items()} }")
+    return grids, shapes.pop()
+
+
+def tile_origins(shape, tile):
+    return [(row, col) for row in range(0, shape[0], tile) for col in range(0, shape[1], tile)]
+
+
+def model_fingerprint(source):
+    # Name, size and modification time of every file the model was loaded from
+    paths = [source] if os.path.isfile(source) else \
+        [os.path.join(source, name) for name in sorted(os.listdir(source))]
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def tile_hash(grids, row, col, tile, seed):
+    digest = hashlib.blake2b(seed.encode(), digest_size=16)
+    for name in sorted(grids):
+        digest.update(np.ascontiguousarray(grids[name][row:row + tile, col:col + tile]).tobytes())
+    return digest.hexdigest()
+
+
+def tile_columns(grids, row, col, tile, fill_values):
+    # Flattened input columns of one tile, filled, plus a mask of the cells with any input
+    columns, present = {}, None
+    for name, grid in grids.items():
+        values = np.asarray(grid[row:row + tile, col:col + tile]).reshape(-1)
+        if values.dtype.kind in "US":
+            has_value = values != ""
+            values = values.astype(str).astype(object)
+        else:
+            values = values.astype(np.float64)
+            has_value = ~np.isnan(values)
+            if name in fill_values:
+                values = np.where(has_value, values, fill_values[name])
+        present = has_value if present is None else present | has_value
+        columns[name] = values
+    return columns, present
+
+
+def _class_codes(labels, classes):
+    uniques, inverse = np.unique(np.asarray(labels).astype(str), return_inverse=True)
+    lookup = {label: code for code, label in enumerate(classes)}
+    try:
+        return np.array([lookup[label] for label in uniques.tolist()], dtype=np.int16)[inverse.reshape(-1)]
+    except KeyError as e:
+        raise ValueError(f"Model returned label {e.args[0]!r} outside its classes {classes}")
+
+
+def score_tile(output_dir, input_dir, feature_names, outputs, row, col, tile):
+    # Runs in a worker: score one tile and write it straight into the output memmaps
+    grids, _ = open_inputs(input_dir, feature_names)
+    fill_values = registry.get(_hazard).get("fill_values") or {}
+    columns, present = tile_columns(grids, row, col, tile, fill_values)
+    tile_shape = grids[feature_names[0]][row:row + tile, col:col + tile].shape
+    cells = np.flatnonzero(present)
+    scored = _module.predict_columns({c: values[cells] for c, values in columns.items()}) if len(cells) else {}
+
+    for name, classes in outputs.items():
+        if classes is not None:
+            block = np.full(present.shape, -1, dtype=np.int16)
+            if len(cells):
+                block[cells] = _class_codes(scored[name], classes)
+        else:
+            block = np.full(present.shape, np.nan, dtype=np.float32)
+            if len(cells):
+                block[cells] = scored[name]
+        out = np.load(os.path.join(output_dir, f"{name}.npy"), mmap_mode="r+")
+        out[row:row + tile, col:col + tile] = block.reshape(tile_shape)
+        out.flush()
+        del out
+    return len(cells)
+
+
+def _output_classes(module, model_data, grids, tile, fill_values):
+    # Score one non-empty cell to learn the output columns; label outputs take the model's classes
+    for row, col in tile_origins(next(iter(grids.values())).shape, tile):
+        columns, present = tile_columns(grids, row, col, tile, fill_values)
+        cells = np.flatnonzero(present)[:1]
+        if len(cells):
+            break
+    else:
+        raise SystemExit("Every grid cell is empty; nothing to score")
+    probe = module.predict_columns({c: values[cells] for c, values in columns.items()})
+    label_classes = model_data.get("label_classes")
+    classes = list(dict.fromkeys(str(label) for label in (label_classes if label_classes is not None else [])))
+    return {name: (classes if np.asarray(values).dtype.kind in "OUS" else None) for name, values in probe.items()}
+
+
+def _read_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def grid_score(hazard, input_path, output_dir, tile=256, workers=None, force=False):
+    workers = workers if workers is not None else os.cpu_count()
+    os.makedirs(output_dir, exist_ok=True)
+    version = registry.store.active_version(hazard)
+    registry.pin(hazard, version)
+    module = load_app(hazard)
+    model_data = registry.get(hazard)
+    feature_names = list(module.input_columns)
+    fill_values = model_data.get("fill_values") or {}
+
+    input_dir = prepare_inputs(input_path, feature_names, output_dir)
+    grids, shape = open_inputs(input_dir, feature_names)
+    outputs = _output_classes(module, model_data, grids, tile, fill_values)
+
+    # Output layout: when it changes, every tile is re-scored into fresh arrays
+    layout = {"hazard": hazard, "shape": list(shape), "tile": tile, "outputs": outputs}
+    manifest = _read_manifest(output_dir)
+    same_layout = not force and all(manifest.get(k) == v for k, v in layout.items()) and \
+        all(os.path.exists(os.path.join(output_dir, f"{name}.npy")) for name in outputs)
+    if not same_layout:
+        for name, classes in outputs.items():
+            dtype, empty = (np.int16, -1) if classes is not None else (np.float32, np.nan)
+            out = open_memmap(os.path.join(output_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+            out[:] = empty
+            out.flush()
+            del out
+    previous = manifest.get("tiles", {}) if same_layout else {}
+
+    # Bundled models all report version "bundled", so the files behind the model go in too
+    seed = json.dumps({"model_version": model_data.get("version"), "model_files": model_fingerprint(model_data["source"]),
+                       "fill_values": fill_values}, sort_keys=True, default=str)
+    hashes = {f"{row},{col}": tile_hash(grids, row, col, tile, seed) for row, col in tile_origins(shape, tile)}
+    changed = [key for key, digest in hashes.items() if previous.get(key) != digest]
+
+    # Tiles about to be rewritten are dropped from the manifest first, so an interrupted
+    # run never leaves half-written tiles marked as up to date
+    manifest = {**layout, "model_version": model_data.get("version"),
+                "tiles": {key: digest for key, digest in hashes.items() if key not in changed}}
+    _write_manifest(output_dir, manifest)
+
+    started = time.perf_counter()
+    cells = 0
+    print(f"{len(changed)} of {len(hashes)} tiles to score ({shape[0]}x{shape[1]} grid, {tile}x{tile} tiles)",
+          file=sys.stderr)
+    args = (output_dir, input_dir, feature_names, outputs)
+    if workers <= 1:
+        _init_worker(hazard, version)
+        for done, key in enumerate(changed, 1):
+            row, col = map(int, key.split(","))
+            cells += score_tile(*args, row, col, tile)
+            manifest["tiles"][key] = hashes[key]
+            _report(done, len(changed), cells, started)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(hazard, version)) as pool:
+            futures = {pool.submit(score_tile, *args, *map(int, key.split(",")), tile): key for key in changed}
+            for done, future in enumerate(as_completed(futures), 1):
+                cells += future.result()
+                manifest["tiles"][futures[future]] = hashes[futures[future]]
+                _report(done, len(changed), cells, started)
+    _write_manifest(output_dir, manifest)
+
+    elapsed = time.perf_counter() - started
+    print(f"\nScored {cells:,} {hazard} cells in {len(changed)} tiles with model {version or 'bundled'} "
+          f"in {elapsed:.1f}s ({cells / max(elapsed, 1e-9):,.0f} cells/s)", file=sys.stderr)
+    return len(changed)
+
+
+def _report(done, total, cells, started):
+    elapsed = time.perf_counter() - started
+    print(f"\r{done}/{total} tiles  {cells:,} cells  {elapsed:.1f}s", end="", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score gridded input fields with a hazard model")
+    parser.add_argument("hazard", choices=list(HAZARDS))
+    parser.add_argument("input", help="Directory of <feature>.npy grids, or an .npz archive of them")
+    parser.add_argument("output", help="Directory for the memory-mapped output grids and manifest.json")
+    parser.add_argument("--tile", type=int, default=256, help="Tile edge in cells")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores, 1 = in-process)")
+    parser.add_argument("--force", action="store_true", help="Re-score every tile")
+    args = parser.parse_args()
+    grid_score(args.hazard, args.input, args.output, args.tile, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Incremental model updates from newly labeled readings
+#
+# Forests grow by warm start: the new trees are fitted on the new readings only,
+# and the oldest trees can be retired to keep the forest at a fixed size.
+# StandardScaler statistics are updated with partial_fit. Since the existing trees
+# were fitted in the old scaled space, their split thresholds are moved so each
+# split stays at the same raw value. K-means centres move towards the new points
+# with per-cluster running means, as in mini-batch k-means. update_scaled_classifier
+# runs the whole update of a scaler + forest classifier.
+
+import numpy as np
+from sklearn.base import is_classifier
+from sklearn.metrics import accuracy_score
+from sklearn.utils.class_weight import compute_class_weight
+
+
+def partial_fit_scaler(scaler, X):
+    # Returns the (mean, scale) the scaler had before this update
+    old_mean = scaler.mean_.copy() if scaler.with_mean else np.zeros(scaler.n_features_in_)
+    old_scale = scaler.scale_.copy() if scaler.with_std else np.ones(scaler.n_features_in_)
+    scaler.partial_fit(X)
+    return old_mean, old_scale
+
+
+def rescale_forest(forest, scaler, old_mean, old_scale):
+    # Keep every split of the existing trees at the same raw-units threshold under the updated scaler
+    new_mean = scaler.mean_ if scaler.with_mean else np.zeros_like(old_mean)
+    new_scale = scaler.scale_ if scaler.with_std else np.ones_like(old_scale)
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        internal = tree.feature >= 0
+        feature = tree.feature[internal]
+        raw = tree.threshold[internal] * old_scale[feature] + old_mean[feature]
+        tree.threshold[internal] = (raw - new_mean[feature]) / new_scale[feature]
+
+
+def grow_forest(forest, X, y, n_new_trees, max_trees=None):
+    # Add n_new_trees fitted on (X, y), then drop the oldest trees beyond max_trees
+    y = np.asarray(y)
+    sample_weight = np.ones(len(y))
+    restore = {"warm_start": False}
+    if is_classifier(forest):
+        # The "balanced" presets would weigh classes by this batch only, and give classes
+        # missing from it infinite weight, so the batch's balanced weights are passed explicitly
+        if forest.class_weight in ("balanced", "balanced_subsample"):
+            restore["class_weight"] = forest.class_weight
+            present = np.unique(y)
+            weights = dict(zip(forest.classes_, np.ones(len(forest.classes_))))
+            weights.update(zip(present, compute_class_weight("balanced", classes=present, y=y)))
+            forest.set_params(class_weight=weights)
+        # A batch that lacks some classes would give the new trees a narrower output than
+        # the old ones, so each missing class gets one zero-weight placeholder row
+        missing = np.setdiff1d(forest.classes_, y)
+        if len(missing):
+            X = np.asarray(X, dtype=np.float64)
+            X = np.vstack([X, np.repeat(X.mean(axis=0, keepdims=True), len(missing), axis=0)])
+            y = np.concatenate([y, missing.astype(y.dtype)])
+            sample_weight = np.concatenate([sample_weight, np.zeros(len(missing))])
+
+    forest.set_params(warm_start=True, n_estimators=len(forest.estimators_) + n_new_trees)
+    forest.fit(X, y, sample_weight=sample_weight)
+    forest.set_params(**restore)
+    if max_trees is not None and len(forest.estimators_) > max_trees:
+        forest.estimators_ = forest.estimators_[-max_trees:]
+        forest.set_params(n_estimators=max_trees)
+    return forest
+
+
+def update_scaled_classifier(forest, scaler, label_encoder, X, labels, n_new_trees, max_trees=None):
+    # X holds the raw (unscaled) features of newly labeled readings. The current scaler + forest
+    # is scored on them first (prequential accuracy), then the scaler statistics are updated
+    # with the existing splits kept in place, and n_new_trees trees fitted on them are added,
+    # retiring the oldest trees beyond max_trees. Returns the metrics of the update.
+    y = np.asarray(labels)
+    if hasattr(label_encoder, "classes_"):
+        y = label_encoder.transform(y)
+
+    metrics = {
+        "update_samples": len(y),
+        "prequential_accuracy": accuracy_score(y, forest.predict(scaler.transform(X))),
+    }
+    old_mean, old_scale = partial_fit_scaler(scaler, X)
+    rescale_forest(forest, scaler, old_mean, old_scale)
+    grow_forest(forest, scaler.transform(X), y, n_new_trees, max_trees)
+    metrics["n_trees"] = len(forest.estimators_)
+    print(f"Model updated with {len(y)} readings: accuracy on them before the update "
+          f"{metrics['prequential_accuracy']:.4f}, {metrics['n_trees']} trees")
+    return metrics
+
+
+def update_centres(centres, counts, X_scaled):
+    # Move each centre to the running mean of every point assigned to it so far
+    distances = ((X_scaled[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+    labels = distances.argmin(axis=1)
+    centres = centres.copy()
+    counts = counts.copy()
+    for cluster in np.unique(labels):
+        members = X_scaled[labels == cluster]
+        counts[cluster] += len(members)
+        centres[cluster] += (members - centres[cluster]).sum(axis=0) / counts[cluster]
+    return centres, counts
@@ -0,0 +1,519 @@
+# Asyncio sensor ingest service: sources -> bounded per-hazard queues -> batched
+# validation and scoring -> prediction subscribers
+#
+#   python ingest_service.py --tail readings.ndjson --listen 0.0.0.0:9000 --publish 0.0.0.0:9001
+#
+# A reading is one JSON object (one per line for the file and socket sources):
+#   {"hazard": "storm", "station": "buoy-17", "timestamp": "2024-05-01T10:00:00Z", "data": {...}}
+# where "data" holds the model's input fields ("data" may be left out and the fields
+# put at the top level).
+#
+# Every hazard has a bounded queue. When it is full, the source that feeds it waits:
+# the file tail stops reading, and socket clients stop being read, so TCP pushes back
+# on the sender. A worker per hazard drains its queue into batches of up to
+# INGEST_BATCH_SIZE readings (or whatever arrived within INGEST_MAX_WAIT_MS). Batches
+# are validated column-wise, with missing fields filled at the model's training
+# values, and scored with the app's predict_columns off the event loop: on a thread
+# pool, or with INGEST_MODEL_WORKERS=N on N worker processes (one core each) that load
+# their own memory-mapped models. At most INGEST_MAX_CONCURRENCY batches are in the
+# model at once. Predictions are published to subscribers one scored batch at a time.
+# A subscriber that falls behind loses its oldest predictions rather than slowing the
+# pipeline down.
+# With --rolling-features, derived inputs (pressure_trend, storm_surge_frequency) that
+# a reading leaves out are computed from the station's recent history.
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from model_registry import HAZARDS, registry, load_app
+from rolling_features import RollingFeatureEngine, DERIVED_FIELDS
+
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "20000"))
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "2048"))
+MAX_WAIT_MS = float(os.getenv("INGEST_MAX_WAIT_MS", "20"))
+MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "4"))
+MODEL_WORKERS = int(os.getenv("INGEST_MODEL_WORKERS", "0"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("INGEST_SUBSCRIBER_QUEUE_SIZE", "10000"))
+
+
+class InvalidReading(ValueError):
+    pass
+
+
+def _timestamp_seconds(timestamp):
+    if timestamp is None:
+        return time.time()
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    return float(timestamp)
+
+
+def parse_reading(item):
+    # Source items are JSON text (str/bytes) or already-decoded dicts
+    if isinstance(item, (str, bytes)):
+        try:
+            item = json.loads(item)
+        except ValueError as e:
+            raise InvalidReading(f"Invalid JSON: {e}")
+    if not isinstance(item, dict):
+        raise InvalidReading("A reading must be a JSON object")
+    hazard = item.get("hazard")
+    if hazard not in HAZARDS:
+        raise InvalidReading(f"Unknown hazard {hazard!r}. Expected one of {list(HAZARDS)}")
+    data = item.get("data")
+    if data is None:
+        data = {k: v for k, v in item.items() if k not in ("hazard", "station", "timestamp")}
+    elif not isinstance(data, dict):
+        raise InvalidReading("'data' must be a JSON object")
+    return {"hazard": hazard, "station": item.get("station"), "timestamp": item.get("timestamp"), "data": data}
+
+
+# -------------------- Sources --------------------
+# A source is any async iterable of readings (JSON text or dicts).
+
+async def queue_source(queue):
+    # Readings put on an asyncio.Queue by code in the same process; None ends the source
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        yield item
+
+
+async def tail_source(path, from_start=False, poll_seconds=0.2, follow=True):
+    # New lines appended to an NDJSON file; with follow=False, stop at the end of the file
+    with open(path, "rb") as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        partial = b""
+        while True:
+            lines = await asyncio.to_thread(f.readlines, 1 << 20)
+            if not lines:
+                if not follow:
+                    return
+                await asyncio.sleep(poll_seconds)
+                continue
+            lines[0] = partial + lines[0]
+            partial = b"" if lines[-1].endswith(b"\n") else lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+
+
+async def socket_source(host, port, queue_size=QUEUE_SIZE):
+    # NDJSON over TCP from any number of clients. The shared queue is bounded, so a
+    # full pipeline stops the reads and TCP flow control slows the senders down.
+    lines = asyncio.Queue(maxsize=queue_size)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await lines.put(line)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, limit=1 << 20)
+    print(f"Listening for readings on {host}:{port}", file=sys.stderr)
+    async with server:
+        while True:
+            yield await lines.get()
+
+
+# -------------------- Subscribers --------------------
+
+def prediction_event(result, i):
+    event = {"hazard": result["hazard"], "station": result["stations"][i], "timestamp": result["timestamps"][i],
+             "model_version": result["model_version"]}
+    for name, values in result["outputs"].items():
+        event[name] = values[i]
+    return event
+
+
+class Subscription:
+    # Holds whole scored batches and turns them into one event per reading only as the
+    # subscriber reads them. Past max_pending unread readings, the oldest batches are
+    # dropped so a slow subscriber never blocks the pipeline.
+    def __init__(self, hub, hazards, max_pending):
+        self.hub = hub
+        self.hazards = set(hazards) if hazards else None
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._results = deque()
+        self._next_row = 0
+        self._pending = 0
+        self._ready = asyncio.Event()
+
+    def offer(self, result):
+        if self.hazards is not None and result["hazard"] not in self.hazards:
+            return
+        self._results.append(result)
+        self._pending += len(result["stations"])
+        while self._pending > self.max_pending and len(self._results) > 1:
+            unread = len(self._results.popleft()["stations"]) - self._next_row
+            self._next_row = 0
+            self._pending -= unread
+            self.dropped += unread
+        self._ready.set()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def drain_nowait(self):
+        # Every unread event, without waiting for more
+        events = []
+        while self._results:
+            result = self._results.popleft()
+            events += [prediction_event(result, i) for i in range(self._next_row, len(result["stations"]))]
+            self._next_row = 0
+        self._pending = 0
+        return events
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._results:
+            self._ready.clear()
+            await self._ready.wait()
+        result = self._results[0]
+        event = prediction_event(result, self._next_row)
+        self._next_row += 1
+        self._pending -= 1
+        if self._next_row == len(result["stations"]):
+            self._results.popleft()
+            self._next_row = 0
+        return event
+
+
+class PredictionHub:
+    def __init__(self):
+        self.subscriptions = set()
+        self.published = 0
+
+    def subscribe(self, hazards=None, max_pending=SUBSCRIBER_QUEUE_SIZE):
+        subscription = Subscription(self, hazards, max_pending)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, result):
+        for subscription in self.subscriptions:
+            subscription.offer(result)
+        self.published += len(result["stations"])
+
+
+# -------------------- Service --------------------
+
+class IngestService:
+    def __init__(self, hazards=None, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_concurrency=MAX_CONCURRENCY, model_workers=MODEL_WORKERS, features=None):
+        self.hazards = list(hazards or HAZARDS)
+        self.apps = {hazard: load_app(hazard) for hazard in self.hazards}
+        self.queues = {hazard: asyncio.Queue(maxsize=queue_size) for hazard in self.hazards}
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_concurrency = max_concurrency
+        self.features = features
+        self.hub = PredictionHub()
+        # Threads share this process's models; worker processes load their own and use more cores
+        if model_workers > 0:
+            self.executor = ProcessPoolExecutor(model_workers, initializer=_init_worker, initargs=(self.hazards,))
+        else:
+            self.executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="ingest-model")
+        self.stats = {"received": 0, "invalid": 0, "rejected": 0, "scored": 0, "batches": 0}
+        self.last_errors = []
+        self._slots = None
+        self._in_flight = set()
+
+    def _record_error(self, error):
+        self.last_errors = (self.last_errors + [str(error)])[-20:]
+
+    async def run(self, *sources):
+        # Consume every source to its end, then drain the queues; cancel to stop a live service
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        workers = [asyncio.create_task(self._batch_worker(hazard)) for hazard in self.hazards]
+        try:
+            await asyncio.gather(*(self._pump(source) for source in sources))
+            for queue in self.queues.values():
+                await queue.join()
+            if self._in_flight:
+                await asyncio.gather(*self._in_flight)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _pump(self, source):
+        async for item in source:
+            self.stats["received"] += 1
+            try:
+                reading = parse_reading(item)
+            except InvalidReading as e:
+                self.stats["invalid"] += 1
+                self._record_error(e)
+                continue
+            if reading["hazard"] not in self.queues:
+                self.stats["invalid"] += 1
+                self._record_error(f"Hazard {reading['hazard']!r} is not ingested by this service")
+                continue
+            if self.features is not None and reading["station"] is not None:
+                self._add_rolling_features(reading)
+            # Waits while the hazard's queue is full: this is the backpressure point
+            await self.queues[reading["hazard"]].put(reading)
+
+    def _add_rolling_features(self, reading):
+        data = reading["data"]
+        try:
+            timestamp = _timestamp_seconds(reading["timestamp"])
+        except (TypeError, ValueError):
+            return
+        self.features.update(reading["station"], data, timestamp)
+        wanted = [f for f in DERIVED_FIELDS if f in self.apps[reading["hazard"]].input_columns and data.get(f) is None]
+        if wanted:
+            data.update(self.features.input_row(reading["station"], wanted))
+
+    async def _batch_worker(self, hazard):
+        queue = self.queues[hazard]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                if queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(queue.get_nowait())
+            # Wait for a model slot before taking more readings off the queue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._score_and_publish(hazard, batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _score_and_publish(self, hazard, batch):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, score_batch, hazard, batch)
+            self.stats["batches"] += 1
+            self.stats["scored"] += len(result["stations"])
+            self.stats["rejected"] += result["rejected"]
+            for error in result["errors"][-3:]:
+                self._record_error(error)
+            if result["stations"]:
+                self.hub.publish(result)
+        except Exception as e:
+            self.stats["rejected"] += len(batch)
+            self._record_error(f"{hazard} batch failed: {e}")
+        finally:
+            self._slots.release()
+            for _ in batch:
+                self.queues[hazard].task_done()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def read_stats(self):
+        return {
+            **self.stats,
+            "published": self.hub.published,
+            "queue_depth": {hazard: queue.qsize() for hazard, queue in self.queues.items()},
+            "batches_in_model": len(self._in_flight),
+            "subscribers": len(self.hub.subscriptions),
+            "subscriber_drops": sum(s.dropped for s in self.hub.subscriptions),
+            "last_errors": self.last_errors,
+        }
+
+
+def _validate_columns(module, hazard, batch):
+    # Build one array per input column; rows with non-numeric values, or with missing
+    # values and no training fill value, are rejected
+    fill_values = registry.get(hazard).get("fill_values") or {}
+    n_rows = len(batch)
+    valid = np.ones(n_rows, dtype=bool)
+    errors = []
+    columns = {}
+    for column in module.input_columns:
+        values = [reading["data"].get(column) for reading in batch]
+        if column == "toxicity_level":
+            missing = np.array([value is None for value in values])
+            columns[column] = np.array([str(value) for value in values], dtype=object)
+        else:
+            try:
+                array = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                array = np.empty(n_rows)
+                for i, value in enumerate(values):
+                    try:
+                        array[i] = np.nan if value is None else float(value)
+                    except (TypeError, ValueError):
+                        array[i] = np.nan
+                        valid[i] = False
+                        errors.append(f"{hazard} reading from {batch[i]['station']}: {column}={value!r} is not a number")
+            missing = np.isnan(array)
+            if missing.any() and column in fill_values:
+                array[missing] = fill_values[column]
+                missing[:] = False
+            columns[column] = array
+        if missing.any():
+            for i in np.flatnonzero(missing & valid)[:3]:
+                errors.append(f"{hazard} reading from {batch[i]['station']} is missing {column}")
+            valid &= ~missing
+    return columns, valid, errors
+
+
+def _init_worker(hazards):
+    for hazard in hazards:
+        load_app(hazard)
+
+
+def score_batch(hazard, batch):
+    # Runs on the model thread or process pool. Returns the batch's predictions column-wise:
+    # stations, timestamps and outputs hold one entry per accepted reading, in order.
+    module = load_app(hazard)
+    columns, valid, errors = _validate_columns(module, hazard, batch)
+    rows = np.flatnonzero(valid)
+    if len(rows) < len(batch):
+        columns = {c: values[rows] for c, values in columns.items()}
+    outputs = {}
+    if len(rows):
+        try:
+            outputs = module.predict_columns(columns)
+        except ValueError:
+            # One bad value (e.g. an unknown label) fails the whole call, so score rows one at a time
+            outputs, rows = _score_rows(module, hazard, columns, rows, batch, errors)
+    rows = rows.tolist()
+    return {
+        "hazard": hazard,
+        "model_version": registry.get(hazard).get("version"),
+        "stations": [batch[i]["station"] for i in rows],
+        "timestamps": [batch[i]["timestamp"] for i in rows],
+        "outputs": {name: np.asarray(values).tolist() for name, values in outputs.items()},
+        "rejected": len(batch) - len(rows),
+        "errors": errors,
+    }
+
+
+def _score_rows(module, hazard, columns, rows, batch, errors):
+    scored_rows, scored = [], []
+    for j, i in enumerate(rows.tolist()):
+        try:
+            scored.append(module.predict_columns({c: values[j:j + 1] for c, values in columns.items()}))
+            scored_rows.append(i)
+        except ValueError as e:
+            errors.append(f"{hazard} reading from {batch[i]['station']}: {e}")
+    if not scored:
+        return {}, np.array([], dtype=np.int64)
+    outputs = {name: np.concatenate([np.asarray(o[name]) for o in scored]) for name in scored[0]}
+    return outputs, np.array(scored_rows, dtype=np.int64)
+
+
+# -------------------- Command line --------------------
+
+async def _serve_subscribers(hub, host, port, hazards):
+    # Every client that connects gets the prediction stream as NDJSON
+    async def handle(reader, writer):
+        subscription = hub.subscribe(hazards)
+        try:
+            async for event in subscription:
+                writer.write((json.dumps(event) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            subscription.close()
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Publishing predictions on {host}:{port}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def _print_predictions(subscription):
+    async for event in subscription:
+        sys.stdout.write(json.dumps(event) + "\n")
+
+
+async def _report_stats(service, every_seconds):
+    previous, started = 0, time.perf_counter()
+    while True:
+        await asyncio.sleep(every_seconds)
+        stats = service.read_stats()
+        rate = (stats["scored"] - previous) / every_seconds
+        previous = stats["scored"]
+        print(f"[{time.perf_counter() - started:,.0f}s] scored {stats['scored']:,} ({rate:,.0f}/s), "
+              f"rejected {stats['rejected']:,}, invalid {stats['invalid']:,}, queues {stats['queue_depth']}",
+              file=sys.stderr)
+
+
+def _host_port(value):
+    host, _, port = value.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+async def main_async(args):
+    service = IngestService(hazards=args.hazard, model_workers=args.model_workers,
+                            features=RollingFeatureEngine() if args.rolling_features else None)
+    sources = [tail_source(path, from_start=args.from_start, follow=not args.no_follow) for path in args.tail]
+    sources += [socket_source(*_host_port(address)) for address in args.listen]
+    if not sources:
+        raise SystemExit("Give at least one --tail file or --listen address")
+
+    background = [asyncio.create_task(_report_stats(service, args.stats_seconds))]
+    if args.publish:
+        background.append(asyncio.create_task(_serve_subscribers(service.hub, *_host_port(args.publish), args.hazard)))
+    printed = service.hub.subscribe(args.hazard) if args.stdout else None
+    if printed is not None:
+        background.append(asyncio.create_task(_print_predictions(printed)))
+    try:
+        await service.run(*sources)
+    finally:
+        for task in background:
+            task.cancel()
+        if printed is not None:
+            for event in printed.drain_nowait():
+                sys.stdout.write(json.dumps(event) + "\n")
+        service.close()
+        print(json.dumps(service.read_stats()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest sensor readings and publish hazard predictions")
+    parser.add_argument("--tail", action="append", default=[], help="NDJSON file to follow (repeatable)")
+    parser.add_argument("--from-start", action="store_true", help="Read tailed files from the beginning")
+    parser.add_argument("--no-follow", action="store_true", help="Stop at the end of tailed files")
+    parser.add_argument("--listen", action="append", default=[], help="host:port accepting NDJSON readings (repeatable)")
+    parser.add_argument("--publish", help="host:port streaming predictions as NDJSON to every client")
+    parser.add_argument("--stdout", action="store_true", help="Write predictions to stdout as NDJSON")
+    parser.add_argument("--hazard", action="append", choices=list(HAZARDS), help="Only ingest these hazards")
+    parser.add_argument("--rolling-features", action="store_true",
+                        help="Compute pressure_trend / storm_surge_frequency from station history when absent")
+    parser.add_argument("--model-workers", type=int, default=MODEL_WORKERS,
+                        help="Score on this many worker processes (default: threads in this process)")
+    parser.add_argument("--stats-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Opt-in micro-batching of concurrent single-reading /predict calls
+#
+# Enable with MICRO_BATCHING=1. Requests that arrive within MICRO_BATCH_MAX_WAIT_MS
+# of each other (up to MICRO_BATCH_MAX_SIZE of them) are scored in one model call.
+
+import os
+import asyncio
+from starlette.concurrency import run_in_threadpool
+
+
+class MicroBatcher:
+    def __init__(self, predict_many, max_batch_size=32, max_wait_ms=2.0):
+        # predict_many(rows) -> one result per row, in order
+        self.predict_many = predict_many
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self._in_flight = 0
+        self.requests = 0
+        self.batches = 0
+        self.batch_size_counts = {}
+
+    @classmethod
+    def from_env(cls, predict_many):
+        if os.getenv("MICRO_BATCHING", "0").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            predict_many,
+            max_batch_size=int(os.getenv("MICRO_BATCH_MAX_SIZE", "32")),
+            max_wait_ms=float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2")),
+        )
+
+    async def submit(self, row):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        self._record_batch(len(batch))
+        self._in_flight += len(batch)
+        try:
+            results = await run_in_threadpool(self.predict_many, [row for row, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                # Callers that disconnected have already cancelled their future
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight -= len(batch)
+
+    def _record_batch(self, size):
+        self.batches += 1
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        self.batch_size_counts[bucket] = self.batch_size_counts.get(bucket, 0) + 1
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "queue_depth": len(self._pending),
+            "in_flight": self._in_flight,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_size_histogram": {f"<={bucket}": count for bucket, count in sorted(self.batch_size_counts.items())},
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+        }
+
+
+def batching_stats(batcher):
+    return batcher.stats() if batcher is not None else {"enabled": False}
@@ -0,0 +1,272 @@
+# Memory-mappable model artifacts for the serving apps
+#
+# An artifact is a directory holding manifest.json (feature order, label classes,
+# array layout) and arrays.bin (every array back to back, 64-byte aligned).
+# Loading maps arrays.bin once and wraps read-only views of it, so all workers on
+# a node share one physical copy of the model through the page cache and cold
+# start costs an mmap instead of an unpickle. The training scripts compile, save
+# and publish their models through the helpers at the end of this module.
+#
+#   python model_artifact.py    # write artifacts next to the existing model pickles
+
+import os
+import json
+import mmap
+import shutil
+import tempfile
+import numpy as np
+from forest_engine import CompiledForest, compile_forest, fold_scaler, matches_sklearn, matches_scaled_sklearn
+
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+def artifact_path(model_filename):
+    return os.path.splitext(model_filename)[0] + ".artifact"
+
+
+def save_artifact(path, arrays, metadata):
+    path = os.path.abspath(path)
+    tmp_dir = tempfile.mkdtemp(prefix=".artifact-", dir=os.path.dirname(path))
+    os.chmod(tmp_dir, 0o755)
+    layout = {}
+    offset = 0
+    with open(os.path.join(tmp_dir, "arrays.bin"), "wb") as f:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            if array.dtype.hasobject:
+                raise TypeError(f"Array '{name}' has object dtype and cannot be memory-mapped")
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            f.write(array.tobytes())
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += array.nbytes
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"format_version": FORMAT_VERSION, "arrays": layout, "metadata": metadata}, f, indent=2)
+
+    # Move the finished directory into place, replacing any previous artifact
+    if os.path.exists(path):
+        old_dir = tmp_dir + ".old"
+        os.rename(path, old_dir)
+        os.rename(tmp_dir, path)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(tmp_dir, path)
+
+
+def load_artifact(path):
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {manifest.get('format_version')} in {path}")
+
+    buffer = b""
+    with open(os.path.join(path, "arrays.bin"), "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        if count == 0:
+            arrays[name] = np.empty(spec["shape"], dtype=dtype)
+        else:
+            arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=spec["offset"]).reshape(spec["shape"])
+    return arrays, manifest["metadata"]
+
+
+# -------------------- Serving models --------------------
+
+def save_forest_artifact(path, model, feature_columns, label_classes=None, final_features=None, fill_values=None):
+    # model is a CompiledForest taking raw inputs in final_features (or feature_columns) order;
+    # fill_values maps input columns to the NaN fill used at training time
+    arrays, settings = model.to_arrays()
+    save_artifact(path, arrays, {
+        "kind": "forest",
+        "forest": settings,
+        "feature_columns": list(feature_columns),
+        "final_features": list(final_features) if final_features is not None else None,
+        "label_classes": [str(label) for label in label_classes] if label_classes is not None else None,
+        "fill_values": _fill_values(fill_values),
+    })
+
+
+def save_centroid_artifact(path, centroids):
+    # centroids is EnvironmentalRiskPredictor.centroids()
+    arrays = {name: np.asarray(centroids[name], dtype=np.float64) for name in ("mean", "scale", "centers")}
+    save_artifact(path, arrays, {
+        "kind": "centroids",
+        "feature_names": centroids["feature_names"],
+        "toxicity_classes": centroids["toxicity_classes"],
+        "risk_levels": centroids["risk_levels"],
+    })
+
+
+def _fill_values(fill_values):
+    return {name: float(value) for name, value in fill_values.items()} if fill_values is not None else None
+
+
+# Training-time NaN fills: the recorded ones, else (models saved before they were recorded)
+# the scaler's training means, else None
+def training_fill_values(fill_values, scaler, feature_columns, final_features=None):
+    if fill_values is not None:
+        return _fill_values(fill_values)
+    if not hasattr(scaler, "mean_"):
+        return None
+    scaled_columns = final_features if final_features is not None else feature_columns
+    return {name: float(mean) for name, mean in zip(scaled_columns, scaler.mean_) if name in feature_columns}
+
+
+def _pickle_fill_values(model_data):
+    return training_fill_values(model_data.get("fill_values"), model_data.get("scaler"),
+                                model_data["feature_columns"], model_data.get("final_features"))
+
+
+def _centroid_fill_values(centroids):
+    return {name: float(mean) for name, mean in zip(centroids["feature_names"], centroids["mean"])
+            if name != "toxicity_level_encoded"}
+
+
+# Nearest-centroid (pollution) serving dict; label_classes are the distinct risk levels,
+# like the label classes of the forest models
+def _centroid_serving_model(centroids):
+    return {
+        "centroids": centroids,
+        "label_classes": np.asarray(list(dict.fromkeys(str(level) for level in centroids["risk_levels"]))),
+        "fill_values": _centroid_fill_values(centroids),
+    }
+
+
+# The dict every serving app reads its model from, whether it came from an artifact or a pickle
+def _forest_serving_model(model, feature_columns, label_classes=None, final_features=None, fill_values=None):
+    return {
+        "model": model,
+        "feature_columns": list(feature_columns),
+        "final_features": list(final_features) if final_features is not None else list(feature_columns),
+        "label_classes": np.asarray(label_classes) if label_classes is not None else None,
+        "fill_values": fill_values,
+    }
+
+
+def load_serving_model(path):
+    arrays, metadata = load_artifact(path)
+    if metadata["kind"] == "forest":
+        return _forest_serving_model(
+            CompiledForest.from_arrays(arrays, metadata["forest"]),
+            metadata["feature_columns"],
+            label_classes=metadata["label_classes"],
+            final_features=metadata["final_features"],
+            fill_values=metadata.get("fill_values"),
+        )
+    if metadata["kind"] == "centroids":
+        centroids = {
+            "feature_names": metadata["feature_names"],
+            "mean": arrays["mean"],
+            "scale": arrays["scale"],
+            "centers": arrays["centers"],
+            "toxicity_classes": metadata["toxicity_classes"],
+            "risk_levels": metadata["risk_levels"],
+        }
+        return _centroid_serving_model(centroids)
+    raise ValueError(f"Unknown artifact kind '{metadata['kind']}' in {path}")
+
+
+def serving_model_from_pickle(model_data):
+    # EnvironmentalRiskPredictor pickles the whole predictor object
+    if not isinstance(model_data, dict):
+        return _centroid_serving_model(model_data.centroids())
+
+    # Only fitted scalers are part of the pipeline (the cyclone pickle carries an unused one)
+    scaler = model_data.get("scaler")
+    label_encoder = model_data.get("label_encoder")
+    return _forest_serving_model(
+        compile_forest(model_data["model"], scaler=scaler if hasattr(scaler, "mean_") else None),
+        model_data["feature_columns"],
+        label_classes=getattr(label_encoder, "classes_", None),
+        final_features=model_data.get("final_features"),
+        fill_values=_pickle_fill_values(model_data),
+    )
+
+
+def convert_pickle(hazard):
+    from model_registry import load_pickle, model_path
+
+    model_data = load_pickle(hazard)
+    artifact = artifact_path(model_path(hazard))
+    if not isinstance(model_data, dict):
+        save_centroid_artifact(artifact, model_data.centroids())
+        return artifact
+
+    compiled = compile_verified(model_data["model"], model_data.get("scaler"), name=f"{hazard} model")
+    label_encoder = model_data.get("label_encoder")
+    save_forest_artifact(
+        artifact, compiled, model_data["feature_columns"],
+        label_classes=getattr(label_encoder, "classes_", None),
+        final_features=model_data.get("final_features"),
+        fill_values=_pickle_fill_values(model_data),
+    )
+    return artifact
+
+
+
+# -------------------- Training scripts --------------------
+
+def compile_verified(forest, scaler=None, X_check=None, name="model"):
+    # Compile a fitted sklearn forest, folding a fitted scaler into its split thresholds so the
+    # result scores raw inputs, and check it reproduces (scaler +) forest on the raw rows
+    # X_check, by default samples around the scaler's training statistics
+    scaled = hasattr(scaler, "mean_")
+    compiled = CompiledForest.from_sklearn(forest)
+    if X_check is None:
+        X_check = np.random.default_rng(0).normal(size=(256, forest.n_features_in_))
+        if scaled:
+            X_check = X_check * scaler.scale_ + scaler.mean_
+    if scaled:
+        compiled = fold_scaler(compiled, scaler)
+        verified = matches_scaled_sklearn(forest, scaler, compiled, X_check)
+    else:
+        verified = matches_sklearn(forest, compiled, X_check)
+    if not verified:
+        raise RuntimeError(f"Compiled {name} does not reproduce the trained one")
+    return compiled
+
+
+def save_trained_model(filename, model_data, compiled, run=None, metrics=None):
+    # Write a predictor's pickle (model_data, as its load_model reads it), the serving artifact
+    # of compiled next to it and the metrics of its training run. compiled comes from
+    # compile_verified before this is called, so a failed check leaves the saved pair untouched.
+    # Without a run, metrics are those of an incremental update and any earlier run is dropped.
+    import joblib
+    from training_run import discard_run
+
+    joblib.dump(model_data, filename)
+    label_encoder = model_data.get("label_encoder")
+    save_forest_artifact(
+        artifact_path(filename), compiled, model_data["feature_columns"],
+        label_classes=getattr(label_encoder, "classes_", None),
+        final_features=model_data.get("final_features"),
+        fill_values=_pickle_fill_values(model_data),
+    )
+    if run is not None:
+        run.save(filename, metrics)
+    elif metrics is not None:
+        discard_run(filename)
+    print(f"Model saved to {filename}")
+
+
+def publish_trained_model(hazard, filename, metrics=None, activate=True):
+    # Register the saved artifact as a new model store version; running serving apps pick it
+    # up without a restart once it is active
+    from model_registry import ModelStore
+
+    version = ModelStore().publish(hazard, artifact_path(filename), metrics=metrics, activate=activate)
+    print(f"Published {hazard} model version {version}")
+    return version
+
+
+if __name__ == "__main__":
+    from model_registry import HAZARDS
+    for hazard in HAZARDS:
+        print(f"{hazard}: wrote {convert_pickle(hazard)}")
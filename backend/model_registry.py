@@ -0,0 +1,293 @@
+# Shared model registry for the hazard prediction APIs
+#
+# Serving models come from a local, directory-backed model store when a version has
+# been published there, else from the artifact/pickle next to each training script:
+#
+#   model_store/<hazard>/<version>/    artifact files plus metadata.json
+#   model_store/<hazard>/ACTIVE        name of the version being served
+#   model_store/<hazard>/HISTORY       every activation, oldest first (used by rollback)
+#
+# A background thread polls the ACTIVE pointers every MODEL_RELOAD_SECONDS. A newly
+# activated version is loaded on that thread and swapped in with a single reference
+# assignment, so in-flight requests finish on the version they started with.
+#
+#   python model_registry.py list storm
+#   python model_registry.py activate storm v0003
+#   python model_registry.py rollback storm
+
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import tempfile
+import importlib
+import threading
+from datetime import datetime, timezone
+from model_artifact import artifact_path, load_serving_model, serving_model_from_pickle
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", os.path.join(BACKEND_DIR, "model_store"))
+RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_SECONDS", "10"))
+
+# hazard -> (model directory, model file, FastAPI app module)
+HAZARDS = {
+    "storm": ("STORM_MODEL", "storm_alert_model.pkl", "storm_app"),
+    "cyclone": ("CYCLONE_MODEL", "cyclone_formation_model.pkl", "cyclone_app"),
+    "coastal_erosion": ("COASTALEROSION_MODEL", "coastal_erosion_model.pkl", "coastalErosion_app"),
+    "pollution": ("POLLUTION_MODEL", "environmental_risk_model.pkl", "pollution_app"),
+}
+
+# Version reported for models loaded from the training directories rather than the store
+BUNDLED_VERSION = "bundled"
+
+
+def hazard_dir(hazard):
+    if hazard not in HAZARDS:
+        raise KeyError(f"Unknown hazard '{hazard}'. Expected one of {list(HAZARDS)}")
+    model_dir = os.path.join(BACKEND_DIR, HAZARDS[hazard][0])
+    # Model folders are plain script directories, so put them on the path
+    # (the pollution pickle references environmental_model by its bare name)
+    if model_dir not in sys.path:
+        sys.path.insert(0, model_dir)
+    return model_dir
+
+
+def model_path(hazard):
+    return os.path.join(hazard_dir(hazard), HAZARDS[hazard][1])
+
+
+def load_pickle(hazard):
+    path = model_path(hazard)
+    if hazard == "pollution":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    import joblib
+    return joblib.load(path)
+
+
+class ModelStore:
+    def __init__(self, root=MODEL_STORE_DIR):
+        self.root = root
+
+    def version_path(self, hazard, version):
+        hazard_dir(hazard)
+        return os.path.join(self.root, hazard, version)
+
+    def versions(self, hazard):
+        path = os.path.join(self.root, hazard)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name for name in os.listdir(path) if name.startswith("v") and name[1:].isdigit())
+
+    def active_version(self, hazard):
+        try:
+            with open(os.path.join(self.root, hazard, "ACTIVE")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def metadata(self, hazard, version):
+        with open(os.path.join(self.version_path(hazard, version), "metadata.json")) as f:
+            return json.load(f)
+
+    def publish(self, hazard, artifact_dir, metrics=None, activate=True):
+        # Copy a model artifact in as the next version; metadata.json records what the
+        # serving apps and operators need to know about it without loading the arrays
+        with open(os.path.join(artifact_dir, "manifest.json")) as f:
+            artifact_metadata = json.load(f)["metadata"]
+        metadata = {
+            "hazard": hazard,
+            "published_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "kind": artifact_metadata["kind"],
+            "feature_columns": artifact_metadata.get("feature_columns", artifact_metadata.get("feature_names")),
+            "final_features": artifact_metadata.get("final_features"),
+            "label_classes": artifact_metadata.get("label_classes", artifact_metadata.get("risk_levels")),
+            "metrics": {name: float(value) for name, value in (metrics or {}).items()},
+        }
+
+        hazard_root = os.path.join(self.root, hazard)
+        os.makedirs(hazard_root, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".publish-", dir=hazard_root)
+        os.chmod(tmp_dir, 0o755)
+        for name in os.listdir(artifact_dir):
+            shutil.copy2(os.path.join(artifact_dir, name), tmp_dir)
+
+        # Claim the next free version number; rename fails if a concurrent publish took it
+        while True:
+            existing = self.versions(hazard)
+            version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+            metadata["version"] = version
+            with open(os.path.join(tmp_dir, "metadata.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+            try:
+                os.rename(tmp_dir, os.path.join(hazard_root, version))
+                break
+            except OSError:
+                if not os.path.isdir(os.path.join(hazard_root, version)):
+                    raise
+
+        if activate:
+            self.activate(hazard, version)
+        return version
+
+    def activate(self, hazard, version):
+        if version not in self.versions(hazard):
+            raise ValueError(f"Unknown {hazard} model version '{version}'. Available: {self.versions(hazard)}")
+        hazard_root = os.path.join(self.root, hazard)
+        with open(os.path.join(hazard_root, "HISTORY"), "a") as f:
+            f.write(version + "\n")
+        self._write_pointer(hazard_root, version)
+
+    def rollback(self, hazard):
+        # Go back to the version that was active before the current one
+        hazard_root = os.path.join(self.root, hazard)
+        try:
+            with open(os.path.join(hazard_root, "HISTORY")) as f:
+                history = f.read().split()
+        except FileNotFoundError:
+            history = []
+        if len(history) < 2:
+            raise ValueError(f"No earlier {hazard} model version to roll back to")
+        history.pop()
+        previous = history[-1]
+        with open(os.path.join(hazard_root, "HISTORY"), "w") as f:
+            f.write("".join(version + "\n" for version in history))
+        self._write_pointer(hazard_root, previous)
+        return previous
+
+    @staticmethod
+    def _write_pointer(hazard_root, version):
+        tmp_path = os.path.join(hazard_root, ".ACTIVE.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(version + "\n")
+        os.replace(tmp_path, os.path.join(hazard_root, "ACTIVE"))
+
+
+def _use_artifacts():
+    return os.getenv("FOREST_ENGINE", "compiled") != "sklearn"
+
+
+class ModelRegistry:
+    def __init__(self, store=None, reload_interval=RELOAD_INTERVAL):
+        self.store = store or ModelStore()
+        self.reload_interval = reload_interval
+        self._models = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._rejected = {}
+
+    def get(self, hazard):
+        # Callers should fetch the model once per request (or batch) and use that
+        # reference throughout, so a swap never mixes two versions in one response
+        model = self._models.get(hazard)
+        if model is None:
+            with self._lock:
+                if hazard not in self._models:
+                    version = self.store.active_version(hazard)
+                    if version is not None and not _use_artifacts():
+                        # Store versions hold only artifacts; serve the bundled pickle and
+                        # leave the active version to the watcher's rejected list
+                        print(f"[model_registry] {hazard}: FOREST_ENGINE=sklearn serves the bundled pickle, not {version}")
+                        self._rejected[hazard] = version
+                        version = None
+                    self._models[hazard] = self._load(hazard, version)
+                    self._start_watcher()
+                model = self._models[hazard]
+        return model
+
+    def pin(self, hazard, version):
+        # Serve exactly this version (None: the bundled model) without following the store
+        with self._lock:
+            self._models[hazard] = self._load(hazard, version)
+
+    def loaded(self):
+        return list(self._models)
+
+    def describe(self, hazard):
+        model = self.get(hazard)
+        return {"hazard": hazard, "version": model["version"], "metadata": model["metadata"]}
+
+    def refresh(self, hazard):
+        # Load the version the store marks active, if it is not the one being served.
+        # A version that fails to load is logged and the current one keeps serving.
+        current = self._models.get(hazard)
+        version = self.store.active_version(hazard)
+        if current is None or version is None or version in (current["version"], self._rejected.get(hazard)):
+            return False
+        try:
+            model = self._load(hazard, version)
+            # The apps build request matrices in feature_columns order, so that cannot change under them
+            if model.get("feature_columns") != current.get("feature_columns"):
+                raise ValueError("it changes the feature columns (restart to serve it)")
+        except Exception as e:
+            print(f"[model_registry] keeping {hazard} {current['version']}: cannot serve {version}: {e}")
+            self._rejected[hazard] = version
+            return False
+        self._models[hazard] = model
+        print(f"[model_registry] {hazard}: swapped {current['version']} -> {version}")
+        return True
+
+    # Serving models come from the memory-mapped artifact when one exists, else the pickle
+    # (FOREST_ENGINE=sklearn always uses the pickle, since it needs the sklearn estimators).
+    # "source" is the artifact directory or pickle file the model was read from.
+    def _load(self, hazard, version=None):
+        use_artifacts = _use_artifacts()
+        if version is not None:
+            if not use_artifacts:
+                raise ValueError(f"store version {version} is a compiled artifact, which FOREST_ENGINE=sklearn cannot serve")
+            model = load_serving_model(self.store.version_path(hazard, version))
+            model["source"] = self.store.version_path(hazard, version)
+            model["version"] = version
+            model["metadata"] = self.store.metadata(hazard, version)
+            return model
+
+        artifact = artifact_path(model_path(hazard))
+        if os.path.isdir(artifact) and use_artifacts:
+            model = load_serving_model(artifact)
+            model["source"] = artifact
+        else:
+            model = serving_model_from_pickle(load_pickle(hazard))
+            model["source"] = model_path(hazard)
+        model["version"] = BUNDLED_VERSION
+        model["metadata"] = None
+        return model
+
+    def _start_watcher(self):
+        if self._watcher is None and self.reload_interval > 0:
+            self._watcher = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            for hazard in self.loaded():
+                self.refresh(hazard)
+
+
+# One registry per process, shared by the single-hazard apps and the gateway
+registry = ModelRegistry()
+
+
+def load_app(hazard):
+    hazard_dir(hazard)
+    return importlib.import_module(HAZARDS[hazard][2])
+
+
+if __name__ == "__main__":
+    command, hazard = sys.argv[1], sys.argv[2]
+    store = ModelStore()
+    if command == "list":
+        active = store.active_version(hazard)
+        for version in store.versions(hazard):
+            metadata = store.metadata(hazard, version)
+            marker = "*" if version == active else " "
+            print(f"{marker} {version}  {metadata['published_at']}  {metadata['metrics']}")
+    elif command == "activate":
+        store.activate(hazard, sys.argv[3])
+        print(f"{hazard}: activated {sys.argv[3]}")
+    elif command == "rollback":
+        print(f"{hazard}: rolled back to {store.rollback(hazard)}")
+    else:
+        raise SystemExit(f"Unknown command '{command}'. Expected list, activate or rollback")
@@ -0,0 +1,120 @@
+# Opt-in cache of single-reading /predict results, keyed on quantized inputs
+#
+# Enable with PREDICTION_CACHE=1. Each feature is rounded to a grid of
+# PREDICTION_CACHE_RESOLUTION (default 0.01; 0 means exact match), with per-feature
+# overrides in PREDICTION_CACHE_FEATURE_RESOLUTION, e.g. "pressure=0.5,wind_speed=0.1".
+# Readings that land in the same cell share the first reading's prediction, so the
+# resolution should be finer than the precision the sensors are trusted to.
+# Entries expire after PREDICTION_CACHE_TTL_SECONDS, the least recently used entry
+# is evicted beyond PREDICTION_CACHE_SIZE, and the whole cache is dropped when the
+# registry starts serving a different model version. Results are stored with the
+# version of the model that scored them, so a swap mid-request cannot cache them
+# under the new version.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class PredictionCache:
+    def __init__(self, columns, version, resolution=0.01, feature_resolution=None, max_size=10000, ttl_seconds=300.0):
+        # version() -> the model version currently being served
+        feature_resolution = feature_resolution or {}
+        self.columns = list(columns)
+        self.version = version
+        self.resolution = np.array([feature_resolution.get(c, resolution) for c in self.columns], dtype=np.float64)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._model_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, columns, version):
+        if os.getenv("PREDICTION_CACHE", "0").lower() not in ("1", "true", "yes"):
+            return None
+        feature_resolution = {}
+        for item in os.getenv("PREDICTION_CACHE_FEATURE_RESOLUTION", "").split(","):
+            if item.strip():
+                name, value = item.split("=")
+                feature_resolution[name.strip()] = float(value)
+        return cls(
+            columns,
+            version,
+            resolution=float(os.getenv("PREDICTION_CACHE_RESOLUTION", "0.01")),
+            feature_resolution=feature_resolution,
+            max_size=int(os.getenv("PREDICTION_CACHE_SIZE", "10000")),
+            ttl_seconds=float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "300")),
+        )
+
+    def key(self, row):
+        # row holds self.columns in order; features with resolution 0 are kept exact
+        row = np.asarray(row, dtype=np.float64)
+        quantized = np.where(self.resolution > 0, np.round(row / np.where(self.resolution > 0, self.resolution, 1.0)), row)
+        return (quantized + 0.0).tobytes()  # + 0.0 folds -0.0 into 0.0
+
+    def get(self, row):
+        key = self.key(row)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+        return None
+
+    def put(self, row, result, version):
+        # version: the model version that produced result. A result scored by a model
+        # that has since been swapped out is not cached under the new version.
+        key = self.key(row)
+        with self._lock:
+            self._check_version()
+            if version != self._model_version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _check_version(self):
+        version = self.version()
+        if version != self._model_version:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self._model_version = version
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "model_version": self._model_version,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def cache_stats(cache):
+    return cache.stats() if cache is not None else {"enabled": False}
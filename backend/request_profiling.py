@@ -0,0 +1,146 @@
+# On-demand CPU profiling and allocation tracing of single prediction requests
+#
+# Off unless configured: with neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE set, the
+# route handlers are not wrapped at all. A request is profiled when
+#   - it sends the header "X-Profile: <PROFILE_TOKEN>" (compared in constant time), or
+#   - it falls in the PROFILE_SAMPLE_RATE fraction of traffic (e.g. 0.001)
+# and no other request is being profiled in this process (one at a time, since both
+# tracers are process-wide); otherwise it is served normally.
+#
+# A profiled request is traced from the moment its route handler starts (body read,
+# validation) to the response being ready (encoding), on the event loop thread and on
+# every worker thread it hands work to through run_in_threadpool below, so the numpy
+# and sklearn calls of the prediction are included. Two files land in PROFILE_DIR:
+#   <id>.prof         cProfile stats of all threads (python -m pstats, snakeviz)
+#   <id>.tracemalloc  tracemalloc snapshot (tracemalloc.Snapshot.load), unless PROFILE_ALLOCATIONS=0
+# and the response carries the id in an X-Profile-Id header. On Python 3.12+ cProfile
+# is process-wide (sys.monitoring), so the handler's one profiler covers the worker
+# threads as well, along with whatever else the process runs meanwhile; a request is
+# served unprofiled if another profiler is already active. Async handlers await on
+# the shared event loop, so other requests' coroutines can show up in the loop
+# thread's profile; streamed CSV bodies are produced after the handler returns and
+# are not covered, nor are MICRO_BATCHING model calls, which run in a shared batch.
+#
+#   curl -H "X-Profile: $PROFILE_TOKEN" -d @sample_data.json localhost:8000/predict
+#   python -m pstats profiles/<id>.prof
+
+import os
+import sys
+import time
+import hmac
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextvars import ContextVar
+from starlette.concurrency import run_in_threadpool as _run_in_threadpool
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BACKEND_DIR, "profiles"))
+PROFILE_ALLOCATIONS = os.getenv("PROFILE_ALLOCATIONS", "1").lower() in ("1", "true", "yes")
+TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "25"))
+
+ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+_current_profile = ContextVar("request_profile", default=None)
+_busy = threading.Lock()
+
+
+def _process_profiler_active():
+    # Python 3.12+: cProfile takes the process-wide sys.monitoring profiler slot, and a
+    # second profiler cannot be enabled while it is held
+    monitoring = getattr(sys, "monitoring", None)
+    return monitoring is not None and monitoring.get_tool(monitoring.PROFILER_ID) is not None
+
+
+class RequestProfile:
+    def __init__(self, name):
+        self.name = name
+        self.profilers = []
+        self._lock = threading.Lock()
+
+    def profiler(self):
+        # A profiler for one thread: cProfile only sees the thread that enabled it
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.profilers.append(profiler)
+        return profiler
+
+    def run(self, func, *args, **kwargs):
+        # Profile func on the calling thread, unless the request's profiler already sees every thread
+        if _process_profiler_active():
+            return func(*args, **kwargs)
+        profiler = self.profiler()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+    def save(self, snapshot):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, self.name)
+        with self._lock:
+            profilers = [p for p in self.profilers if p.getstats()]
+        if profilers:
+            pstats.Stats(*profilers).dump_stats(path + ".prof")
+        if snapshot is not None:
+            snapshot.dump(path + ".tracemalloc")
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    # starlette's run_in_threadpool, profiling func too when the current request is profiled
+    profile = _current_profile.get()
+    if profile is None:
+        return await _run_in_threadpool(func, *args, **kwargs)
+    return await _run_in_threadpool(profile.run, func, *args, **kwargs)
+
+
+def _requested(request):
+    header = request.headers.get("x-profile")
+    if header is not None and PROFILE_TOKEN and hmac.compare_digest(header.encode(), PROFILE_TOKEN.encode()):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def profiled(handler, hazard, endpoint):
+    # Wrap a route handler so requests that ask for it (or are sampled) are profiled
+    if not ENABLED:
+        return handler
+
+    async def profiled_handler(request):
+        if not _requested(request) or _process_profiler_active() or not _busy.acquire(blocking=False):
+            return await handler(request)
+        try:
+            profile = RequestProfile(f"{time.strftime('%Y%m%dT%H%M%S')}-{hazard}-{endpoint}-{uuid.uuid4().hex[:8]}")
+            token = _current_profile.set(profile)
+            # Leave tracemalloc alone if someone else (PYTHONTRACEMALLOC) already runs it
+            trace_allocations = PROFILE_ALLOCATIONS and not tracemalloc.is_tracing()
+            if trace_allocations:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            profiler = profile.profiler()
+            profiler.enable()
+            try:
+                response = await handler(request)
+                profiler.disable()
+                snapshot = tracemalloc.take_snapshot() if PROFILE_ALLOCATIONS and tracemalloc.is_tracing() else None
+            finally:
+                profiler.disable()
+                if trace_allocations:
+                    tracemalloc.stop()
+                _current_profile.reset(token)
+            await _run_in_threadpool(profile.save, snapshot)
+        finally:
+            _busy.release()
+        response.headers["X-Profile-Id"] = profile.name
+        return response
+
+    return profiled_handler
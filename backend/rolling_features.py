@@ -0,0 +1,316 @@
+# Streaming per-station rolling features for the hazard model inputs
+#
+# The storm model takes pressure_trend and the erosion model storm_surge_frequency,
+# which summarise a station's recent history rather than one reading. The engine
+# keeps, per station and tracked channel, a fixed-size ring buffer of the last
+# `window` readings in preallocated arrays, and updates in O(1) per reading:
+#   - running sums for the least-squares trend (units per hour), rebuilt from the
+#     buffer each time it wraps so float error cannot accumulate
+#   - monotonic queues (also ring buffers) for the rolling max and min
+#   - a count of readings above the channel's event threshold
+# It also keeps the latest value of every input field, so a reading may carry only
+# some fields. input_row/input_columns return model inputs with the derived fields
+# filled in, ready for StormInput, CoastalErosionInput, CycloneInput or the
+# columnar endpoints. Memory is fixed per station; past max_stations the station
+# updated least recently is dropped.
+#
+#   engine = RollingFeatureEngine()
+#   engine.update("buoy-17", reading, timestamp)
+#   StormInput(**engine.input_row("buoy-17", "storm"))
+
+import numpy as np
+
+HAZARD_FIELDS = {
+    "storm": [
+        "water_level", "surge_height", "wave_height", "wave_period", "wave_direction", "tidal_level",
+        "tidal_range", "current_speed", "current_direction", "wind_speed", "wind_direction", "wind_gusts",
+        "atmospheric_pressure", "pressure_trend", "air_temperature", "sea_surface_temp", "flood_depth",
+        "inundation_area", "drainage_rate",
+    ],
+    "coastal_erosion": [
+        "shoreline_position", "beach_width", "beach_volume", "dune_height", "dune_width", "cliff_retreat_rate",
+        "wave_height", "wave_period", "wave_energy", "tidal_range", "storm_surge_frequency", "wind_speed",
+        "wind_direction", "sea_level_rise", "relative_sea_level_change",
+    ],
+    "cyclone": [
+        "central_pressure", "wind_speed", "wind_shear", "sea_surface_temp", "cloud_top_temp", "vorticity",
+        "convective_activity", "humidity", "precipitation",
+    ],
+}
+
+# Input fields computed from a channel's window instead of read from the latest reading:
+#   pressure_trend         hPa per hour, least-squares slope of atmospheric_pressure
+#   storm_surge_frequency  fraction (0-1) of the window's readings with surge_height
+#                          above the surge_height event level below
+DERIVED_FIELDS = {
+    "pressure_trend": ("atmospheric_pressure", "trend"),
+    "storm_surge_frequency": ("surge_height", "exceedance"),
+}
+
+# Range each derived field is clamped to: the range the model using it was trained on.
+# The erosion model saw storm_surge_frequency from -0.035 to 0.339 (mean 0.145).
+DERIVED_RANGES = {
+    "storm_surge_frequency": (0.0, 0.34),
+}
+
+# Channels with a rolling window, and the level above which a reading counts as an event.
+# surge_height is in metres; 3.5 m is exceeded by 13.5% of the storm training readings,
+# so the derived storm_surge_frequency centres on the erosion model's training mean.
+DEFAULT_CHANNELS = {
+    "atmospheric_pressure": None,
+    "surge_height": 3.5,
+    "water_level": None,
+    "wave_height": 4.0,
+    "wind_speed": 17.0,
+    "central_pressure": None,
+}
+
+
+def _timestamp_seconds(timestamp):
+    if hasattr(timestamp, "timestamp"):
+        return float(timestamp.timestamp())
+    return float(timestamp)
+
+
+class RollingFeatureEngine:
+    def __init__(self, window=48, channels=None, max_stations=10_000, initial_capacity=256):
+        self.window = window
+        self.channels = dict(DEFAULT_CHANNELS if channels is None else channels)
+        self.channel_names = list(self.channels)
+        self._channel_index = {name: i for i, name in enumerate(self.channel_names)}
+        self.thresholds = np.array([np.inf if t is None else t for t in self.channels.values()])
+        self.fields = list(dict.fromkeys([f for fields in HAZARD_FIELDS.values() for f in fields
+                                          if f not in DERIVED_FIELDS] + self.channel_names))
+        self._field_index = {name: i for i, name in enumerate(self.fields)}
+        self.max_stations = max_stations
+        self._rows = {}
+        self._stations = []
+        self._free = []
+        self._clock = 0
+        self._allocate(min(initial_capacity, max_stations))
+
+    def _allocate(self, capacity):
+        n_channels, window = len(self.channel_names), self.window
+        old = getattr(self, "_values", None)
+        arrays = {
+            "_values": ((capacity, n_channels, window), np.float64, np.nan),
+            "_times": ((capacity, n_channels, window), np.float64, np.nan),
+            "_count": ((capacity, n_channels), np.int64, 0),
+            "_pushed": ((capacity, n_channels), np.int64, 0),
+            # Running sums for the trend; times are hours since _origin
+            "_origin": ((capacity, n_channels), np.float64, 0.0),
+            "_sum_t": ((capacity, n_channels), np.float64, 0.0),
+            "_sum_tt": ((capacity, n_channels), np.float64, 0.0),
+            "_sum_x": ((capacity, n_channels), np.float64, 0.0),
+            "_sum_tx": ((capacity, n_channels), np.float64, 0.0),
+            "_events": ((capacity, n_channels), np.int64, 0),
+            # Monotonic queues of push sequence numbers, front = current max / min
+            "_max_queue": ((capacity, n_channels, window), np.int64, 0),
+            "_max_head": ((capacity, n_channels), np.int64, 0),
+            "_max_len": ((capacity, n_channels), np.int64, 0),
+            "_min_queue": ((capacity, n_channels, window), np.int64, 0),
+            "_min_head": ((capacity, n_channels), np.int64, 0),
+            "_min_len": ((capacity, n_channels), np.int64, 0),
+            "_latest": ((capacity, len(self.fields)), np.float64, np.nan),
+            "_last_update": ((capacity,), np.int64, 0),
+        }
+        for name, (shape, dtype, fill) in arrays.items():
+            array = np.full(shape, fill, dtype=dtype)
+            if old is not None:
+                previous = getattr(self, name)
+                array[:len(previous)] = previous
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def _row(self, station):
+        row = self._rows.get(station)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+        elif len(self._stations) < self.capacity:
+            row = len(self._stations)
+            self._stations.append(None)
+        elif self.capacity < self.max_stations:
+            self._allocate(min(self.capacity * 2, self.max_stations))
+            row = len(self._stations)
+            self._stations.append(None)
+        else:
+            # Full: reuse the row of the station that has gone longest without a reading
+            row = int(self._last_update.argmin())
+            del self._rows[self._stations[row]]
+            self._reset(row)
+        self._rows[station] = row
+        self._stations[row] = station
+        return row
+
+    def _reset(self, row):
+        for name in ("_values", "_times", "_latest"):
+            getattr(self, name)[row] = np.nan
+        for name in ("_count", "_pushed", "_origin", "_sum_t", "_sum_tt", "_sum_x", "_sum_tx", "_events",
+                     "_max_head", "_max_len", "_min_head", "_min_len"):
+            getattr(self, name)[row] = 0
+
+    def remove(self, station):
+        row = self._rows.pop(station)
+        self._stations[row] = None
+        self._reset(row)
+        self._free.append(row)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, station):
+        return station in self._rows
+
+    def update(self, station, reading, timestamp):
+        # reading maps field names to values; missing or None fields keep their last value
+        row = self._row(station)
+        self._clock += 1
+        self._last_update[row] = self._clock
+        t = _timestamp_seconds(timestamp)
+        latest = self._latest[row]
+        for field, value in reading.items():
+            if value is None:
+                continue
+            i = self._field_index.get(field)
+            if i is not None:
+                latest[i] = value
+            c = self._channel_index.get(field)
+            if c is not None and value == value:
+                self._push(row, c, float(value), t)
+
+    def _push(self, row, c, x, t):
+        window = self.window
+        seq = int(self._pushed[row, c])
+        pos = seq % window
+        if self._count[row, c] == 0:
+            self._origin[row, c] = t
+        hours = (t - self._origin[row, c]) / 3600.0
+
+        if self._count[row, c] == window:
+            # Evict the oldest reading, which sits where the new one goes
+            old_x = self._values[row, c, pos]
+            old_hours = (self._times[row, c, pos] - self._origin[row, c]) / 3600.0
+            self._sum_t[row, c] -= old_hours
+            self._sum_tt[row, c] -= old_hours * old_hours
+            self._sum_x[row, c] -= old_x
+            self._sum_tx[row, c] -= old_hours * old_x
+            self._events[row, c] -= old_x > self.thresholds[c]
+        else:
+            self._count[row, c] += 1
+
+        self._values[row, c, pos] = x
+        self._times[row, c, pos] = t
+        self._sum_t[row, c] += hours
+        self._sum_tt[row, c] += hours * hours
+        self._sum_x[row, c] += x
+        self._sum_tx[row, c] += hours * x
+        self._events[row, c] += x > self.thresholds[c]
+        self._pushed[row, c] = seq + 1
+
+        oldest = seq + 1 - window
+        self._push_queue(self._max_queue, self._max_head, self._max_len, row, c, seq, x, oldest, np.greater)
+        self._push_queue(self._min_queue, self._min_head, self._min_len, row, c, seq, x, oldest, np.less)
+
+        if pos == window - 1:
+            self._rebuild_sums(row, c)
+
+    def _push_queue(self, queue, head, length, row, c, seq, x, oldest, keeps):
+        # Drop the front if it left the window (before appending: a full queue's next free
+        # slot is the front), then the queued readings the new one dominates, and append it
+        window = self.window
+        ring, values = queue[row, c], self._values[row, c]
+        h, n = int(head[row, c]), int(length[row, c])
+        if n and ring[h] < oldest:
+            h = (h + 1) % window
+            n -= 1
+        while n and not keeps(values[ring[(h + n - 1) % window] % window], x):
+            n -= 1
+        ring[(h + n) % window] = seq
+        head[row, c], length[row, c] = h, n + 1
+
+    def _rebuild_sums(self, row, c):
+        # Recompute the sums from the full buffer with its oldest reading as the new origin
+        times = self._times[row, c]
+        x = self._values[row, c]
+        self._origin[row, c] = times.min()
+        hours = (times - self._origin[row, c]) / 3600.0
+        self._sum_t[row, c] = hours.sum()
+        self._sum_tt[row, c] = (hours * hours).sum()
+        self._sum_x[row, c] = x.sum()
+        self._sum_tx[row, c] = (hours * x).sum()
+
+    def _rows_for(self, stations):
+        return np.array([self._rows[station] for station in stations], dtype=np.int64)
+
+    def channel_features(self, stations, channel):
+        # Rolling features of one channel for many stations at once, as arrays
+        rows = self._rows_for(stations)
+        c = self._channel_index[channel]
+        n = self._count[rows, c].astype(np.float64)
+        sum_t, sum_x = self._sum_t[rows, c], self._sum_x[rows, c]
+        denominator = n * self._sum_tt[rows, c] - sum_t * sum_t
+        with np.errstate(divide="ignore", invalid="ignore"):
+            trend = np.where(denominator > 1e-12, (n * self._sum_tx[rows, c] - sum_t * sum_x) / denominator, np.nan)
+            mean = sum_x / n
+            exceedance = self._events[rows, c] / n
+
+        window = self.window
+        pushed = self._pushed[rows, c]
+        newest = (pushed - 1) % window
+        oldest = np.where(pushed > window, pushed % window, 0)
+        values, times = self._values[rows, c], self._times[rows, c]
+        index = np.arange(len(rows))
+        span_hours = (times[index, newest] - times[index, oldest]) / 3600.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = np.where(span_hours > 0, (values[index, newest] - values[index, oldest]) / span_hours, np.nan)
+
+        max_seq = self._max_queue[rows, c, self._max_head[rows, c]]
+        min_seq = self._min_queue[rows, c, self._min_head[rows, c]]
+        empty = n == 0
+        return {
+            "count": n.astype(np.int64),
+            "latest": np.where(empty, np.nan, values[index, newest]),
+            "mean": mean,
+            "trend": trend,
+            "rate": rate,
+            "max": np.where(empty, np.nan, values[index, max_seq % window]),
+            "min": np.where(empty, np.nan, values[index, min_seq % window]),
+            "events": self._events[rows, c].copy(),
+            "exceedance": exceedance,
+        }
+
+    def features(self, station):
+        # Every rolling feature of one station, as {"<channel>_<feature>": value}
+        features = {}
+        for channel in self.channel_names:
+            for name, values in self.channel_features([station], channel).items():
+                features[f"{channel}_{name}"] = values[0].item()
+        return features
+
+    def input_columns(self, stations, fields):
+        # fields: a HAZARD_FIELDS key or a list of input fields; returns one array per field,
+        # NaN where a station has no value yet (fill those with the model's fill_values)
+        fields = HAZARD_FIELDS[fields] if isinstance(fields, str) else fields
+        rows = self._rows_for(stations)
+        columns = {}
+        for field in fields:
+            if field in DERIVED_FIELDS:
+                channel, feature = DERIVED_FIELDS[field]
+                columns[field] = self.channel_features(stations, channel)[feature]
+                if field in DERIVED_RANGES:
+                    columns[field] = np.clip(columns[field], *DERIVED_RANGES[field])
+            else:
+                columns[field] = self._latest[rows, self._field_index[field]]
+        return columns
+
+    def input_row(self, station, fields):
+        # One station's model input; fields without a value yet are left out, so the
+        # input schema reports them as missing
+        row = {}
+        for field, values in self.input_columns([station], fields).items():
+            value = values[0].item()
+            if value == value:
+                row[field] = value
+        return row
@@ -0,0 +1,272 @@
+# Per-stage latency histograms for the hazard APIs, in Prometheus text format
+#
+# Each app records the stages of its prediction pipeline:
+#   validate   request received -> endpoint called (body read, JSON parse, pydantic)
+#   features   pydantic model -> model input matrix
+#   engineer   derived features (coastal erosion)
+#   model      model.predict / predict_proba (the scaler is folded into the forests)
+#   labels     class index -> label decoding
+#   encode     endpoint returned -> response ready (result dicts, jsonable_encoder, JSON)
+# The batch endpoints read their raw body (wire_formats.py), so for them validate is
+# only the body read, and two stages of their own cover the rest:
+#   decode     body -> one array per input field (JSON, MessagePack or float64 matrix)
+#   serialize  output arrays -> response body in the format the client accepts
+# plus the duration and body size of every request and the rows per model call, by
+# model version (its _sum is the rows each version scored). validate and encode are timed by TimedRoute, the
+# route class of every app (and of the gateway), around the POST endpoints; the
+# others are timed by the app code:
+#
+#   started = clock()
+#   X = ...
+#   started = metrics.observe("features", started)
+#
+# Recording is a clock read and a lock-free append, a few hundred nanoseconds; values
+# are bucketed in bulk with NumPy. GET /metrics renders every histogram.
+
+import time
+import asyncio
+import threading
+import functools
+from collections import deque
+from contextvars import ContextVar
+import numpy as np
+from fastapi.routing import APIRoute
+from fastapi.responses import PlainTextResponse
+from request_profiling import profiled, current_profile
+
+clock = time.perf_counter_ns
+
+# Upper bounds: seconds for durations, rows or bytes for sizes
+DURATION_BUCKETS = [1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+ROW_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10_000, 20_000, 50_000, 100_000, 1_000_000]
+BYTE_BUCKETS = [256, 1024, 4096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216, 67_108_864]
+
+# Values a histogram buffers before the recording thread folds them in
+PENDING_LIMIT = 4096
+
+METRICS = {
+    # name -> (help, buckets, scale from recorded value to exposed unit)
+    "hazard_stage_duration_seconds": ("Time spent in each prediction pipeline stage", DURATION_BUCKETS, 1e-9),
+    "hazard_request_duration_seconds": ("Time from request received to response ready", DURATION_BUCKETS, 1e-9),
+    "hazard_request_body_bytes": ("Request body size", BYTE_BUCKETS, 1),
+    "hazard_model_call_rows": ("Rows scored per model call, by model version", ROW_BUCKETS, 1),
+}
+
+
+class Histogram:
+    # observe() only appends to a deque, which is atomic under the GIL, so recording
+    # takes no lock. Pending values are folded into the bucket counts when the metrics
+    # are rendered, or by the recording thread once PENDING_LIMIT have piled up.
+    def __init__(self, buckets, scale):
+        # Bounds are kept in the recorded unit (nanoseconds for durations) so observe() does no arithmetic
+        self.bounds = np.array(buckets, dtype=np.float64) / scale
+        self.counts = np.zeros(len(buckets) + 1, dtype=np.int64)
+        self.sum = 0.0
+        self.count = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) > PENDING_LIMIT:
+            self.fold()
+
+    def fold(self):
+        with self._lock:
+            n = len(self._pending)
+            if not n:
+                return
+            popleft = self._pending.popleft
+            values = np.fromiter((popleft() for _ in range(n)), dtype=np.float64, count=n)
+            self.counts += np.bincount(np.searchsorted(self.bounds, values), minlength=len(self.counts))
+            self.sum += float(values.sum())
+            self.count += n
+
+    def snapshot(self):
+        self.fold()
+        with self._lock:
+            return self.counts.tolist(), self.sum, self.count
+
+
+# (metric name, labels) -> Histogram, in creation order
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    hist = _histograms.get(key)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(key, Histogram(*METRICS[name][1:]))
+    return hist
+
+
+class ServingMetrics:
+    def __init__(self, hazard):
+        self.hazard = hazard
+        self.stages = {}
+        self.model_rows = {}
+
+    def stage(self, stage):
+        hist = self.stages.get(stage)
+        if hist is None:
+            hist = self.stages[stage] = histogram("hazard_stage_duration_seconds", hazard=self.hazard, stage=stage)
+        return hist
+
+    def observe(self, stage, started):
+        # Record the time since started (a clock() reading) and return the current clock
+        now = clock()
+        (self.stages.get(stage) or self.stage(stage)).observe(now - started)
+        return now
+
+    def observe_model(self, started, rows, version):
+        # The model stage, plus the rows it scored under which model version
+        now = clock()
+        (self.stages.get("model") or self.stage("model")).observe(now - started)
+        hist = self.model_rows.get(version)
+        if hist is None:
+            hist = self.model_rows[version] = histogram("hazard_model_call_rows", hazard=self.hazard, version=version)
+        hist.observe(rows)
+        return now
+
+
+_metrics = {}
+
+
+def metrics_for(hazard):
+    metrics = _metrics.get(hazard)
+    if metrics is None:
+        metrics = _metrics.setdefault(hazard, ServingMetrics(hazard))
+    return metrics
+
+
+class _RequestTimer:
+    __slots__ = ("received", "entered", "returned")
+
+    def __init__(self, received):
+        self.received = received
+        self.entered = None
+        self.returned = None
+
+
+_request_timer = ContextVar("request_timer", default=None)
+
+
+def _app_hazard(module_name):
+    from model_registry import HAZARDS
+    for hazard, (_, _, app_module) in HAZARDS.items():
+        if module_name == app_module:
+            return hazard
+    return None
+
+
+class TimedRoute(APIRoute):
+    # Times the POST endpoints of the hazard apps: request duration and body size, and the
+    # validate/encode stages either side of the endpoint call. Routes whose endpoint is
+    # not defined in a hazard app module are left alone.
+    def __init__(self, path, endpoint, **kwargs):
+        self.metrics = None
+        hazard = _app_hazard(endpoint.__module__)
+        if hazard is not None and "POST" in (kwargs.get("methods") or ()):
+            self.metrics = metrics_for(hazard)
+            endpoint = _timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if self.metrics is None:
+            return handler
+        metrics, endpoint_name = self.metrics, self.name
+        handler = profiled(handler, metrics.hazard, endpoint_name)
+        duration = histogram("hazard_request_duration_seconds", hazard=metrics.hazard, endpoint=endpoint_name)
+        body_bytes = histogram("hazard_request_body_bytes", hazard=metrics.hazard, endpoint=endpoint_name)
+
+        async def timed_handler(request):
+            timer = _RequestTimer(clock())
+            token = _request_timer.set(timer)
+            try:
+                response = await handler(request)
+            finally:
+                _request_timer.reset(token)
+            now = clock()
+            duration.observe(now - timer.received)
+            length = request.headers.get("content-length")
+            if length is not None:
+                body_bytes.observe(int(length))
+            if timer.entered is not None:
+                metrics.stage("validate").observe(timer.entered - timer.received)
+            if timer.returned is not None:
+                metrics.stage("encode").observe(now - timer.returned)
+            return response
+
+        return timed_handler
+
+
+def _timed_endpoint(endpoint):
+    # Mark when the endpoint starts and returns; FastAPI reads the signature through __wrapped__.
+    # Sync endpoints run on a worker thread, which a profiled request profiles too
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            timer = _request_timer.get()
+            if timer is not None:
+                timer.entered = clock()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if timer is not None:
+                    timer.returned = clock()
+    else:
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            timer = _request_timer.get()
+            if timer is not None:
+                timer.entered = clock()
+            profile = current_profile()
+            try:
+                if profile is not None:
+                    return profile.run(endpoint, *args, **kwargs)
+                return endpoint(*args, **kwargs)
+            finally:
+                if timer is not None:
+                    timer.returned = clock()
+    return timed
+
+
+def _labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+def render():
+    # Prometheus text exposition of every histogram, plus the served model versions
+    from model_registry import registry
+
+    by_name = {}
+    for (name, labels), hist in list(_histograms.items()):
+        by_name.setdefault(name, []).append((labels, hist))
+
+    lines = []
+    for name, series in by_name.items():
+        help_text, buckets, scale = METRICS[name]
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, hist in series:
+            counts, total, count = hist.snapshot()
+            label_text = _labels(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label_text}}} {total * scale:.9g}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+
+    lines += ["# HELP hazard_model_info Model version being served", "# TYPE hazard_model_info gauge"]
+    for hazard in registry.loaded():
+        lines.append(f'hazard_model_info{{{_labels([("hazard", hazard), ("version", registry.get(hazard)["version"])])}}} 1')
+    return "\n".join(lines) + "\n"
+
+
+def metrics_response():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
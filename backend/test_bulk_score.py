@@ -0,0 +1,26 @@
+# Bulk scoring reports unscorable pollution rows in place instead of aborting the run
+
+import json
+import os
+import pandas as pd
+import pytest
+from bulk_score import bulk_score
+from model_registry import HAZARDS, BACKEND_DIR
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pollution_bad_rows(tmp_path, workers):
+    with open(os.path.join(BACKEND_DIR, HAZARDS["pollution"][0], "sample_data.json")) as f:
+        sample = json.load(f)
+    readings = pd.DataFrame([dict(sample, timestamp=f"t{i}") for i in range(6)])
+    readings.loc[1, "toxicity_level"] = None
+    readings.loc[4, "toxicity_level"] = "Bogus"
+    readings.to_csv(tmp_path / "readings.csv", index=False)
+
+    output = tmp_path / "scored.ndjson"
+    assert bulk_score("pollution", str(tmp_path / "readings.csv"), str(output),
+                      chunk_rows=4, workers=workers, id_column="timestamp") == 6
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [line.get("timestamp") for line in lines] == ["t0", None, "t2", "t3", None, "t5"]
+    assert lines[1] == {"error": "missing toxicity_level", "row": 1}
+    assert lines[4]["row"] == 4 and "Bogus" in lines[4]["error"]
@@ -0,0 +1,36 @@
+# Every CompiledForest batch path against the sklearn forest it was compiled from
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+import forest_engine
+from forest_engine import CompiledForest, fold_scaler
+
+
+def _data(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, 5)) * [1.0, 10.0, 100.0, 0.1, 1000.0] + [0.0, 50.0, 1013.0, 0.0, 0.0]
+    return X, (X[:, 0] + X[:, 1] / 10 > 5).astype(int) + (X[:, 2] > 1013)
+
+
+@pytest.mark.parametrize("path", ["blocked", "heap", "compiled"])
+def test_batch_paths_match_sklearn(path, monkeypatch):
+    X, y = _data(600)
+    scaler = StandardScaler().fit(X)
+    classifier = RandomForestClassifier(n_estimators=12, max_depth=8, random_state=0).fit(scaler.transform(X), y)
+    regressor = RandomForestRegressor(n_estimators=12, max_depth=8, random_state=0).fit(X, X[:, 1])
+    folded = fold_scaler(CompiledForest.from_sklearn(classifier), scaler)
+    compiled = CompiledForest.from_sklearn(regressor)
+
+    monkeypatch.setattr(forest_engine, "TREE_MAJOR_ROWS", 1 if path == "heap" else 10**9)
+    monkeypatch.setattr(forest_engine, "COMPILED_TREE_ROWS", 1 if path == "compiled" else 10**9)
+    if path == "compiled":
+        folded._build_compiled_trees()
+        compiled._build_compiled_trees()
+
+    X_test, _ = _data(3000, seed=1)
+    X_test[::17, 1] = np.nan
+    assert np.array_equal(folded.predict_proba(X_test), make_pipeline(scaler, classifier).predict_proba(X_test))
+    assert np.array_equal(compiled.predict(X_test), regressor.predict(X_test))
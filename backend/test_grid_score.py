@@ -0,0 +1,37 @@
+# Gridded scoring of the pollution model, whose toxicity_level input is a string grid
+
+import json
+import os
+import numpy as np
+import pytest
+from grid_score import grid_score
+from model_registry import HAZARDS, BACKEND_DIR, load_app
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pollution_grid(tmp_path, workers):
+    with open(os.path.join(BACKEND_DIR, HAZARDS["pollution"][0], "sample_data.json")) as f:
+        sample = json.load(f)
+    module = load_app("pollution")
+    shape = (40, 30)
+    rng = np.random.default_rng(0)
+    input_dir = tmp_path / "inputs"
+    input_dir.mkdir()
+    for name in module.input_columns:
+        if name == "toxicity_level":
+            grid = rng.choice(["Low", "Moderate", "High", "Very High"], size=shape)
+            grid[0, :5] = ""
+        else:
+            grid = sample[name] * rng.uniform(0.5, 1.5, shape)
+            grid[0, :5] = np.nan
+        np.save(input_dir / f"{name}.npy", grid)
+
+    assert grid_score("pollution", str(input_dir), str(tmp_path / "out"), tile=16, workers=workers) == 6
+
+    with open(tmp_path / "out" / "manifest.json") as f:
+        classes = json.load(f)["outputs"]["predicted_risk_level"]
+    codes = np.load(tmp_path / "out" / "predicted_risk_level.npy")
+    assert (codes[0, :5] == -1).all()
+    columns = {name: np.load(input_dir / f"{name}.npy")[1:].reshape(-1) for name in module.input_columns}
+    expected = module.predict_columns(columns)["predicted_risk_level"]
+    assert np.array(classes, dtype=object)[codes[1:].reshape(-1)].tolist() == expected.tolist()
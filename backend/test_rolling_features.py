@@ -0,0 +1,49 @@
+# Rolling max/min of RollingFeatureEngine against a brute-force window
+
+import numpy as np
+import pytest
+from rolling_features import RollingFeatureEngine
+
+
+def _rolling_extremes(series, window=3):
+    engine = RollingFeatureEngine(window=window, channels={"atmospheric_pressure": None})
+    seen = []
+    for t, value in enumerate(series):
+        engine.update("buoy", {"atmospheric_pressure": value}, t * 3600)
+        features = engine.channel_features(["buoy"], "atmospheric_pressure")
+        seen.append((features["max"][0], features["min"][0]))
+    return seen
+
+
+@pytest.mark.parametrize("series", [
+    [10, 9, 8, 7, 6, 5],
+    [1, 2, 3, 4, 5, 6],
+    [5, 1, 4, 2, 8, 3, 7, 7, 0, 9],
+])
+def test_rolling_max_min_match_window(series):
+    window = 3
+    for t, (high, low) in enumerate(_rolling_extremes(series, window)):
+        expected = series[max(0, t + 1 - window):t + 1]
+        assert (high, low) == (max(expected), min(expected))
+
+
+def test_random_series_matches_window():
+    series = np.random.default_rng(0).normal(1000, 5, 500).tolist()
+    for t, (high, low) in enumerate(_rolling_extremes(series, 7)):
+        expected = series[max(0, t - 6):t + 1]
+        assert (high, low) == (max(expected), min(expected))
+
+
+def test_storm_surge_frequency_in_training_range():
+    # The storm training surges, replayed through one station, stay in the erosion model's range
+    import os
+    import pandas as pd
+    from model_registry import BACKEND_DIR
+    surges = pd.read_csv(os.path.join(BACKEND_DIR, "STORM_MODEL", "storm_data.csv"))["surge_height"]
+    engine = RollingFeatureEngine()
+    shares = []
+    for t, value in enumerate(surges):
+        engine.update("tide-gauge", {"surge_height": value}, t * 3600)
+        shares.append(engine.input_row("tide-gauge", ["storm_surge_frequency"])["storm_surge_frequency"])
+    assert 0.0 <= min(shares) and max(shares) <= 0.34
+    assert 0.1 < np.mean(shares[48:]) < 0.2
@@ -0,0 +1,82 @@
+# Column-projected, compact training data loading for the model training scripts
+#
+# read_training_table accepts a CSV file, a Parquet/Feather/Arrow file, or a
+# directory holding a partitioned dataset (hive-style key=value folders of Parquet
+# files, or CSV parts). Only the requested columns are read. float64 columns are
+# stored as float32, which is what the forests split on anyway. Label columns come
+# back as pandas categoricals. CSVs are read in chunks so the float64 copy never
+# exists for the whole file. Parquet/Arrow input needs pyarrow.
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+COLUMNAR_SUFFIXES = (".parquet", ".pq", ".feather", ".arrow", ".ipc")
+CSV_CHUNK_ROWS = 200_000
+
+
+def read_training_table(path, columns=None, categorical=(), float32=True):
+    # columns=None reads every column; requested columns missing from the data are
+    # skipped, so callers keep their own missing-feature handling
+    wanted = list(dict.fromkeys(columns)) if columns is not None else None
+    if os.path.isdir(path):
+        parquet_parts = glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)
+        if parquet_parts:
+            data = _read_arrow(path, wanted, categorical, float32, "parquet")
+        else:
+            parts = sorted(glob.glob(os.path.join(path, "**", "*.csv"), recursive=True))
+            if not parts:
+                raise ValueError(f"No Parquet or CSV files found under {path}")
+            data = pd.concat([_read_csv(part, wanted, float32) for part in parts], ignore_index=True)
+    elif path.lower().endswith(COLUMNAR_SUFFIXES):
+        file_format = "parquet" if path.lower().endswith((".parquet", ".pq")) else "ipc"
+        data = _read_arrow(path, wanted, categorical, float32, file_format)
+    else:
+        data = _read_csv(path, wanted, float32)
+
+    for column in categorical:
+        if column in data.columns and not isinstance(data[column].dtype, pd.CategoricalDtype):
+            data[column] = data[column].astype("category")
+    if wanted is not None:
+        data = data[[c for c in wanted if c in data.columns]]
+    return data
+
+
+def _compact(frame, float32):
+    if float32:
+        doubles = frame.select_dtypes(include=[np.float64]).columns
+        if len(doubles):
+            frame = frame.astype({c: np.float32 for c in doubles})
+    return frame
+
+
+def _read_csv(path, wanted, float32):
+    usecols = (lambda c: c in wanted) if wanted is not None else None
+    chunks = [_compact(chunk, float32) for chunk in pd.read_csv(path, usecols=usecols, chunksize=CSV_CHUNK_ROWS)]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=wanted or [])
+
+
+def _read_arrow(path, wanted, categorical, float32, file_format):
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError("Reading Parquet/Arrow training data requires pyarrow (pip install pyarrow)")
+
+    dataset = ds.dataset(path, format=file_format, partitioning="hive")
+    names = dataset.schema.names
+    table = dataset.to_table(columns=[c for c in wanted if c in names] if wanted is not None else None)
+
+    # Cast in Arrow so pandas never materialises float64 copies, and dictionary-encode
+    # label columns so they convert straight to categoricals
+    if float32:
+        schema = pa.schema([f.with_type(pa.float32()) if pa.types.is_float64(f.type) else f for f in table.schema])
+        table = table.cast(schema)
+    for column in categorical:
+        column_type = table.schema.field(column).type if column in table.column_names else None
+        if column_type is not None and (pa.types.is_string(column_type) or pa.types.is_large_string(column_type)):
+            i = table.column_names.index(column)
+            table = table.set_column(i, column, pc.dictionary_encode(table[column]))
+    return table.to_pandas()
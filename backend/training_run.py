@@ -0,0 +1,86 @@
+# Memoized results of one training run
+#
+# A TrainingRun wraps a fitted model and its train/test split. Predictions, the
+# cross-validation scores (folds fitted in parallel) and the feature importances
+# are each computed the first time they are needed and then reused by every
+# summary, plot, publish and save step of the run. save() writes them next to
+# the model as <model stem>.run.json. An incremental update changes the forest, so
+# the predictors drop their run then and refuse to report its metrics.
+
+import os
+import json
+from datetime import datetime, timezone
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import cross_val_score
+
+
+def run_path(model_filename):
+    return os.path.splitext(model_filename)[0] + ".run.json"
+
+
+def require_run(run, updated=False):
+    # The run behind evaluate/summary/plot calls, or an error saying why there is none
+    if run is not None:
+        return run
+    if updated:
+        raise ValueError("The model was updated after training, so its training run no longer describes it; "
+                         "retrain to re-evaluate (update_metrics holds the scores of the update)")
+    raise ValueError("No training run to evaluate: train the model first (a loaded model has no test split)")
+
+
+def discard_run(model_filename):
+    # Remove the run.json of an earlier forest saved under this name
+    try:
+        os.remove(run_path(model_filename))
+    except FileNotFoundError:
+        pass
+
+
+class TrainingRun:
+    def __init__(self, model, X_train, y_train, X_test, y_test, feature_names, scoring, cv=5, n_jobs=-1):
+        self.model = model
+        self.X_train, self.y_train = X_train, y_train
+        self.X_test, self.y_test = X_test, y_test
+        self.feature_names = list(feature_names)
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+
+    @cached_property
+    def y_train_pred(self):
+        return self.model.predict(self.X_train)
+
+    @cached_property
+    def y_test_pred(self):
+        return self.model.predict(self.X_test)
+
+    @cached_property
+    def cv_scores(self):
+        # Each fold refits a clone of the model, so the folds run side by side
+        return cross_val_score(self.model, self.X_train, self.y_train, cv=self.cv, scoring=self.scoring, n_jobs=self.n_jobs)
+
+    @cached_property
+    def feature_importance(self):
+        importances = self.model.feature_importances_
+        n = min(len(self.feature_names), len(importances))
+        return pd.DataFrame({
+            'feature': self.feature_names[:n],
+            'importance': importances[:n]
+        }).sort_values('importance', ascending=False)
+
+    def save(self, model_filename, metrics):
+        path = run_path(model_filename)
+        with open(path, 'w') as f:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'model': type(self.model).__name__,
+                'train_samples': len(self.y_train),
+                'test_samples': len(self.y_test),
+                'metrics': {name: float(value) for name, value in metrics.items()},
+                'cv_scoring': self.scoring,
+                'cv_scores': [float(score) for score in np.asarray(self.cv_scores)],
+                'feature_importance': {row.feature: float(row.importance) for row in self.feature_importance.itertuples()},
+            }, f, indent=2)
+        return path
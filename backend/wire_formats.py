@@ -0,0 +1,265 @@
+# Wire formats for the batch prediction endpoints
+#
+# Request bodies are read according to Content-Type:
+#   application/json          {"field": [values...], ...} (coastal erosion also takes {"records": [{...}, ...]},
+#                             where an empty list gets an empty list of predictions)
+#   application/msgpack       the same object, MessagePack-encoded
+#   application/x-float64-matrix
+#                             little-endian float64 matrix, row-major, one column per input
+#                             field in the app's input order (or the order of a JSON list in an
+#                             X-Columns header). String fields are sent as the index of the
+#                             label in the model's sorted labels (pollution's toxicity_level).
+# Bodies are decoded straight into one NumPy array per field, without a pydantic
+# object per reading. Numbers must be finite; null/NaN is rejected with a 422.
+#
+# Responses are written according to Accept:
+#   application/json          (default) {"predictions": [{...}, ...]}, one object per row as
+#                             before; ?layout=columns returns {"predictions": {output: [values...]}}
+#                             encoded from the NumPy arrays
+#   application/msgpack       {"predictions": {output: [values...]}}
+#   application/x-float64-matrix
+#                             float64 matrix, one column per output, label outputs as class
+#                             indices; X-Columns and X-Classes headers (JSON) describe it
+# JSON goes through orjson when it is installed, and MessagePack needs msgpack;
+# without it those requests get a 415/406.
+
+import json
+import numpy as np
+from fastapi import HTTPException
+from starlette.responses import Response
+from serving_metrics import clock
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MATRIX = "application/x-float64-matrix"
+MEDIA_TYPES = {
+    JSON: JSON,
+    "text/json": JSON,
+    MSGPACK: MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    MATRIX: MATRIX,
+    "application/octet-stream": MATRIX,
+}
+
+
+def _media_type(header):
+    return header.split(";", 1)[0].strip().lower()
+
+
+def _json_loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def _json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, separators=(",", ":"), default=lambda array: array.tolist()).encode()
+
+
+def batch_openapi(batch_model):
+    # OpenAPI request body of a batch endpoint that reads the raw request: the JSON
+    # schema it accepts, plus the other content types
+    return {"requestBody": {"required": True, "content": {
+        JSON: {"schema": batch_model.schema(ref_template="#/components/schemas/{model}")},
+        MSGPACK: {"schema": {"type": "object"}},
+        MATRIX: {"schema": {"type": "string", "format": "binary"}},
+    }}}
+
+
+def _unprocessable(detail):
+    return HTTPException(status_code=422, detail=detail)
+
+
+def decode_columns(request, body, input_columns, categories=None, metrics=None):
+    """Decode a batch request body into {field: 1-D array} for every input field.
+
+    categories maps each string field to its labels, in the order the float matrix
+    format indexes them.
+    """
+    started = clock()
+    categories = categories or {}
+    media_type = MEDIA_TYPES.get(_media_type(request.headers.get("content-type", JSON)))
+    if media_type is None:
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Type. Expected one of {sorted(MEDIA_TYPES)}")
+    if media_type == MATRIX:
+        columns = _matrix_columns(request, body, input_columns, categories)
+    else:
+        if media_type == MSGPACK and msgpack is None:
+            raise HTTPException(status_code=415, detail="MessagePack support needs the msgpack package")
+        try:
+            payload = msgpack.unpackb(body) if media_type == MSGPACK else _json_loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Malformed {media_type} body: {e}")
+        columns = _payload_columns(payload, input_columns, categories)
+    if metrics is not None:
+        metrics.observe("decode", started)
+    return columns
+
+
+def _payload_columns(payload, input_columns, categories):
+    records = isinstance(payload, dict) and isinstance(payload.get("records"), list)
+    if records:
+        try:
+            payload = {c: [record[c] for record in payload["records"]] for c in input_columns}
+        except (KeyError, TypeError) as e:
+            raise _unprocessable(f"Every record must be an object with all input fields; missing {e}")
+    if not isinstance(payload, dict):
+        raise _unprocessable("Expected an object with one array per input field")
+    missing = [c for c in input_columns if c not in payload]
+    if missing:
+        raise _unprocessable(f"Missing input fields {missing}")
+
+    columns = {}
+    for c in input_columns:
+        values = payload[c]
+        if not isinstance(values, list):
+            raise _unprocessable(f"Field '{c}' must be an array")
+        if c in categories:
+            if not all(isinstance(value, str) for value in values):
+                raise _unprocessable(f"Field '{c}' must hold strings")
+            columns[c] = np.array(values, dtype=object)
+            continue
+        try:
+            array = np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise _unprocessable(f"Field '{c}' must hold numbers")
+        if array.ndim != 1 or not np.isfinite(array).all():
+            raise _unprocessable(f"Field '{c}' must be a flat array of finite numbers (no null/NaN)")
+        columns[c] = array
+    # An empty record list has always been a valid batch with no predictions
+    _check_lengths(columns, allow_empty=records)
+    return columns
+
+
+def _matrix_columns(request, body, input_columns, categories):
+    header = request.headers.get("x-columns")
+    try:
+        names = json.loads(header) if header else list(input_columns)
+    except ValueError:
+        names = None
+    if not isinstance(names, list):
+        raise _unprocessable("X-Columns must be a JSON list of field names")
+    missing = [c for c in input_columns if c not in names]
+    if missing:
+        raise _unprocessable(f"Missing input fields {missing}")
+    row_bytes = 8 * len(names)
+    if not body or len(body) % row_bytes:
+        raise _unprocessable(f"Body of {len(body)} bytes is not a whole number of {len(names)}-column float64 rows")
+    matrix = np.frombuffer(body, dtype="<f8").reshape(-1, len(names))
+    if not np.isfinite(matrix).all():
+        raise _unprocessable("Matrix values must be finite (no NaN)")
+
+    columns = {}
+    for i, c in enumerate(names):
+        if c not in input_columns:
+            continue
+        values = matrix[:, i]
+        if c in categories:
+            labels = np.array(categories[c], dtype=object)
+            codes = values.astype(np.intp)
+            if (codes != values).any() or (codes < 0).any() or (codes >= len(labels)).any():
+                raise _unprocessable(f"Field '{c}' must hold label indices into {categories[c]}")
+            values = labels[codes]
+        columns[c] = values
+    return columns
+
+
+def _check_lengths(columns, allow_empty=False):
+    lengths = {c: len(values) for c, values in columns.items()}
+    sizes = set(lengths.values())
+    if len(sizes) != 1:
+        raise _unprocessable(f"All feature arrays must have the same length, got {lengths}")
+    if sizes.pop() == 0 and not allow_empty:
+        raise _unprocessable("Feature arrays must not be empty")
+
+
+def _accepted(request):
+    # The supported media type the client prefers; JSON when it has no preference
+    accept = request.headers.get("accept", "")
+    preferences = []
+    for i, item in enumerate(accept.split(",")):
+        media_type, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        preferences.append((-q, i, media_type.strip().lower()))
+    for neg_q, _, media_type in sorted(preferences):
+        if neg_q >= 0:
+            break
+        if media_type in ("", "*/*", "application/*"):
+            return JSON
+        if media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+    raise HTTPException(status_code=406, detail=f"Cannot produce {accept}. Available: {JSON}, {MSGPACK}, {MATRIX}")
+
+
+def encode_predictions(request, outputs, rows, classes=None, metrics=None):
+    """Response for a batch: outputs maps each output column to an array.
+
+    rows() builds the per-row result dicts of the default JSON layout; it is only
+    called for that layout. classes gives the labels of each label output, in the
+    order the float matrix format indexes them.
+    """
+    started = clock()
+    media_type = _accepted(request)
+    headers = None
+    if media_type == MATRIX:
+        classes = classes or {}
+        matrix = np.empty((len(next(iter(outputs.values()))), len(outputs)), dtype="<f8")
+        for i, (name, values) in enumerate(outputs.items()):
+            matrix[:, i] = _class_indices(values, classes[name]) if name in classes else values
+        content = matrix.tobytes()
+        headers = {"X-Columns": json.dumps(list(outputs)),
+                   "X-Classes": json.dumps({name: [str(label) for label in labels] for name, labels in classes.items()})}
+    elif media_type == MSGPACK:
+        if msgpack is None:
+            raise HTTPException(status_code=406, detail="MessagePack support needs the msgpack package")
+        content = msgpack.packb({"predictions": {name: _plain(values) for name, values in outputs.items()}})
+    elif request.query_params.get("layout") == "columns":
+        content = _json_dumps({"predictions": {name: _json_array(values) for name, values in outputs.items()}})
+    else:
+        content = _json_dumps({"predictions": rows()})
+    response = Response(content, media_type=media_type, headers=headers)
+    if metrics is not None:
+        metrics.observe("serialize", started)
+    return response
+
+
+def _class_indices(values, labels):
+    # Map each distinct label once, then scatter the indices back to the rows
+    uniques, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    lookup = {str(label): i for i, label in enumerate(labels)}
+    try:
+        return np.array([lookup[label] for label in uniques.tolist()], dtype=np.float64)[inverse.reshape(-1)]
+    except KeyError as e:
+        raise ValueError(f"Model returned label {e.args[0]!r} outside its classes {list(labels)}")
+
+
+def _plain(values):
+    # Python list of an output column (numeric columns convert in one C loop)
+    values = np.asarray(values)
+    return values.astype(str).tolist() if values.dtype.kind in "OUS" else values.tolist()
+
+
+def _json_array(values):
+    # orjson encodes numeric arrays from their buffer; labels go through a list
+    values = np.asarray(values)
+    if values.dtype.kind in "OUS" or orjson is None:
+        return _plain(values)
+    return np.ascontiguousarray(values)